@@ -203,12 +203,36 @@ create or replace stage SEMANTIC_STAGE encryption = (TYPE = 'SNOWFLAKE_SSE') dir
  -- Run the following statement to create a Snowflake managed internal stage to store the csv data files.
  create or replace stage CSV_FILES file_format = csvformat encryption = (TYPE = 'SNOWFLAKE_SSE') directory = ( ENABLE = true );
 
+-- Run the following statement to create a Snowflake managed internal stage to store the Python modules imported by stored procedures.
+create or replace stage CODE_STAGE encryption = (TYPE = 'SNOWFLAKE_SSE') directory = ( ENABLE = true );
+
 -- Conversation History table for storing chat threads and messages
 create or replace TABLE CONVERSATION_HISTORY (
 	CONVERSATION_ID STRING NOT NULL COMMENT 'Unique identifier for each conversation thread',
+	USER_NAME STRING NOT NULL COMMENT 'Streamlit user who started the thread; only they can list and open it',
 	THREAD_NAME STRING NOT NULL COMMENT 'User-friendly name for the conversation thread',
 	CREATED_AT TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP() COMMENT 'Timestamp when the conversation was created',
 	UPDATED_AT TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP() COMMENT 'Timestamp when the conversation was last updated',
 	MESSAGES VARIANT COMMENT 'JSON array of messages in the conversation thread',
 	primary key (CONVERSATION_ID)
-)COMMENT='Storage for conversation history and chat threads for the Supply Chain Assistant';
\ No newline at end of file
+)COMMENT='Storage for conversation history and chat threads for the Supply Chain Assistant';
+
+-- Answer cache table, optionally used by the Supply Chain Assistant to share cached agent answers across sessions
+create or replace TABLE AGENT_ANSWER_CACHE (
+	CACHE_KEY STRING NOT NULL COMMENT 'Hash of the normalized question and the semantic model, search service and inventory data versions',
+	QUESTION STRING COMMENT 'Question text as first asked',
+	RESPONSE VARIANT COMMENT 'Parsed agent response (text, interpretation and tool results)',
+	CREATED_AT TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP() COMMENT 'Timestamp when the answer was cached'
+)COMMENT='Cached Cortex Agent answers for the Supply Chain Assistant';
+
+-- App telemetry table, optionally used by the Supply Chain Assistant to keep timing spans for offline analysis
+create or replace TABLE APP_TELEMETRY (
+	TRACE_ID STRING NOT NULL COMMENT 'Identifier shared by all spans of one user action',
+	SPAN_ID STRING NOT NULL COMMENT 'Unique identifier of the span',
+	PARENT_ID STRING COMMENT 'Span this span ran inside, if any',
+	NAME STRING NOT NULL COMMENT 'Phase name, e.g. snowflake.sql, agent.round_trip or optimizer.solve',
+	START_TIME TIMESTAMP_NTZ COMMENT 'Start of the span in UTC',
+	DURATION_MS FLOAT COMMENT 'Duration of the span in milliseconds',
+	ATTRIBUTES VARCHAR COMMENT 'JSON object of span attributes such as row counts and solver statistics',
+	ERROR STRING COMMENT 'Exception raised inside the span, if any'
+)COMMENT='Timing spans recorded by the Supply Chain Assistant diagnostics panel';
@@ -0,0 +1,154 @@
+"""
+Times every phase of the transfer optimizer on synthetic networks.
+
+Run from the repository root:
+
+    python benchmarks/benchmark_optimizer.py
+    python benchmarks/benchmark_optimizer.py --sizes 1000x10000 5000x50000 --output results.jsonl
+
+Each size is PLANTSxMATERIALS. A network is generated with synthetic_network.py
+and loaded into the local backend, then the same steps as optimize_transfers()
+in the Streamlit app are timed separately:
+
+    data_prep   LOW_EXCESS_QUERY on the network (SQLite, not Snowflake), priced with TransportCostModel
+    build       building the LP of every subproblem (summed over subproblems)
+    solve       solving them (summed over subproblems)
+    optimize    wall time of solve_transfers, i.e. build and solve on the worker pool
+    write       create_dataframe().write.mode("overwrite").save_as_table()
+
+Every run is one JSON object per line with sorted keys, so results from
+different commits can be appended to one file and compared.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit"))
+
+from backends import LocalSession  # noqa: E402
+from solver_engines import SOLVER_ENGINES  # noqa: E402
+from synthetic_network import generate_network, write_network  # noqa: E402
+from transfer_optimizer import LOW_EXCESS_QUERY, solve_transfers  # noqa: E402
+from transport_costs import TransportCostModel  # noqa: E402
+
+DEFAULT_SIZES = ["25x50", "100x1000", "500x5000", "1000x10000"]
+SCHEMA_VERSION = 1  # Bump when the meaning of a field changes
+TRANSFER_ACTIONS_TABLE = "transfer_actions"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_size(num_plants: int, num_materials: int, engine: str, partition_by, executor: str,
+                   repeat: int, seed: int, plants_per_material: float) -> dict:
+    """Runs every phase repeat times on one network and keeps the best time of each phase."""
+    tables = generate_network(num_plants, num_materials, plants_per_material=plants_per_material, seed=seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_network(tables, data_dir)
+        session = LocalSession(data_dir)
+
+    timings = {'data_prep': [], 'build': [], 'solve': [], 'optimize': [], 'write': []}
+    for _ in range(repeat):
+        low_excess_df_pd, seconds = _timed(
+            lambda: TransportCostModel.from_session(session).add_transfer_costs(session.sql(LOW_EXCESS_QUERY).to_pandas()))
+        timings['data_prep'].append(seconds)
+
+        result = solve_transfers(low_excess_df_pd, engine=engine, partition_by=partition_by, executor=executor)
+        stats = result.solver_stats
+        timings['build'].append(stats['build_seconds'])
+        timings['solve'].append(stats['solve_seconds'])
+        timings['optimize'].append(stats['wall_seconds'])
+
+        if result.status == 0 and not result.transfer_actions.empty:
+            _, seconds = _timed(session.create_dataframe(result.transfer_actions).write.mode("overwrite")
+                                .save_as_table, TRANSFER_ACTIONS_TABLE)
+        else:
+            seconds = 0.0
+        timings['write'].append(seconds)
+
+    record = {
+        'plants': num_plants,
+        'materials': num_materials,
+        'plants_per_material': plants_per_material,
+        'seed': seed,
+        'inventory_rows': len(tables['MFG_INVENTORY']),
+        'surcharge_lanes': len(tables['TRANSPORT_COST_SURCHARGE']),
+        'lanes': len(low_excess_df_pd),
+        'engine': engine,
+        'partition_by': partition_by,
+        'executor': executor,
+        'repeat': repeat,
+        'status': int(result.status),
+        'subproblems': stats.get('subproblems'),
+        'variables': stats.get('variables'),
+        'constraints': stats.get('constraints'),
+        'nonzeros': stats.get('nonzeros'),
+        'iterations': stats.get('iterations'),
+    }
+    if result.status == 0:
+        kpis = result.kpis
+        record.update({
+            'transfers': kpis['transfers'],
+            'purchases': kpis['purchases'],
+            'total_spend': round(kpis['total_spend'], 4),
+        })
+    for phase, seconds in timings.items():
+        record[f"{phase}_seconds"] = round(min(seconds), 6)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="PLANTSxMATERIALS network sizes")
+    parser.add_argument("--engines", nargs="+", default=["min_cost_flow"], choices=list(SOLVER_ENGINES))
+    parser.add_argument("--partition-by", default="MATERIAL_ID", help='Column to decompose on, or "none"')
+    parser.add_argument("--executor", default="process", choices=["process", "thread"])
+    parser.add_argument("--plants-per-material", type=float, default=2.0)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per size and engine, the best is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Append the results to this JSON lines file instead of printing them")
+    args = parser.parse_args()
+
+    partition_by = None if args.partition_by.lower() == "none" else args.partition_by
+    run = {
+        'schema_version': SCHEMA_VERSION,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for size in args.sizes:
+            num_plants, num_materials = (int(n) for n in size.lower().split("x"))
+            for engine in args.engines:
+                record = benchmark_size(num_plants, num_materials, engine, partition_by, args.executor,
+                                        args.repeat, args.seed, args.plants_per_material)
+                output.write(json.dumps({**run, **record}, sort_keys=True) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
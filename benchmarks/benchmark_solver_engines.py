@@ -0,0 +1,113 @@
+"""
+Compares the transfer optimizer's solver engines on synthetic networks.
+
+Run from the repository root:
+
+    python benchmarks/benchmark_solver_engines.py
+    python benchmarks/benchmark_solver_engines.py --sizes 50x100 200x500 --repeat 3
+
+Each size is PLANTSxMATERIALS. The synthetic low/excess rows have the same
+columns as LOW_EXCESS_QUERY in transfer_optimizer.py.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit"))
+
+from transfer_optimizer import build_transfer_model, solve_transfer_model  # noqa: E402
+from solver_engines import SOLVER_ENGINES  # noqa: E402
+
+DEFAULT_SIZES = ["10x20", "25x50", "50x100", "100x200", "200x400"]
+
+
+def synthetic_low_excess(num_plants: int, num_materials: int, low_share: float = 0.2,
+                         excess_share: float = 0.2, seed: int = 0) -> pd.DataFrame:
+    """
+    Low/excess rows for a random network. Every plant stocks every material; a
+    share of the (plant, material) positions is low and another share is in
+    excess, and every low position can be served from every excess position of
+    the same material.
+    """
+    rng = np.random.default_rng(seed)
+    plant_ids = np.arange(1001, 1001 + num_plants)
+    material_ids = np.arange(101, 101 + num_materials)
+    material_cost = np.round(rng.uniform(2, 200, num_materials), 2)
+
+    state = rng.random((num_plants, num_materials))
+    low_plant, low_material = np.nonzero(state < low_share)
+    excess_plant, excess_material = np.nonzero(state > 1 - excess_share)
+    low = pd.DataFrame({
+        'LOW_PLANT_ID': plant_ids[low_plant],
+        'MATERIAL_ID': material_ids[low_material],
+        'UNITS_NEEDED': rng.integers(50, 1500, len(low_plant)),
+        'MATERIAL_COST': material_cost[low_material],
+    })
+    excess = pd.DataFrame({
+        'EXCESS_PLANT_ID': plant_ids[excess_plant],
+        'MATERIAL_ID': material_ids[excess_material],
+        'AVAILABLE_TO_TRANSFER': rng.integers(50, 2000, len(excess_plant)),
+    })
+
+    lanes = low.merge(excess, on='MATERIAL_ID')
+    lanes = lanes[lanes['LOW_PLANT_ID'] != lanes['EXCESS_PLANT_ID']]
+    # Surcharges like TRANSPORT_COST_SURCHARGE, with 1.5 for missing lanes
+    surcharge = rng.choice([0.8, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0, 3.6], len(lanes))
+    lanes = lanes.assign(TRANSFER_COST_PER_UNIT=lanes['MATERIAL_COST'] * 0.3 * surcharge)
+    return lanes.reset_index(drop=True)
+
+
+def benchmark(sizes, engines, repeat: int, seed: int):
+    rows = []
+    for size in sizes:
+        num_plants, num_materials = (int(n) for n in size.lower().split("x"))
+        low_excess_df_pd = synthetic_low_excess(num_plants, num_materials, seed=seed)
+        model = build_transfer_model(low_excess_df_pd)
+
+        objectives = {}
+        for engine in engines:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = solve_transfer_model(model, engine)
+                timings.append(time.perf_counter() - start)
+            objectives[engine] = result.fun
+            rows.append({
+                'plants': num_plants,
+                'materials': num_materials,
+                'lanes': len(low_excess_df_pd),
+                'variables': model.num_vars,
+                'engine': engine,
+                'status': result.status,
+                'objective': result.fun,
+                'iterations': result.nit,
+                'best_seconds': min(timings),
+            })
+
+        # Both engines solve the same LP, so the optimal cost must agree
+        reference = objectives[engines[0]]
+        for engine, objective in objectives.items():
+            if not np.isclose(objective, reference, rtol=1e-7):
+                print(f"WARNING: {engine} objective {objective} differs from {engines[0]} {reference} "
+                      f"at {size}", file=sys.stderr)
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="PLANTSxMATERIALS network sizes")
+    parser.add_argument("--engines", nargs="+", default=list(SOLVER_ENGINES), choices=list(SOLVER_ENGINES))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per engine and size, the best is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.engines, args.repeat, args.seed)
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+Generates synthetic supply chain networks shaped like the shipped data/*.csv.
+
+Run from the repository root to write a network as CSV files that the local
+backend (streamlit/backends.py) can load:
+
+    python benchmarks/synthetic_network.py --plants 1000 --materials 10000 --out /tmp/network
+
+The tables have the same columns as MFG_PLANT, RAW_MATERIAL, MFG_INVENTORY and
+TRANSPORT_COST_SURCHARGE. As in the shipped data, plants and materials belong
+to one of four business lines, each material is stocked at a few plants of its
+business line, and every stocked position is either low, normal or in excess
+relative to its safety stock level.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+BUSINESS_LINES = np.array(["AEROSPACE", "INDUSTRIAL", "BUILDINGS", "ENERGY"])
+LAST_UPDATED_TIMESTAMP = "2024-12-20T09:27:34.709Z"
+
+# Share of stocked positions per state, and their QUANTITY_ON_HAND / SAFETY_STOCK_LEVEL ranges
+STOCK_STATES = {
+    'low': (0.3, (0.3, 0.95)),
+    'normal': (0.4, (1.0, 3.0)),
+    'excess': (0.3, (3.1, 8.0)),
+}
+
+
+def generate_network(num_plants: int, num_materials: int, plants_per_material: float = 2.0,
+                     max_lanes_per_plant: int = 50, seed: int = 0) -> dict:
+    """
+    Generates a consistent network.
+
+    Args:
+        num_plants: Number of manufacturing plants.
+        num_materials: Number of raw materials.
+        plants_per_material: Average number of plants stocking each material
+            (at least one, at most the plants of the material's business line).
+        max_lanes_per_plant: Surcharges are generated towards this many nearest
+            plants per plant; the optimizer prices other lanes with the default
+            surcharge. Networks this small or smaller get every lane, like the
+            shipped data.
+        seed: Random seed, the same seed always produces the same network.
+
+    Returns:
+        Dict of DataFrames keyed by table name (MFG_PLANT, RAW_MATERIAL,
+        MFG_INVENTORY, TRANSPORT_COST_SURCHARGE).
+    """
+    rng = np.random.default_rng(seed)
+    plants = _plants(rng, num_plants)
+    materials = _materials(rng, num_materials)
+    return {
+        'MFG_PLANT': plants,
+        'RAW_MATERIAL': materials,
+        'MFG_INVENTORY': _inventory(rng, plants, materials, plants_per_material),
+        'TRANSPORT_COST_SURCHARGE': _surcharges(rng, plants, max_lanes_per_plant),
+    }
+
+
+def _plants(rng, num_plants):
+    plant_ids = np.arange(1001, 1001 + num_plants)
+    business_line = BUSINESS_LINES[np.arange(num_plants) % len(BUSINESS_LINES)]
+    return pd.DataFrame({
+        'MFG_PLANT_ID': plant_ids,
+        'MFG_PLANT_NAME': [f"Plant {plant_id} {line.title()} Manufacturing"
+                           for plant_id, line in zip(plant_ids, business_line)],
+        'ADDRESS': [f"{number} Industrial Way" for number in rng.integers(100, 9999, num_plants)],
+        'CITY': [f"City {plant_id}" for plant_id in plant_ids],
+        'STATE': "TX",
+        'COUNTRY': "USA",
+        'ZIP_CODE': rng.integers(10000, 99999, num_plants),
+        # Continental US
+        'LATITUDE': np.round(rng.uniform(25.5, 48.5, num_plants), 4),
+        'LONGITUDE': np.round(rng.uniform(-123.0, -70.5, num_plants), 4),
+        'PLANT_MANAGER_CONTACT_ID': plant_ids + 9000,
+        'SQUARE_FOOTAGE': np.round(rng.uniform(245000, 800000, num_plants), -3),
+        'NUMBER_OF_EMPLOYEES': rng.integers(350, 1600, num_plants),
+        'IS_ACTIVE': True,
+        'BUSINESS_LINE': business_line,
+    })
+
+
+def _materials(rng, num_materials):
+    material_ids = np.arange(101, 101 + num_materials)
+    business_line = BUSINESS_LINES[np.arange(num_materials) % len(BUSINESS_LINES)]
+    # Costs are heavy-tailed like the shipped data: mostly a few dollars, some in the hundreds
+    material_cost = np.round(np.exp(rng.normal(2.5, 1.1, num_materials)).clip(1.5, 400), 2)
+    return pd.DataFrame({
+        'MATERIAL_ID': material_ids,
+        'MATERIAL_NAME': [f"Material {material_id}" for material_id in material_ids],
+        'MATERIAL_DESCRIPTION': [f"Synthetic {line.lower()} raw material" for line in business_line],
+        'SUPPLIER_ID': 9001 + np.arange(num_materials) % 20,
+        'MATERIAL_COST': material_cost,
+        'PLANT_TRANSPORT_COST': np.round(material_cost * rng.uniform(0.1, 0.3, num_materials), 2),
+        'BUSINESS_LINE': business_line,
+    })
+
+
+def _inventory(rng, plants, materials, plants_per_material):
+    plant_lines = plants['BUSINESS_LINE'].to_numpy()
+    material_lines = materials['BUSINESS_LINE'].to_numpy()
+
+    plant_ids, material_ids = [], []
+    for line in BUSINESS_LINES:
+        line_plants = plants['MFG_PLANT_ID'].to_numpy()[plant_lines == line]
+        line_materials = materials['MATERIAL_ID'].to_numpy()[material_lines == line]
+        if len(line_plants) == 0 or len(line_materials) == 0:
+            continue
+        counts = np.minimum(1 + rng.poisson(max(plants_per_material - 1, 0), len(line_materials)), len(line_plants))
+        for material_id, count in zip(line_materials, counts):
+            plant_ids.append(rng.choice(line_plants, count, replace=False))
+            material_ids.append(np.full(count, material_id))
+
+    plant_ids = np.concatenate(plant_ids)
+    material_ids = np.concatenate(material_ids)
+    num_rows = len(plant_ids)
+
+    shares = np.array([share for share, _ in STOCK_STATES.values()])
+    state = rng.choice(len(STOCK_STATES), num_rows, p=shares / shares.sum())
+    ranges = np.array([bounds for _, bounds in STOCK_STATES.values()])
+    ratio = rng.uniform(ranges[state, 0], ranges[state, 1])
+
+    safety_stock = rng.integers(100, 2500, num_rows)
+    lead_time = rng.integers(7, 25, num_rows)
+    variability = rng.integers(2, 6, num_rows)
+    # Coverage follows the stock level, so low positions are also short on coverage
+    coverage = np.where(state == 0, rng.integers(1, 6, num_rows) + lead_time // 2,
+                        np.where(state == 2, 2 * lead_time + rng.integers(1, 30, num_rows),
+                                 lead_time + rng.integers(0, 20, num_rows)))
+
+    return pd.DataFrame({
+        'MFG_PLANT_ID': plant_ids,
+        'MATERIAL_ID': material_ids,
+        'COMPONENT_ID': pd.array([pd.NA] * num_rows, dtype="Int64"),
+        'PRODUCT_ID': pd.array([pd.NA] * num_rows, dtype="Int64"),
+        'QUANTITY_ON_HAND': np.round(safety_stock * ratio).astype(int),
+        'QUANTITY_ON_ORDER': rng.integers(0, 1000, num_rows),
+        'SAFETY_STOCK_LEVEL': safety_stock,
+        'REPLENISHMENT_POINT': np.round(safety_stock * 1.8).astype(int),
+        'LAST_UPDATED_TIMESTAMP': LAST_UPDATED_TIMESTAMP,
+        'MATERIAL_LEAD_TIME': lead_time,
+        'DAYS_FORWARD_COVERAGE': coverage,
+        'LEAD_TIME_VARIABILITY': variability,
+    })
+
+
+def _surcharges(rng, plants, max_lanes_per_plant):
+    num_plants = len(plants)
+    plant_ids = plants['MFG_PLANT_ID'].to_numpy()
+    lanes = min(max_lanes_per_plant, num_plants - 1)
+    if lanes <= 0:
+        return pd.DataFrame(columns=['SOURCE_FACILITY_ID', 'DESTINATION_FACILITY_ID', 'TRANSPORT_COST_SURCHARGE'])
+
+    if lanes == num_plants - 1:
+        source, destination = np.nonzero(~np.eye(num_plants, dtype=bool))
+    else:
+        points = plants[['LATITUDE', 'LONGITUDE']].to_numpy()
+        _, neighbours = cKDTree(points).query(points, k=lanes + 1)
+        source = np.repeat(np.arange(num_plants), lanes)
+        destination = neighbours[:, 1:].ravel()  # The first neighbour is the plant itself
+
+    return pd.DataFrame({
+        'SOURCE_FACILITY_ID': plant_ids[source],
+        'DESTINATION_FACILITY_ID': plant_ids[destination],
+        'TRANSPORT_COST_SURCHARGE': np.round(rng.uniform(1.05, 1.58, len(source)), 2),
+    })
+
+
+def write_network(tables: dict, out_dir: str):
+    """Writes the tables as <table>.csv files, the layout of data/."""
+    os.makedirs(out_dir, exist_ok=True)
+    for name, table in tables.items():
+        table.to_csv(os.path.join(out_dir, f"{name.lower()}.csv"), index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plants", type=int, default=100)
+    parser.add_argument("--materials", type=int, default=1000)
+    parser.add_argument("--plants-per-material", type=float, default=2.0)
+    parser.add_argument("--max-lanes-per-plant", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True, help="Directory for the CSV files")
+    args = parser.parse_args()
+
+    tables = generate_network(args.plants, args.materials, args.plants_per_material, args.max_lanes_per_plant,
+                              args.seed)
+    write_network(tables, args.out)
+    for name, table in tables.items():
+        print(f"{name}: {len(table):,} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,117 @@
+import time
+
+SCRIPT_START = time.perf_counter()  # Start of this script run, imports included, for the time to first paint
+
 import streamlit as st
 import json
-import _snowflake
-from snowflake.snowpark.context import get_active_session
 from abc import ABC, abstractmethod
-from scipy.optimize import linprog  # For linear programming
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import uuid
-import numpy as np
-
-session = get_active_session()
+from agent_events import AgentResponseParser, parse_agent_response
+from answer_cache import AnswerCache
+from backends import get_backend
+from batch_assistant import run_question_batch
+from conversation_store import ConversationStore
+from query_router import VerifiedQueryRouter, load_verified_queries
+from sql_executor import execute_bounded, sql_hash
+from tracing import Tracer, activate, current_tracer, traced
+from transport_costs import SURCHARGE_VERSION_QUERY, TransportCostModel
 
 API_ENDPOINT = "/api/v2/cortex/agent:run"
 API_TIMEOUT = 50000  # in milliseconds
+STREAM_RENDER_INTERVAL = 0.05  # in seconds, minimum time between chat re-renders while streaming
 
 CORTEX_SEARCH_SERVICES = "SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.SUPPLY_CHAIN_INFO"
 SEMANTIC_MODELS = "@SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.semantic_stage/supply_chain_network.yaml"
 
+OPTIMIZER_PARTITION_BY = "MATERIAL_ID"  # or "BUSINESS_LINE" for fewer, larger subproblems
+OPTIMIZER_ENGINE = "min_cost_flow"  # or "highs" to solve every subproblem as a generic LP
+# Pool for the subproblems and the scenario sweep. Streamlit in Snowflake, like the stored
+# procedure, cannot reliably start worker processes; "process" only pays off when run locally.
+OPTIMIZER_EXECUTOR = "thread"
+
+TRANSFER_ACTIONS_TABLE = "supply_chain_network_optimization_db.entities.transfer_actions"
+
+# Shadow prices and lane reduced costs of the plan, for what-if answers from a single solve.
+# They come from HiGHS, so with this on the min-cost-flow engine is not used.
+OPTIMIZER_SENSITIVITY = False
+TRANSFER_SENSITIVITY_TABLE = "supply_chain_network_optimization_db.entities.transfer_sensitivity"
+
+# Incremental re-optimization only re-solves materials whose MFG_INVENTORY rows changed since the last plan
+OPTIMIZER_INCREMENTAL = True
+# Session-scoped temporary tables the changed actions are merged from
+TRANSFER_ACTIONS_STAGING_TABLE = "supply_chain_network_optimization_db.entities.transfer_actions_staging"
+CHANGED_MATERIALS_TABLE = "supply_chain_network_optimization_db.entities.transfer_actions_changed_materials"
+
+# The optimizer can also run next to the data as a stored procedure, see tools/tool_DDL.sql
+OPTIMIZER_PROCEDURE = "supply_chain_network_optimization_db.entities.optimize_transfers_sp"
+OPTIMIZE_IN_WAREHOUSE = False  # default of the page toggle, the procedure has to be created first
+OPTIMIZER_POLL_INTERVAL = 0.5  # in seconds, how often a running procedure is checked
+
+# What-if scenarios offered on the Optimization page; planners can edit and add rows
+DEFAULT_SCENARIOS = [
+    {'Scenario': "Base", 'Surcharge multiplier': 1.0, 'Safety stock multiplier': 1.0,
+     'Material cost multiplier': 1.0, 'Offline plants': ""},
+    {'Scenario': "Transport surcharge +20%", 'Surcharge multiplier': 1.2, 'Safety stock multiplier': 1.0,
+     'Material cost multiplier': 1.0, 'Offline plants': ""},
+    {'Scenario': "Safety stock doubled", 'Surcharge multiplier': 1.0, 'Safety stock multiplier': 2.0,
+     'Material cost multiplier': 1.0, 'Offline plants': ""},
+]
+SCENARIO_MAX_WORKERS = None  # workers solving scenarios concurrently, defaults to the number of CPUs
+
+# Open orders can be exploded through BILL_OF_MATERIALS and netted from the inventory the optimizer sees
+NET_OPEN_ORDERS = False  # default of the page toggle
+
+# Transfer lanes near severe forecast weather can be penalized or excluded, see weather_risk.py
+WEATHER_AWARE_LANES = False  # default of the page toggle
+WEATHER_CACHE_TTL = 3600  # in seconds, forecasts are re-read at most this often
+
+# Rolling-horizon replenishment plan offered on the Optimization page
+PLANNING_BUCKET = "Weekly"  # or "Daily"
+PLANNING_HORIZON = 8  # buckets every window looks ahead
+PLANNING_PERIODS = 12  # buckets orders are committed for
+
+# Chat threads are persisted in CONVERSATION_HISTORY and loaded a page at a time
+CONVERSATION_HISTORY_TABLE = "supply_chain_network_optimization_db.entities.conversation_history"
+CONVERSATION_PAGE_SIZE = 20  # messages loaded and rendered per page
+CONVERSATION_THREADS_SHOWN = 20  # most recent threads offered in the sidebar
+
+# Agent answers are cached per normalized question and knowledge version
+ANSWER_CACHE_TTL = 3600  # in seconds
+ANSWER_CACHE_MAX_ENTRIES = 256
+ANSWER_CACHE_TABLE = None  # e.g. "supply_chain_network_optimization_db.entities.agent_answer_cache" to share answers across sessions
+
+# Batch mode answers a checklist of questions concurrently
+BATCH_MAX_WORKERS = 4  # concurrent agent requests, and concurrent SQL statements
+BATCH_QUESTION_TIMEOUT = 120  # in seconds, per question
+
+# Questions that closely match a verified query of the semantic model skip the agent
+ROUTE_VERIFIED_QUERIES = True
+
+# Agent-generated SQL runs with a row cap and a statement timeout
+GENERATED_SQL_MAX_ROWS = 10000
+GENERATED_SQL_TIMEOUT = 60  # in seconds
+
+# Timing spans are shown in the Diagnostics sidebar panel
+TELEMETRY_TABLE = None  # e.g. "supply_chain_network_optimization_db.entities.app_telemetry" to keep spans for offline analysis
+
+# Query results are cached per query text and inventory data version
+DATA_VERSION_QUERY = "SELECT MAX(LAST_UPDATED_TIMESTAMP) FROM supply_chain_network_optimization_db.entities.mfg_inventory"
+DATA_VERSION_TTL = 60  # in seconds, how often the data version is re-checked
+QUERY_CACHE_TTL = 3600  # in seconds
+QUERY_CACHE_MAX_ENTRIES = 32
+
+
+@st.cache_resource
+def load_backend():
+    # Snowflake in production; SUPPLY_CHAIN_BACKEND=local runs on data/*.csv with canned agent answers
+    return get_backend(api_endpoint=API_ENDPOINT, api_timeout=API_TIMEOUT)
+
+# Created on the first run only; later reruns reuse the same backend and session
+backend = load_backend()
+session = backend.session
+
 # Page settings
 st.set_page_config(
     page_title="Supply Chain Assistant",
@@ -226,7 +322,14 @@ def set_default_sidebar():
             set_page('Welcome')
             st.rerun()
 
+def get_tracer():
+    # One tracer per user session; main() activates it for every rerun
+    if 'tracer' not in st.session_state:
+        st.session_state.tracer = Tracer()
+    return st.session_state.tracer
+
 def run_snowflake_query(query):
+    # Snowpark DataFrames are lazy: the query runs, and is traced, where the caller collects it
     try:
         df = session.sql(query.replace(';',''))
         
@@ -236,9 +339,118 @@ def run_snowflake_query(query):
         st.error(f"Error executing SQL: {str(e)}")
         return None, None
 
-def snowflake_api_call(query: str, limit: int = 10):
-    
-    payload = {
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def get_data_version():
+    """Latest MFG_INVENTORY update timestamp, used to invalidate cached query results."""
+    return str(session.sql(DATA_VERSION_QUERY).collect()[0][0])
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def get_surcharge_version():
+    """Hash of the TRANSPORT_COST_SURCHARGE rows, used to rebuild the transport cost model."""
+    return str(session.sql(SURCHARGE_VERSION_QUERY).collect()[0][0])
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_query(query: str, data_version: str):
+    # data_version is only part of the cache key: new inventory data means a new entry
+    with current_tracer().span("snowflake.to_pandas") as span:
+        df = session.sql(query.replace(';','')).to_pandas()
+        span.set(rows=len(df), bytes=int(df.memory_usage(deep=True).sum()))
+    return df
+
+def run_generated_sql(sql):
+    """
+    Runs agent-generated SQL with a row cap and a statement timeout. Results
+    are kept for the session, keyed by the SQL hash, so reruns and repeated
+    answers do not execute the statement again. Failed statements are not kept.
+    """
+    results = st.session_state.setdefault('generated_sql_results', {})
+    key = sql_hash(sql)
+    if key not in results:
+        result = execute_bounded(session, sql, max_rows=GENERATED_SQL_MAX_ROWS,
+                                 timeout_seconds=GENERATED_SQL_TIMEOUT)
+        if result.error:
+            return result
+        results[key] = result
+    return results[key]
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def get_semantic_model_version():
+    """MD5 of the semantic model file on its stage."""
+    try:
+        return session.sql(f"LIST {SEMANTIC_MODELS}").collect()[0].as_dict()['md5']
+    except Exception:
+        return SEMANTIC_MODELS
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def get_knowledge_version():
+    """
+    Versions of everything an agent answer depends on: the semantic model file
+    (its stage MD5), the search service (its data timestamp) and the inventory data.
+    """
+    semantic_model = get_semantic_model_version()
+    try:
+        database, schema, name = CORTEX_SEARCH_SERVICES.split(".")
+        service = session.sql(f"SHOW CORTEX SEARCH SERVICES LIKE '{name}' IN SCHEMA {database}.{schema}").collect()[0].as_dict()
+        search_service = str(service.get('data_timestamp') or service.get('created_on'))
+    except Exception:
+        search_service = CORTEX_SEARCH_SERVICES
+    return f"{semantic_model}|{search_service}|{get_data_version()}"
+
+@st.cache_resource
+def get_answer_cache():
+    return AnswerCache(max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL,
+                       session=session, table=ANSWER_CACHE_TABLE)
+
+@st.cache_resource(show_spinner=False)
+def get_query_router(semantic_model_version: str):
+    """
+    Index over the semantic model's verified queries, built once per semantic
+    model version. Without a readable model the router never matches.
+    """
+    try:
+        with session.file.get_stream(SEMANTIC_MODELS) as stream:
+            verified_queries = load_verified_queries(stream.read().decode("utf-8"))
+    except Exception as e:
+        st.warning(f"Verified queries unavailable, every question goes to the agent: {str(e)}")
+        verified_queries = []
+    return VerifiedQueryRouter(verified_queries)
+
+def get_user_name() -> str:
+    """The viewer of the app; conversation threads belong to the user who started them."""
+    user = st.user if hasattr(st, "user") else st.experimental_user
+    return user.get("user_name") or user.get("email") or "anonymous"
+
+def get_conversation_store():
+    # One store per user session, so buffered messages never mix between users
+    if 'conversation_store' not in st.session_state:
+        st.session_state.conversation_store = ConversationStore(session, CONVERSATION_HISTORY_TABLE, get_user_name())
+    return st.session_state.conversation_store
+
+@st.cache_data(ttl=DATA_VERSION_TTL, show_spinner=False)
+def list_conversation_threads(user_name: str):
+    # user_name is only the cache key, so every user gets their own list
+    try:
+        return get_conversation_store().list_threads(CONVERSATION_THREADS_SHOWN)
+    except Exception as e:
+        st.error(f"Error loading conversations: {str(e)}")
+        return []
+
+@traced("query.cached")
+def run_cached_query(query):
+    """
+    Runs a query and returns its result as a pandas DataFrame, cached per query
+    text and inventory data version. Entries expire after QUERY_CACHE_TTL seconds
+    and at most QUERY_CACHE_MAX_ENTRIES results are kept.
+    """
+    try:
+        return _cached_query(query, get_data_version())
+
+    except Exception as e:
+        st.error(f"Error executing SQL: {str(e)}")
+        return None
+
+def build_agent_payload(query: str, limit: int = 10):
+    return {
         "model": "claude-3-5-sonnet",
         "messages": [
             {
@@ -274,307 +486,543 @@ def snowflake_api_call(query: str, limit: int = 10):
         },
         "response-instruction": "You will always maintain a friendly tone and provide a concise response. Don't say things like 'According to the information provided'"
     }
-    
-    try:
-        resp = _snowflake.send_snow_api_request(
-            "POST",  # method
-            API_ENDPOINT,  # path
-            {},  # headers
-            {},  # params
-            payload,  # body
-            None,  # request_guid
-            API_TIMEOUT,  # timeout in milliseconds,
-        )
-        try:
-            response_content = json.loads(resp["content"])
-        except json.JSONDecodeError:
-            st.error("❌ Failed to parse API response. The server may have returned an invalid JSON format.")
 
-            if resp["status"] != 200:
-                st.error(f"Error:{resp} ") # instead of st.error(f"Error:{resp['status']} ")
-            return None
-            
-        return response_content
+@traced("agent.request")
+def request_agent_events(query: str, limit: int = 10):
+    """Blocking agent request. Errors are raised, so worker threads can call it without a script run context."""
+    return backend.agent_request(build_agent_payload(query, limit))
+
+def snowflake_api_call(query: str, limit: int = 10):
+    try:
+        return request_agent_events(query, limit)
             
     except Exception as e:
         st.error(f"Error making request: {str(e)}")
         return None
 
+def stream_agent_events(query: str, limit: int = 10, raise_errors: bool = False):
+    """
+    Yields Cortex Agent events as they arrive.
+
+    When streaming is unavailable (no requests package or no direct network
+    access to the account) this falls back to the blocking snowflake_api_call
+    and yields its events, so callers handle both paths the same way. A
+    request that reached the API is never sent again. With raise_errors a
+    failed request raises instead of calling st.error, for callers on worker
+    threads.
+    """
+    payload = build_agent_payload(query, limit)
+    # Generators are resumed by the caller, so the span is recorded at the end instead of held open
+    start = time.perf_counter()
+    try:
+        events = backend.agent_stream(payload)
+        first = next(events, None) if events is not None else None
+    except Exception as e:
+        if raise_errors:
+            raise
+        st.error(f"Error making request: {str(e)}")
+        return
+    if events is None:
+        fallback = request_agent_events if raise_errors else snowflake_api_call
+        yield from fallback(query, limit) or []
+        return
+
+    first_event_seconds = time.perf_counter() - start
+    count = 0
+    if first is not None:
+        count += 1
+        yield first
+        for event in events:
+            count += 1
+            yield event
+    current_tracer().record("agent.stream", time.perf_counter() - start,
+                            first_event_seconds=first_event_seconds, events=count)
+
+@traced("agent.parse")
 def process_sse_response(response):
-    """Process SSE response"""
-    text = ""
-    sql = ""
-    interpretation = ""
-    citation = ""
-    
+    """Process SSE response into an AgentResponse"""
+    parser = AgentResponseParser()
+
     if not response:
-        return text, sql, interpretation, citation
-        
+        return parser.response
+
     try:
         for event in response:
-            if event.get('event') == "message.delta":
-                data = event.get('data', {})
-                delta = data.get('delta', {})
-                
-                for content_item in delta.get('content', []):
-                    content_type = content_item.get('type')
-                    if content_type == "tool_results":
-                        tool_results = content_item.get('tool_results', {})
-                        if 'content' in tool_results:
-                            for result in tool_results['content']:
-                                if result.get('type') == 'json':
-                                    interpretation += result.get('json', {}).get('text', '')
-                                    search_results = result.get('json', {}).get('searchResults', [])
-                                    for search_result in search_results:
-                                        citation += f"\n• {search_result.get('text', '')}"
-                                    sql = result.get('json', {}).get('sql', '')
-                    if content_type == 'text':
-                        text += content_item.get('text', '')
-                            
-    except json.JSONDecodeError as e:
-        st.error(f"Error processing events: {str(e)}")
-                
+            parser.feed(event)
+
     except Exception as e:
         st.error(f"Error processing events: {str(e)}")
-        
-    return text, sql, interpretation, citation
-
-low_excess_query = """
-    WITH low_inventory AS (
-        SELECT
-            l.mfg_plant_id AS low_plant_id,
-            mp.mfg_plant_name AS low_plant_name,  -- Keep names for reporting
-            l.material_id,
-            rm.material_name,
-            l.quantity_on_hand AS low_qty,
-            l.safety_stock_level,
-            rm.material_cost,
-            l.safety_stock_level * 2 AS low_replenishment_point,
-            (low_replenishment_point - l.quantity_on_hand) AS units_needed
-        FROM
-            supply_chain_network_optimization_db.entities.mfg_inventory AS l
-        JOIN supply_chain_network_optimization_db.entities.mfg_plant AS mp ON l.mfg_plant_id = mp.mfg_plant_id
-        JOIN supply_chain_network_optimization_db.entities.raw_material AS rm ON l.material_id = rm.material_id
-        WHERE l.quantity_on_hand < l.safety_stock_level
-        AND l.days_forward_coverage <= l.material_lead_time + l.lead_time_variability
-    ), excess_inventory AS (
-        SELECT
-            e.mfg_plant_id AS excess_plant_id,
-            mp.mfg_plant_name AS excess_plant_name,  -- Keep names for reporting
-            e.material_id,
-            e.quantity_on_hand AS excess_qty,
-            e.safety_stock_level,
-            e.safety_stock_level * 2 AS excess_replenishment_point,
-            (e.quantity_on_hand - excess_replenishment_point) AS available_to_transfer
-        FROM
-            supply_chain_network_optimization_db.entities.mfg_inventory AS e
-        JOIN supply_chain_network_optimization_db.entities.mfg_plant AS mp ON e.mfg_plant_id = mp.mfg_plant_id
-        WHERE e.quantity_on_hand > 3 * e.safety_stock_level
-        AND e.days_forward_coverage > 2 * e.material_lead_time
-    )
-    SELECT
-        l.low_plant_id,
-        l.low_plant_name,
-        l.material_id,
-        l.material_name,
-        l.units_needed,
-        l.material_cost,
-        e.excess_plant_id,
-        e.excess_plant_name,
-        e.available_to_transfer,
-        (l.material_cost * 0.3 * COALESCE(tcs.transport_cost_surcharge, 1.5)) AS transfer_cost_per_unit
-    FROM
-        low_inventory AS l
-    LEFT JOIN excess_inventory AS e ON l.material_id = e.material_id
-    LEFT JOIN supply_chain_network_optimization_db.entities.transport_cost_surcharge AS tcs
-        ON e.excess_plant_id = tcs.source_facility_id AND l.low_plant_id = tcs.destination_facility_id
-    WHERE e.available_to_transfer > 0  AND l.units_needed > 0 -- Ensure positive transfer amounts
-    ORDER BY
-        l.low_plant_name,
-        l.material_name;
-    """
 
-low_excess_df = run_snowflake_query(low_excess_query)
+    return parser.response
 
+def run_checklist(questions):
+    """
+    Answers a list of questions concurrently and runs their SQL, bounded like
+    single answers. Cached answers are reused and new ones are cached.
+    """
+    # Resolve everything that needs the script run context before the worker threads start.
+    # The workers raise instead of calling st.error; the batch reports their errors per question.
+    knowledge_version = get_knowledge_version()
+    answer_cache = get_answer_cache()
+
+    def ask(question):
+        response = answer_cache.get(question, knowledge_version)
+        if response is None:
+            response = parse_agent_response(stream_agent_events(question, 1, raise_errors=True))
+            if response.text or response.tool_results:
+                answer_cache.put(question, knowledge_version, response)
+        return response
+
+    def run_sql(sql):
+        return execute_bounded(session, sql, max_rows=GENERATED_SQL_MAX_ROWS, timeout_seconds=GENERATED_SQL_TIMEOUT)
+
+    return run_question_batch(questions, ask, run_sql, max_workers=BATCH_MAX_WORKERS,
+                              timeout_seconds=BATCH_QUESTION_TIMEOUT)
+
+@st.cache_resource(show_spinner="Loading the optimizer...")
+def load_optimizer():
+    """
+    Imports transfer_optimizer, and with it scipy, the first time the
+    Optimization page needs it instead of on every cold start.
+    """
+    with current_tracer().span("optimizer.import"):
+        import transfer_optimizer
+    return transfer_optimizer
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _transport_cost_model(surcharge_version: str):
+    # surcharge_version is only part of the cache key: the surcharge table is read again once it changes
+    with current_tracer().span("transport_costs.load") as span:
+        model = TransportCostModel.from_session(session, surcharge_version)
+        span.set(plants=len(model.plant_ids))
+    return model
+
+def get_transport_costs():
+    """Surcharge matrix shared by the optimizer, the scenario sweep and the replenishment planner."""
+    return _transport_cost_model(get_surcharge_version())
+
+def get_low_excess():
+    """The cached result of LOW_EXCESS_QUERY, priced with the shared transport cost model."""
+    low_excess_df = run_cached_query(load_optimizer().LOW_EXCESS_QUERY)
+    if low_excess_df is None:
+        return None
+    try:
+        return get_transport_costs().add_transfer_costs(low_excess_df)
+    except Exception as e:
+        st.error(f"Error pricing transfer lanes: {str(e)}")
+        return None
 
-def optimize_transfers():
+@st.cache_resource(show_spinner=False)
+def load_scenarios():
+    # Imports the optimizer as well, so it is only loaded once scenarios are compared
+    with current_tracer().span("scenarios.import"):
+        import scenarios
+    return scenarios
+
+@st.cache_resource(show_spinner=False)
+def load_sensitivity_report():
+    # Imports the optimizer as well, so it is only loaded once a plan has sensitivity data
+    with current_tracer().span("sensitivity.import"):
+        from sensitivity import SensitivityReport
+    return SensitivityReport
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=1, show_spinner=False)
+def get_scenario_base_data(data_version: str, surcharge_version: str):
+    # data_version is only part of the cache key: every sweep on the same data reuses one fetch
+    with current_tracer().span("scenarios.fetch_base_data"):
+        return load_scenarios().fetch_base_data(session, _transport_cost_model(surcharge_version))
+
+@st.cache_resource(show_spinner=False)
+def load_bom_engine():
+    with current_tracer().span("bom.import"):
+        import bom_engine
+    return bom_engine
+
+@st.cache_data(ttl=QUERY_CACHE_TTL, max_entries=1, show_spinner=False)
+def get_order_requirements(data_version: str):
     """
-    Optimizes material transfers between plants with low and excess inventory.
+    Raw material units per plant committed to open orders. The BOM is compiled
+    once per data version and the orders are exploded in one sparse product.
+    """
+    bom_engine = load_bom_engine()
+    tracer = current_tracer()
+    with tracer.span("bom.compile") as span:
+        bom = bom_engine.compile_bom(session.sql(bom_engine.BOM_QUERY).to_pandas())
+        span.set(products=len(bom.products), materials=len(bom.materials), levels=bom.levels)
+    demand = session.sql(bom_engine.OPEN_ORDER_DEMAND_QUERY).to_pandas()
+    with tracer.span("bom.explode", order_lines=len(demand)):
+        return bom_engine.explode_requirements(bom, demand)
+
+@st.cache_resource(show_spinner=False)
+def load_weather_risk():
+    with current_tracer().span("weather.import"):
+        import weather_risk
+    return weather_risk
+
+@st.cache_resource(show_spinner=False)
+def get_weather_index():
+    """Nearest-city index over the forecast cities, built once and shared by all sessions."""
+    weather_risk = load_weather_risk()
+    with current_tracer().span("weather.index"):
+        return weather_risk.WeatherIndex(session.sql(weather_risk.FORECAST_CITY_QUERY).to_pandas())
+
+@st.cache_data(ttl=WEATHER_CACHE_TTL, show_spinner=False)
+def get_lane_risk():
+    # Only the forecast is re-read; the index is reused
+    weather_risk = load_weather_risk()
+    index = get_weather_index()
+    with current_tracer().span("weather.assess", cities=len(index)):
+        return weather_risk.assess_lane_risk(index, session.sql(weather_risk.PLANT_LOCATION_QUERY).to_pandas(),
+                                             session.sql(weather_risk.FORECAST_QUERY).to_pandas())
+
+def apply_weather_risk(low_excess_df):
+    """Low/excess rows with an OBJECTIVE_COST_PER_UNIT raised, or lanes excluded, by their disruption risk."""
+    try:
+        return load_weather_risk().apply_lane_risk(low_excess_df, get_lane_risk())
+    except Exception as e:
+        st.error(f"Error assessing weather risk: {str(e)}")
+        return None
 
-    This function:
-    1. Executes a modified version of the provided SQL query to get
-       low/excess inventory data, including transport cost multipliers.
-    2. Formulates and solves a linear programming problem to minimize
-       total transfer costs.
-    3. Inserts the optimal transfer actions into a 'transfer_actions' table.
+def get_order_netted_low_excess():
+    """Low/excess rows like LOW_EXCESS_QUERY, with open order requirements taken out of the stock on hand."""
+    try:
+        data_version = get_data_version()
+        scenarios = load_scenarios()
+        return scenarios.build_low_excess(get_scenario_base_data(data_version, get_surcharge_version()),
+                                          scenarios.Scenario("Base"),
+                                          get_order_requirements(data_version))
+    except Exception as e:
+        st.error(f"Error netting open orders: {str(e)}")
+        return None
+
+def run_scenario_sweep(scenario_rows):
+    """
+    Solves the scenarios of the editor rows against the base data, fetched
+    once per inventory data version.
 
     Args:
-        session: The Snowflake Snowpark session.
+        scenario_rows: Records with the columns of DEFAULT_SCENARIOS.
 
     Returns:
-        A string indicating success and the number of transfer actions created.
+        A scenarios.ScenarioSweep, or None after showing an error.
     """
+    scenarios = load_scenarios()
+    try:
+        overrides = [
+            scenarios.Scenario(
+                name=str(row['Scenario']),
+                surcharge_multiplier=float(row['Surcharge multiplier']),
+                safety_stock_multiplier=float(row['Safety stock multiplier']),
+                material_cost_multiplier=float(row['Material cost multiplier']),
+                offline_plants=tuple(int(plant) for plant in str(row['Offline plants'] or "").split(",")
+                                     if plant.strip()),
+            )
+            for row in scenario_rows if row.get('Scenario')
+        ]
+    except (TypeError, ValueError) as e:
+        st.error(f"Invalid scenario: {str(e)}")
+        return None
 
-    # --- 1. Get Data from Snowflake (Modified Query) ---
+    try:
+        base_data = get_scenario_base_data(get_data_version(), get_surcharge_version())
+        with current_tracer().span("scenarios.sweep", scenarios=len(overrides)):
+            return scenarios.run_scenarios(base_data, overrides, engine=OPTIMIZER_ENGINE,
+                                           max_workers=SCENARIO_MAX_WORKERS, executor=OPTIMIZER_EXECUTOR)
+    except Exception as e:
+        st.error(f"Error comparing scenarios: {str(e)}")
+        return None
 
-    low_excess_df_pd = low_excess_df.to_pandas()
+@st.cache_resource(show_spinner=False)
+def load_replenishment_planner():
+    with current_tracer().span("planner.import"):
+        import replenishment_planner
+    return replenishment_planner
 
-    # --- 2. Linear Programming Formulation ---
+@traced("planner")
+def plan_replenishment(bucket: str, horizon: int, periods: int):
+    """
+    Plans purchases and transfers over a rolling horizon from the current
+    inventory positions, see replenishment_planner.py.
 
-    if low_excess_df_pd.empty:
-        return "No transfer opportunities found."
+    Returns:
+        A replenishment_planner.ReplenishmentPlan, or None after showing an error.
+    """
+    planner = load_replenishment_planner()
+    inventory = run_cached_query(planner.PLANNING_INVENTORY_QUERY)
+    lanes = run_cached_query(planner.PLANNING_LANES_QUERY)
+    if inventory is None or lanes is None:
+        return None
+    try:
+        lanes = get_transport_costs().add_transfer_costs(lanes, 'SOURCE_PLANT_ID', 'DESTINATION_PLANT_ID')
+        plan = planner.plan_rolling_horizon(inventory, lanes, periods=periods, horizon=horizon,
+                                            bucket_days=planner.BUCKET_DAYS[bucket])
+    except Exception as e:
+        st.error(f"Error planning replenishment: {str(e)}")
+        return None
+    stats = plan.solver_stats
+    current_tracer().record("planner.solve", stats['solve_seconds'], backend=stats['backend'],
+                            windows=stats['windows'], iterations=stats['iterations'])
+    return plan
 
-    low_plants = low_excess_df_pd['LOW_PLANT_ID'].unique().tolist()
-    excess_plants = low_excess_df_pd['EXCESS_PLANT_ID'].unique().tolist()
-    materials = low_excess_df_pd['MATERIAL_ID'].unique().tolist()
+@st.cache_resource
+def get_background_executor():
+    """Single worker shared across reruns, so table writes never overlap."""
+    return ThreadPoolExecutor(max_workers=1)
 
-    # --- Add Supplier as an "Excess Plant" ---
-    supplier_id = "999"  # Use '999' as the supplier ID
-    excess_plants.append(supplier_id)
 
-    # --- Linear Programming Formulation ---
-    num_low_plants = len(low_plants)
-    num_excess_plants = len(excess_plants)
-    num_materials = len(materials)
-    num_vars = num_low_plants * num_excess_plants * num_materials
+@traced("optimizer.write")
+def write_transfer_actions(transfer_actions):
+    # Create Snowpark DataFrame and write to Snowflake
+    transfer_actions_df = session.create_dataframe(transfer_actions)
+    transfer_actions_df.write.mode("overwrite").save_as_table(TRANSFER_ACTIONS_TABLE)
 
-    c = np.zeros(num_vars)  # Cost coefficients
-    A_ub = []  # Inequality constraint matrix (Ax <= b)
-    b_ub = []  # Inequality constraint vector
-    A_eq = []  # Equality constraint matrix (Ax = b)
-    b_eq = []  # Equality constraint vector
-    bounds = [(0, float('inf'))] * num_vars
 
-     # Build cost matrix (c)
-    for i, low_plant_id in enumerate(low_plants):
-        for j, material_id in enumerate(materials):
-            for k, excess_plant_id in enumerate(excess_plants):
-                idx = i * num_excess_plants * num_materials + j * num_excess_plants + k
+@traced("optimizer.write_sensitivity")
+def write_transfer_sensitivity(sensitivity):
+    # Small enough to replace as a whole, also after an incremental run
+    session.create_dataframe(sensitivity).write.mode("overwrite").save_as_table(TRANSFER_SENSITIVITY_TABLE)
 
-                if excess_plant_id == supplier_id:
-                    # Cost from supplier is just the material cost
-                    material_cost = low_excess_df_pd[low_excess_df_pd['MATERIAL_ID'] == material_id]['MATERIAL_COST'].iloc[0]
-                    c[idx] = material_cost
-                else:
-                    # Cost from another plant is material cost * transport multiplier
-                    match = low_excess_df_pd[
-                        (low_excess_df_pd['LOW_PLANT_ID'] == low_plant_id) &
-                        (low_excess_df_pd['EXCESS_PLANT_ID'] == excess_plant_id) &
-                        (low_excess_df_pd['MATERIAL_ID'] == material_id)
-                        ]
-                    if not match.empty:
-                        row = match.iloc[0]
-                        c[idx] = row['TRANSFER_COST_PER_UNIT']
-                    else:
-                        c[idx] = 1e9  # Very high cost for impossible transfers
-
-    # Supply Constraints (<= available_to_transfer, including supplier)
-    for j, material_id in enumerate(materials):
-        for k, excess_plant_id in enumerate(excess_plants):
-            row = [0] * num_vars
-            for i in range(num_low_plants):
-                idx = i * num_excess_plants * num_materials + j * num_excess_plants + k
-                row[idx] = 1
-
-            if excess_plant_id == supplier_id:
-                available = 1e9 # Large number for Supplier
-            else:
-                match = low_excess_df_pd[
-                    (low_excess_df_pd['EXCESS_PLANT_ID'] == excess_plant_id) &
-                    (low_excess_df_pd['MATERIAL_ID'] == material_id)
-                    ]
-                if not match.empty:
-                    available = match['AVAILABLE_TO_TRANSFER'].iloc[0]
-                else:
-                    available = 0
-            A_ub.append(row)
-            b_ub.append(available)
-
-    # Demand Constraints (= units_needed) -- CORRECTED LOGIC
-    for i, low_plant_id in enumerate(low_plants):
-        for j, material_id in enumerate(materials):
-            row = [0] * num_vars
-            for k in range(num_excess_plants):
-                idx = i * num_excess_plants * num_materials + j * num_excess_plants + k
-                row[idx] = 1 # Summing all inbound transfers
-
-            match = low_excess_df_pd[
-                (low_excess_df_pd['LOW_PLANT_ID'] == low_plant_id) &
-                (low_excess_df_pd['MATERIAL_ID'] == material_id)
-                ]
 
-            if not match.empty:
-                needed = match['UNITS_NEEDED'].iloc[0]
-            else:
-                needed = 0
+@traced("optimizer.drop_sensitivity")
+def drop_transfer_sensitivity():
+    # The table always belongs to the plan in TRANSFER_ACTIONS, so a plan without sensitivity removes it
+    session.sql(f"DROP TABLE IF EXISTS {TRANSFER_SENSITIVITY_TABLE}").collect()
 
-            A_eq.append(row) # Equality constraint
-            b_eq.append(needed)
 
+def load_sensitivity():
+    """Sensitivity of the latest plan, from this session or else from TRANSFER_SENSITIVITY."""
+    if 'transfer_sensitivity' not in st.session_state:
+        try:
+            st.session_state.transfer_sensitivity = session.table(TRANSFER_SENSITIVITY_TABLE).to_pandas()
+        except Exception:
+            # The latest plan has no sensitivity; remembered until this session solves or reloads a plan
+            st.session_state.transfer_sensitivity = None
+    return st.session_state.transfer_sensitivity
 
-    # --- Solve the Linear Program ---
-    # Use A_eq and b_eq for equality constraints
-    result = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=b_eq, bounds=bounds, method="highs")
 
+def _quoted(columns):
+    # create_dataframe keeps the lower-case pandas column names as quoted identifiers
+    return ", ".join(f'"{column}"' for column in columns)
 
-    if result.status != 0:
-        return f"Linear programming failed: {result.message}"
-
-    transfer_actions = []
-    idx = 0
-    for i, low_plant_id in enumerate(low_plants):
-        for j, material_id in enumerate(materials):
-            for k, excess_plant_id in enumerate(excess_plants):
-                transfer_quantity = round(result.x[idx], 2)
-                idx += 1
-                if transfer_quantity > 0:
-                    if excess_plant_id == supplier_id:
-                        # Purchase Action
-                        material_cost = low_excess_df_pd[low_excess_df_pd['MATERIAL_ID'] == material_id]['MATERIAL_COST'].iloc[0]
-                        transfer_actions.append({
-                            'action_type': 'PURCHASE',
-                            'source_plant_id': excess_plant_id,
-                            'destination_plant_id': low_plant_id,
-                            'material_id': material_id,
-                            'transfer_quantity': transfer_quantity,
-                            'transfer_cost': transfer_quantity * material_cost,
-                            'savings': 0.00,
-                            'transfer_id': str(uuid.uuid4()),
-                            'transfer_date': pd.to_datetime('today').normalize()                            
-                        })
-                    else:
-                        # Transfer Action
-                        match = low_excess_df_pd[
-                            (low_excess_df_pd['LOW_PLANT_ID'] == low_plant_id) &
-                            (low_excess_df_pd['EXCESS_PLANT_ID'] == excess_plant_id) &
-                            (low_excess_df_pd['MATERIAL_ID'] == material_id)
-                        ]
-                        if not match.empty:
-                            cost_per_unit = match.iloc[0]['TRANSFER_COST_PER_UNIT']
-                            material_cost = low_excess_df_pd[low_excess_df_pd['MATERIAL_ID'] == material_id]['MATERIAL_COST'].iloc[0]
-                            transfer_actions.append({
-                                'action_type': 'TRANSFER',
-                                'source_plant_id': excess_plant_id,
-                                'destination_plant_id': low_plant_id,
-                                'material_id': material_id,
-                                'transfer_quantity': transfer_quantity,
-                                'transfer_cost': transfer_quantity * cost_per_unit,
-                                'savings': transfer_quantity * (material_cost - cost_per_unit),
-                                'transfer_id': str(uuid.uuid4()),
-                                'transfer_date': pd.to_datetime('today').normalize()
-                            })
-
-    if not transfer_actions:
-        return "No optimal transfers found."
 
-    # Create Snowpark DataFrame and write to Snowflake
-    transfer_actions_df = session.create_dataframe(pd.DataFrame(transfer_actions))
-    # transfer_actions_df = transfer_actions_df.rename(columns={col: col.upper() for col in transfer_actions_df.columns}) #Uppercase
-    transfer_actions_df.write.mode("overwrite").save_as_table("supply_chain_network_optimization_db.entities.transfer_actions")
+@traced("optimizer.merge")
+def merge_transfer_actions(transfer_actions, materials):
+    """
+    Replaces the actions of the given materials in TRANSFER_ACTIONS and leaves
+    every other row untouched. Actions are upserted with a MERGE on
+    TRANSFER_ACTION_KEY, then the actions of these materials that are no longer
+    part of the plan are deleted.
+    """
+    optimizer = load_optimizer()
+    key = optimizer.TRANSFER_ACTION_KEY
+    matches = " AND ".join(f't."{column}" = s."{column}"' for column in key)
+
+    session.create_dataframe(pd.DataFrame({'material_id': materials})).write.mode("overwrite") \
+        .save_as_table(CHANGED_MATERIALS_TABLE, table_type="temporary")
+    stale = f"""
+        DELETE FROM {TRANSFER_ACTIONS_TABLE} AS t
+        WHERE t."material_id" IN (SELECT "material_id" FROM {CHANGED_MATERIALS_TABLE})"""
+
+    if not transfer_actions.empty:
+        session.create_dataframe(transfer_actions).write.mode("overwrite") \
+            .save_as_table(TRANSFER_ACTIONS_STAGING_TABLE, table_type="temporary")
+        updates = ", ".join(f'"{column}" = s."{column}"'
+                            for column in optimizer.TRANSFER_ACTION_COLUMNS if column not in key)
+        values = ", ".join(f's."{column}"' for column in optimizer.TRANSFER_ACTION_COLUMNS)
+        session.sql(f"""
+            MERGE INTO {TRANSFER_ACTIONS_TABLE} AS t
+            USING {TRANSFER_ACTIONS_STAGING_TABLE} AS s
+            ON {matches}
+            WHEN MATCHED THEN UPDATE SET {updates}
+            WHEN NOT MATCHED THEN INSERT ({_quoted(optimizer.TRANSFER_ACTION_COLUMNS)})
+                VALUES ({values})
+            """).collect()
+        stale += f"""
+        AND NOT EXISTS (SELECT 1 FROM {TRANSFER_ACTIONS_STAGING_TABLE} AS s WHERE {matches})"""
+
+    session.sql(stale).collect()
+
+
+def get_plan_store():
+    """Latest plan of this session, that incremental re-optimization starts from."""
+    # One store per user session, so one user's plan is never the starting point of another user's run
+    if 'plan_store' not in st.session_state:
+        st.session_state.plan_store = {'snapshot': None}
+    return st.session_state.plan_store
+
+
+@traced("optimizer.changed_materials")
+def get_changed_materials(since: str) -> list:
+    """Materials with an MFG_INVENTORY row updated after the given data version."""
+    rows = session.sql(load_optimizer().CHANGED_MATERIALS_QUERY, params=[since]).collect()
+    return [row[0] for row in rows]
+
+
+def _forget_plan_on_failure(plans, snapshot):
+    # The callback runs on the writer thread, without session state, so it gets the store itself
+    def callback(write):
+        # The table no longer matches the plan in memory, so the next run solves everything
+        if write.exception() is not None and plans['snapshot'] is snapshot:
+            plans['snapshot'] = None
+    return callback
+
+
+@traced("optimizer")
+def optimize_transfers(low_excess_df_pd, data_version: str = None, incremental: bool = False):
+    """
+    Optimizes material transfers between plants with low and excess inventory.
+
+    This function:
+    1. Takes the low/excess inventory data from LOW_EXCESS_QUERY, as served
+       by the query cache and priced with the shared transport cost model.
+    2. Formulates and solves a linear programming problem to minimize
+       total transfer costs.
+    3. Writes the optimal transfer actions to the 'transfer_actions' table in
+       the background, so the caller can render the plan from memory.
+
+    The model itself is built and solved in transfer_optimizer.py, which emits
+    the cost vector and constraint matrices as scipy.sparse matrices. Materials
+    never share a constraint, so each one is solved as its own subproblem on an
+    OPTIMIZER_EXECUTOR pool and the results are merged.
+
+    In incremental mode only the materials with inventory rows updated since
+    the previous plan are re-solved, the rest of that plan is kept, and only
+    the re-solved materials' actions are merged into the table. With
+    OPTIMIZER_SENSITIVITY, shadow prices and lane reduced costs are saved to
+    TRANSFER_SENSITIVITY as well; without it the table is dropped. The first run,
+    a run after a failed write, a run with another solver engine and a run
+    after a TRANSPORT_COST_SURCHARGE change solve everything. Raw material
+    cost changes carry no LAST_UPDATED_TIMESTAMP, so they need a full run.
+
+    Args:
+        low_excess_df_pd: The result of get_low_excess as a pandas DataFrame.
+        data_version: The MFG_INVENTORY data version low_excess_df_pd was read at,
+            or None if the rows are not derived from MFG_INVENTORY alone.
+        incremental: Re-solve only what changed since the previous plan.
+
+    Returns:
+        An OptimizationResult with the plan, its KPIs, solver statistics and a
+        message indicating success and the number of transfer actions created.
+    """
+
+    # --- 1. Linear Programming Formulation ---
+    optimizer = load_optimizer()
+
+    if low_excess_df_pd is None or low_excess_df_pd.empty:
+        return optimizer.OptimizationResult(0, "No transfer opportunities found.")
+
+    # --- 2. Solve the Linear Program, one subproblem per material ---
+    tracer = current_tracer()
+    plans = get_plan_store()
+    previous = plans['snapshot']
+    solver_options = {'engine': OPTIMIZER_ENGINE, 'sensitivity': OPTIMIZER_SENSITIVITY,
+                      'surcharge_version': get_surcharge_version()}
+    incremental = (incremental and data_version is not None and previous is not None
+                   and previous.solver_options == solver_options)
+    with tracer.span("optimizer.solve_transfers", lanes=len(low_excess_df_pd), incremental=incremental) as span:
+        if incremental:
+            result = optimizer.reoptimize_changed_materials(
+                low_excess_df_pd, previous, get_changed_materials(previous.data_version), engine=OPTIMIZER_ENGINE,
+                executor=OPTIMIZER_EXECUTOR, sensitivity=OPTIMIZER_SENSITIVITY)
+        else:
+            result = optimizer.solve_transfers(low_excess_df_pd, engine=OPTIMIZER_ENGINE,
+                                               partition_by=OPTIMIZER_PARTITION_BY, executor=OPTIMIZER_EXECUTOR,
+                                               sensitivity=OPTIMIZER_SENSITIVITY)
+        stats = result.solver_stats
+        span.set(**{key: value for key, value in stats.items()
+                    if not key.endswith("_seconds") and key != 'changed_materials'},
+                 changed_materials=len(stats.get('changed_materials', [])))
+        # Build and solve run in the worker pool; their times are summed over subproblems
+        tracer.record("optimizer.build", stats.get('build_seconds', 0.0), summed_over_subproblems=True)
+        tracer.record("optimizer.solve", stats.get('solve_seconds', 0.0), summed_over_subproblems=True,
+                      iterations=stats.get('iterations'))
 
-    return f"Successfully created {len(transfer_actions)} transfer actions."
+    if result.status != 0:
+        result.message = f"Linear programming failed: {result.message}"
+        return result
+
+    # --- 3. Persist the plan without blocking the page ---
+    if incremental:
+        changed = result.solver_stats['changed_materials']
+        if not changed:
+            result.message = "No inventory changed since the last optimization, the plan is up to date."
+            return result
+        resolved = result.transfer_actions[result.transfer_actions['material_id'].isin(changed)]
+        write = get_background_executor().submit(
+            contextvars.copy_context().run, merge_transfer_actions, resolved, changed)
+        result.message = (f"Re-optimized {len(changed)} changed material(s) into "
+                          f"{len(result.transfer_actions)} transfer actions.")
+    elif result.transfer_actions.empty:
+        result.message = "No optimal transfers found."
+        return result
+    else:
+        write = get_background_executor().submit(
+            contextvars.copy_context().run, write_transfer_actions, result.transfer_actions)
+        result.message = f"Successfully created {len(result.transfer_actions)} transfer actions."
+    st.session_state.transfer_actions_write = write
+    st.session_state.transfer_sensitivity = result.sensitivity
+    if result.sensitivity is not None:
+        get_background_executor().submit(
+            contextvars.copy_context().run, write_transfer_sensitivity, result.sensitivity)
+    else:
+        get_background_executor().submit(contextvars.copy_context().run, drop_transfer_sensitivity)
+
+    if data_version is not None:
+        snapshot = optimizer.PlanSnapshot(data_version, frozenset(low_excess_df_pd['MATERIAL_ID'].unique()),
+                                          result.transfer_actions, solver_options, result.sensitivity)
+        plans['snapshot'] = snapshot
+        write.add_done_callback(_forget_plan_on_failure(plans, snapshot))
+    else:
+        # The table was replaced by a plan that cannot be reused, e.g. one netted with open orders
+        plans['snapshot'] = None
+    return result
     
 
+@traced("optimizer.procedure")
+def optimize_transfers_in_warehouse():
+    """
+    Solves the transfer problem with OPTIMIZER_PROCEDURE, which reads the
+    low/excess rows, solves and writes TRANSFER_ACTIONS inside Snowflake.
+
+    The procedure is started as an asynchronous query and polled, so the
+    inventory rows never travel to the app and back; only the finished plan
+    is read for display.
+
+    Returns:
+        An OptimizationResult with the plan read back from TRANSFER_ACTIONS and
+        the KPIs and solver statistics reported by the procedure.
+    """
+    optimizer = load_optimizer()
+    try:
+        job = session.sql(f"CALL {OPTIMIZER_PROCEDURE}(?, ?, ?)",
+                          params=[OPTIMIZER_ENGINE, OPTIMIZER_PARTITION_BY or "", OPTIMIZER_SENSITIVITY]).collect_nowait()
+        start = time.perf_counter()
+        progress = st.empty()
+        while not job.is_done():
+            progress.caption(f"Solving in the warehouse... {time.perf_counter() - start:.0f}s")
+            time.sleep(OPTIMIZER_POLL_INTERVAL)
+        progress.empty()
+        summary = json.loads(job.result()[0][0])
+    except Exception as e:
+        return optimizer.OptimizationResult(1, f"Optimizer procedure failed: {str(e)}")
+
+    # The procedure replaced the tables, so the next incremental run starts from a full plan again,
+    # and TRANSFER_SENSITIVITY, which it replaced or dropped, is read again when needed
+    get_plan_store()['snapshot'] = None
+    st.session_state.pop('transfer_sensitivity', None)
+    current_tracer().record("optimizer.procedure.solve", summary.get('solve_seconds', 0.0),
+                            **{key: value for key, value in summary.get('solver_stats', {}).items()
+                               if not key.endswith("_seconds")})
+
+    result = optimizer.OptimizationResult(summary['status'], summary['message'],
+                                          solver_stats=summary.get('solver_stats', {}))
+    if result.status != 0:
+        result.message = f"Linear programming failed: {result.message}"
+    elif summary.get('transfer_actions'):
+        result.transfer_actions = session.table(TRANSFER_ACTIONS_TABLE).to_pandas()
+    return result
+
+
 class WelcomePage(Page):
     def __init__(self):
         self.name = "Welcome"
@@ -612,51 +1060,266 @@ class AssistantPage(Page):
         st.title("Intelligent Supply Chain Network Assistant")
         
         if 'messages' not in st.session_state:
-            st.session_state.messages = []
+            self.open_thread(None)
+
+        self.print_batch_mode()
+
+        # Only the most recent page of messages is rendered, so reruns cost the same
+        # however long the conversation grows
+        if st.session_state.messages_offset > 0 or len(st.session_state.messages) > st.session_state.history_window:
+            if st.button("Load older messages"):
+                self.load_older_messages()
     
-        for message in st.session_state.messages:
+        for message in st.session_state.messages[-st.session_state.history_window:]:
             with st.chat_message(message['role']):
                 st.markdown(message['content'].replace("•", "\n\n-"))
     
         if query := st.chat_input("What would you like to learn?"):
-            # Add user message to chat
-            with st.chat_message("user"):
-                st.markdown(query)
-            st.session_state.messages.append({"role": "user", "content": query})
-            
-            # Get response from API
-            with st.spinner("Processing your request..."):
-                response = snowflake_api_call(query, 1)
-                text, sql, interpretation, citation = process_sse_response(response)
-
-                if citation:
-                    st.session_state.messages.append({"role": "assistant", "content": citation})
-                    with st.expander("Citations", expanded=True):
-                        st.markdown(citation.replace("•", "\n\n-"))
-                
-                # Add assistant response to chat
-                if text:
-                    st.session_state.messages.append({"role": "assistant", "content": text})
-                    with st.chat_message("assistant"):
-                        st.markdown(text.replace("•", "\n\n-"))
-
-                # Add assistant response to chat
-                if interpretation:
-                    st.session_state.messages.append({"role": "assistant", "content": interpretation})
-                    with st.chat_message("assistant"):
-                        st.markdown(interpretation.replace("•", "\n\n-"))
-    
-                # Display SQL if present
-                if sql:
-                    st.markdown("### Generated SQL")
+            self.answer_question(query)
+            self.save_turn()
+
+    def print_batch_mode(self):
+        with st.expander("📋 Batch questions"):
+            text = st.text_area("One question per line, e.g. a morning checklist across plants or business lines",
+                                key="batch_questions")
+            questions = [line.strip() for line in text.splitlines() if line.strip()]
+            if st.button("Run checklist", disabled=not questions):
+                with st.spinner(f"Answering {len(questions)} questions..."):
+                    st.session_state.batch_report = run_checklist(questions)
+
+            report = st.session_state.get('batch_report')
+            if report is None:
+                return
+            st.caption(f"{len(report.results)} questions answered in {report.elapsed_seconds:.1f}s")
+            st.dataframe(report.summary, hide_index=True)
+            for result in report.results:
+                st.markdown(f"**{result.question}**")
+                if result.error:
+                    st.error(result.error)
+                    continue
+                if result.response.text:
+                    st.markdown(result.response.text.replace("•", "\n\n-"))
+                for query_result in result.query_results:
+                    st.code(query_result.sql, language="sql")
+                    if query_result.error:
+                        st.error(f"Error executing SQL: {query_result.error}")
+                    else:
+                        st.dataframe(query_result.frame)
+            st.download_button("Download report", report.to_markdown(), file_name="supply_chain_checklist.md",
+                               mime="text/markdown")
+
+    def open_thread(self, conversation_id):
+        """Switches to a thread (None starts a new one) and loads its most recent messages."""
+        messages, total = [], 0
+        if conversation_id is not None:
+            try:
+                messages, total = get_conversation_store().load_messages(conversation_id, CONVERSATION_PAGE_SIZE)
+            except Exception as e:
+                st.error(f"Error loading conversation: {str(e)}")
+        st.session_state.conversation_id = conversation_id
+        st.session_state.messages = messages
+        st.session_state.messages_offset = total - len(messages)  # position of messages[0] in the thread
+        st.session_state.history_window = CONVERSATION_PAGE_SIZE
+
+    def load_older_messages(self):
+        if len(st.session_state.messages) <= st.session_state.history_window:
+            try:
+                older, _ = get_conversation_store().load_messages(
+                    st.session_state.conversation_id, CONVERSATION_PAGE_SIZE, end=st.session_state.messages_offset)
+            except Exception as e:
+                st.error(f"Error loading conversation: {str(e)}")
+                return
+            st.session_state.messages = older + st.session_state.messages
+            st.session_state.messages_offset -= len(older)
+        st.session_state.history_window += CONVERSATION_PAGE_SIZE
+
+    def add_message(self, role, content):
+        if st.session_state.conversation_id is None and role == "user":
+            try:
+                st.session_state.conversation_id = get_conversation_store().create_thread(content)
+                list_conversation_threads.clear()
+            except Exception as e:
+                st.error(f"Error saving conversation: {str(e)}")
+        st.session_state.messages.append({"role": role, "content": content})
+        if st.session_state.conversation_id is not None:
+            get_conversation_store().append(st.session_state.conversation_id, {"role": role, "content": content})
+
+    def save_turn(self):
+        """Writes the turn's messages in one statement and drops what is no longer rendered."""
+        try:
+            get_conversation_store().flush()
+        except Exception as e:
+            st.error(f"Error saving conversation: {str(e)}")
+            return
+        if st.session_state.conversation_id is not None:
+            # Everything is persisted now, so older messages can be reloaded on demand
+            surplus = len(st.session_state.messages) - st.session_state.history_window
+            if surplus > 0:
+                st.session_state.messages = st.session_state.messages[surplus:]
+                st.session_state.messages_offset += surplus
+
+    def answer_question(self, query):
+        # Add user message to chat
+        with st.chat_message("user"):
+            st.markdown(query)
+        self.add_message("user", query)
+        
+        # Questions that match a verified query are answered with its vetted SQL
+        router = get_query_router(get_semantic_model_version()) if ROUTE_VERIFIED_QUERIES else None
+        route = router.match(query) if router else None
+        if route:
+            self.print_verified_query_answer(router, route)
+            return
+
+        # Serve repeated questions from the answer cache, otherwise get the
+        # response from the API, rendering it as the events arrive
+        knowledge_version = get_knowledge_version()
+        answer_cache = get_answer_cache()
+        response = answer_cache.get(query, knowledge_version)
+        if response is not None:
+            self.print_response(self.response_placeholders(), response, final=True)
+            st.caption("⚡ Answered from cache")
+        else:
+            start = time.perf_counter()
+            response = self.print_streaming_response(query)
+            if router:
+                router.record_agent_call(time.perf_counter() - start)
+            if response.text or response.tool_results:
+                answer_cache.put(query, knowledge_version, response)
+
+        if response.citation:
+            self.add_message("assistant", response.citation)
+
+        # Add assistant response to chat
+        if response.text:
+            self.add_message("assistant", response.text)
+
+        # Add assistant response to chat
+        if response.interpretation:
+            self.add_message("assistant", response.interpretation)
+
+        # Run every SQL statement the agent generated, bounded in rows and time
+        for sql in response.sql_statements:
+            with st.spinner("Running generated SQL..."):
+                scn_results = run_generated_sql(sql)
+            if scn_results.error:
+                st.error(f"Error executing SQL: {scn_results.error}")
+                continue
+            st.write("### Supply Chain Query Results")
+            st.dataframe(scn_results.frame)
+            limit_note = f" (limited to the first {GENERATED_SQL_MAX_ROWS:,})" if scn_results.truncated else ""
+            st.caption(f"{scn_results.row_count:,} rows{limit_note} in {scn_results.elapsed_seconds:.2f}s")
+
+    def print_verified_query_answer(self, router, route):
+        verified_query = route.verified_query
+        start = time.perf_counter()
+        with st.spinner("Running verified query..."), \
+                current_tracer().span("router.fast_path", verified_query=verified_query.name) as span:
+            df = run_snowflake_query(verified_query.sql)
+            with current_tracer().span("snowflake.sql"):
+                results = df.to_pandas() if df is not None else None
+            span.set(rows=0 if results is None else len(results))
+        elapsed = time.perf_counter() - start
+        router.record_fast_path(elapsed)
+
+        content = f"Answered with the verified query **{verified_query.name}**."
+        with st.chat_message("assistant"):
+            st.markdown(content)
+            st.code(verified_query.sql, language="sql")
+        self.add_message("assistant", content)
+        if results is not None:
+            st.write("### Supply Chain Query Results")
+            st.dataframe(results)
+        st.caption(f"⚡ Verified query match ({route.score:.0%}) answered in {elapsed:.2f}s without calling the agent")
+
+    def response_placeholders(self):
+        """Placeholders for the citations, the chat message, the interpretation and the generated SQL."""
+        citation_placeholder = st.empty()
+        with st.chat_message("assistant"):
+            text_placeholder = st.empty()
+            text_placeholder.markdown("_Thinking..._")
+        return {
+            'citation': citation_placeholder,
+            'text': text_placeholder,
+            'interpretation': st.empty(),
+            'sql': st.empty(),
+        }
+
+    def print_response(self, placeholders, response, final=False):
+        if response.citation:
+            with placeholders['citation'].container():
+                with st.expander("Citations", expanded=True):
+                    st.markdown(response.citation.replace("•", "\n\n-"))
+        if response.text:
+            placeholders['text'].markdown(response.text.replace("•", "\n\n-") + ("" if final else " ▌"))
+        elif final:
+            placeholders['text'].empty()
+        if response.interpretation:
+            with placeholders['interpretation'].container():
+                with st.chat_message("assistant"):
+                    st.markdown(response.interpretation.replace("•", "\n\n-"))
+        if response.sql_statements:
+            with placeholders['sql'].container():
+                st.markdown("### Generated SQL")
+                for sql in response.sql_statements:
                     st.code(sql, language="sql")
-                    scn_results = run_snowflake_query(sql)
-                    if scn_results:
-                        st.write("### Supply Chain Query Results")
-                        st.dataframe(scn_results)
+
+    def print_streaming_response(self, query):
+        """
+        Streams the agent answer into the response placeholders, so the first
+        tokens show up as soon as they arrive. Returns the parsed AgentResponse.
+        """
+        placeholders = self.response_placeholders()
+        parser = AgentResponseParser()
+        last_render = 0.0
+
+        with current_tracer().span("agent.round_trip") as span:
+            try:
+                for event in stream_agent_events(query, 1):
+                    # Re-rendering markdown on every token is wasteful, so throttle it
+                    if parser.feed(event) and time.monotonic() - last_render >= STREAM_RENDER_INTERVAL:
+                        self.print_response(placeholders, parser.response)
+                        last_render = time.monotonic()
+
+            except Exception as e:
+                st.error(f"Error processing events: {str(e)}")
+
+            response = parser.response
+            span.set(text_chars=len(response.text), tool_results=len(response.tool_results))
+        self.print_response(placeholders, response, final=True)
+        return response
 
     def print_sidebar(self):
         set_default_sidebar()
+        self.print_thread_selector()
+        router = get_query_router(get_semantic_model_version()) if ROUTE_VERIFIED_QUERIES else None
+        if router and router.questions:
+            stats = router.stats
+            with st.sidebar.expander("Verified query routing"):
+                st.metric("Match rate", f"{stats['match_rate']:.0%}", f"{stats['matches']} of {stats['questions']} questions",
+                          delta_color="off")
+                if stats['seconds_saved'] is not None:
+                    st.metric("Latency saved", f"{stats['seconds_saved']:.1f}s",
+                              f"agent {stats['average_agent_seconds']:.1f}s per question", delta_color="off")
+
+    def print_thread_selector(self):
+        threads = {thread.conversation_id: thread for thread in list_conversation_threads(get_user_name())}
+        current = st.session_state.get('conversation_id')
+        options = [None] + list(threads)
+        if current is not None and current not in threads:
+            options.insert(1, current)
+
+        def label(conversation_id):
+            if conversation_id is None:
+                return "➕ New conversation"
+            thread = threads.get(conversation_id)
+            return f"{thread.thread_name} ({thread.message_count})" if thread else "Current conversation"
+
+        with st.sidebar:
+            selected = st.selectbox("Conversations", options, index=options.index(current), format_func=label)
+        if selected != current:
+            self.open_thread(selected)
+            st.rerun()
 
 
 class OptimizationPage(Page):
@@ -678,7 +1341,18 @@ class OptimizationPage(Page):
         and other plants with excess. An intelligent assistant is great for answering ad-hoc questions like this.''')
 
         st.write('')
+        # Only this page needs the inventory data, and it is served from cache until MFG_INVENTORY changes
+        net_orders = st.toggle("Net open orders through the bill of materials", value=NET_OPEN_ORDERS)
+        if net_orders:
+            low_excess_df = get_order_netted_low_excess()
+        else:
+            low_excess_df = get_low_excess()
+        weather_aware = st.toggle("Penalize transfer lanes at risk of weather disruption", value=WEATHER_AWARE_LANES)
+        if weather_aware and low_excess_df is not None and not low_excess_df.empty:
+            low_excess_df = apply_weather_risk(low_excess_df)
         st.dataframe(low_excess_df)
+        self.print_scenarios()
+        self.print_replenishment_plan()
         
         st.write('''However, this seems to be a regular challenge we want to stay on top of. Let's use [Linear Programming](
         https://en.wikipedia.org/wiki/Linear_programming), also called linear optimization or constraint programming,
@@ -703,22 +1377,46 @@ class OptimizationPage(Page):
                  "solver we want.  In this case, we are using the [HiGHS solver](https://highs.dev/) for our "
                  "models.")
 
+        st.write("Because moving materials between plants is a classic transportation problem, the models can also be "
+                 "solved with a dedicated min-cost-flow engine, which falls back to HiGHS for anything that is not a "
+                 "pure transportation problem.")
+
+        # The procedure reads LOW_EXCESS_QUERY itself, and order and forecast changes carry no inventory timestamp
+        adjusted = net_orders or weather_aware
+        in_warehouse = st.toggle("Solve in the warehouse with the OPTIMIZE_TRANSFERS_SP stored procedure",
+                                 value=OPTIMIZE_IN_WAREHOUSE and not adjusted, disabled=adjusted)
+        incremental = st.toggle("Only re-optimize materials whose inventory changed since the last plan",
+                                value=OPTIMIZER_INCREMENTAL and not adjusted, disabled=in_warehouse or adjusted)
         submitted = st.button("Optimize for Cost 📊")
 
         if submitted:
             with st.spinner("Solving Models..."):
-                optimize_transfers()
+                if in_warehouse:
+                    result = optimize_transfers_in_warehouse()
+                else:
+                    result = optimize_transfers(low_excess_df, None if adjusted else get_data_version(), incremental)
                 st.write('')
-                transfer_actions = session.table("SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.TRANSFER_ACTIONS")
-                st.dataframe(transfer_actions)
+                if result.status != 0:
+                    st.error(result.message)
+                    return
+                if result.transfer_actions is None or result.transfer_actions.empty:
+                    st.info(result.message)
+                    return
+
+                # Render straight from the in-memory plan; the table write runs in the background
+                st.dataframe(result.transfer_actions)
+                if in_warehouse:
+                    st.caption(f"{result.message} The procedure saved them to TRANSFER_ACTIONS.")
+                else:
+                    st.caption(f"{result.message} Saving the changes to TRANSFER_ACTIONS in the background.")
                 st.write('')
                 
                 # Calculate the statistics
-                df_pandas = transfer_actions.to_pandas()
-                transfers_count = len(df_pandas[df_pandas['action_type'] == 'TRANSFER'])
-                purchases_count = len(df_pandas[df_pandas['action_type'] == 'PURCHASE'])
-                total_spend = df_pandas['transfer_cost'].sum()
-                total_savings = df_pandas['savings'].sum()
+                kpis = result.kpis
+                transfers_count = kpis['transfers']
+                purchases_count = kpis['purchases']
+                total_spend = kpis['total_spend']
+                total_savings = kpis['total_savings']
                 
                 # Use Streamlit columns to display the boxes in a row
                 col1, col2, col3, col4 = st.columns(4)
@@ -766,23 +1464,149 @@ class OptimizationPage(Page):
                         """,
                         unsafe_allow_html=True,
                     )
-                
+
+                st.write('')
+                with st.expander("Solver statistics"):
+                    st.json(result.solver_stats)
                 
         
         
 
+    def print_scenarios(self):
+        with st.expander("🔀 Compare what-if scenarios"):
+            st.caption("Offline plants are comma-separated plant IDs that neither ship nor receive materials. "
+                       "Costs are compared to the first scenario.")
+            rows = st.data_editor(pd.DataFrame(DEFAULT_SCENARIOS), num_rows="dynamic", hide_index=True,
+                                  key="scenario_editor")
+            if st.button("Compare scenarios"):
+                with st.spinner("Solving scenarios..."):
+                    st.session_state.scenario_sweep = run_scenario_sweep(rows.to_dict("records"))
+
+            sweep = st.session_state.get('scenario_sweep')
+            if sweep is not None:
+                st.dataframe(sweep.comparison, hide_index=True)
+                st.caption(f"{len(sweep.scenarios)} scenarios solved in {sweep.elapsed_seconds:.1f}s")
+
+    def print_replenishment_plan(self):
+        with st.expander("📅 Plan replenishment over time"):
+            st.caption("Projects every inventory position forward with its usage, open orders and lead times, "
+                       "and commits purchases and transfers one period at a time.")
+            col1, col2, col3 = st.columns(3)
+            bucket = col1.selectbox("Period", ["Weekly", "Daily"], index=["Weekly", "Daily"].index(PLANNING_BUCKET))
+            horizon = col2.number_input("Look-ahead (periods)", min_value=2, max_value=60, value=PLANNING_HORIZON)
+            periods = col3.number_input("Periods to plan", min_value=1, max_value=60, value=PLANNING_PERIODS)
+            if st.button("Plan replenishment"):
+                with st.spinner("Solving planning windows..."):
+                    st.session_state.replenishment_plan = plan_replenishment(bucket, int(horizon), int(periods))
+
+            plan = st.session_state.get('replenishment_plan')
+            if plan is None:
+                return
+            stats = plan.solver_stats
+            if stats['status'] != 0:
+                st.error(f"Planning stopped early: {stats['message']}")
+            kpis = plan.kpis
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Transfers", kpis['transfers'])
+            col2.metric("Purchases", kpis['purchases'])
+            col3.metric("Total Spend", f"${kpis['total_spend']:,.2f}")
+            col4.metric("Unmet usage", f"{kpis['unmet_usage']:,.0f}")
+            st.dataframe(plan.actions, hide_index=True)
+            below = plan.projection.groupby('date')['below_safety_stock'].sum()
+            st.line_chart(below.rename("Units below safety stock"))
+            st.caption(f"{stats['windows']} windows solved in {stats['solve_seconds']:.1f}s with "
+                       f"{stats['backend']}, {stats['iterations']} iterations")
+            if stats['backend'] == "linprog":
+                st.caption("highspy is not installed, so every window was solved from scratch. Add it to the "
+                           "app's packages (see environment.yml) to warm-start the windows, about ten times "
+                           "faster for daily plans.")
+
     def print_sidebar(self):
         set_default_sidebar()
+        if OPTIMIZER_SENSITIVITY:
+            self.print_what_if()
+
+    def print_what_if(self):
+        sensitivity = load_sensitivity()
+        if sensitivity is None or sensitivity.empty:
+            return
+        report = load_sensitivity_report()(sensitivity)
+        with st.sidebar.expander("What if..."):
+            st.caption("Excess and demand answers come from the shadow prices of the latest plan and hold for "
+                       "changes small enough to keep its transfers and purchases. A lane's break-even cost "
+                       "re-solves only that lane's material.")
+            question = st.radio("Question", ["More excess at a plant", "More demand at a plant",
+                                             "Lane break-even cost"], key="what_if_question")
+            if question == "Lane break-even cost":
+                lanes = report.lanes()
+                lanes = lanes[lanes['kind'] == 'TRANSFER']
+                lane = st.selectbox("Lane", list(lanes.itertuples(index=False)), key="what_if_lane",
+                                    format_func=lambda row: f"{row.source_plant_id} → {row.destination_plant_id}, "
+                                                            f"material {row.material_id}")
+                if lane is None:
+                    return
+                answer = report.lane(lane.source_plant_id, lane.destination_plant_id, lane.material_id)
+            else:
+                rows = report.supplies() if question == "More excess at a plant" else report.demands()
+                plant = 'source_plant_id' if question == "More excess at a plant" else 'destination_plant_id'
+                row = st.selectbox("Plant and material", list(rows.itertuples(index=False)), key="what_if_row",
+                                   format_func=lambda row: f"Plant {getattr(row, plant)}, material {row.material_id}")
+                units = st.number_input("Units", min_value=0.0, value=100.0, step=10.0, key="what_if_units")
+                if row is None:
+                    return
+                if question == "More excess at a plant":
+                    answer = report.extra_supply(row.source_plant_id, row.material_id, units)
+                else:
+                    answer = report.extra_demand(row.destination_plant_id, row.material_id, units)
+            st.markdown(f"**{answer.question}**")
+            st.write(answer.answer)
+
+
+PAGES = {'Welcome': WelcomePage, 'Assistant': AssistantPage, 'Optimization': OptimizationPage}
 
 
-pages = [WelcomePage(), AssistantPage(), OptimizationPage()]
+@st.cache_resource
+def get_page(name: str) -> Page:
+    # Pages keep no per-user state, so each one is created once, when it is first shown
+    return PAGES[name]()
+
+
+def print_diagnostics():
+    """Optional sidebar panel with the timing spans of this session."""
+    tracer = get_tracer()
+    if not st.sidebar.toggle("Diagnostics"):
+        return
+    with st.sidebar:
+        st.markdown("#### Time by phase")
+        st.dataframe(tracer.summary().round(1), hide_index=True)
+        st.markdown("#### Recent spans")
+        spans = tracer.to_frame()
+        st.dataframe(spans.tail(50).iloc[::-1][['NAME', 'DURATION_MS', 'ATTRIBUTES', 'ERROR']].round(1),
+                     hide_index=True)
+        st.download_button("Export spans (JSON lines)", tracer.to_json_lines(), file_name="spans.jsonl",
+                           mime="application/x-ndjson")
+        if TELEMETRY_TABLE and st.button("Save spans to telemetry table", disabled=spans.empty):
+            try:
+                session.create_dataframe(spans).write.mode("append").save_as_table(TELEMETRY_TABLE)
+                tracer.clear()
+            except Exception as e:
+                st.error(f"Error saving spans: {str(e)}")
+        if st.button("Clear spans"):
+            tracer.clear()
+            st.rerun()
 
 
 def main():
-    for page in pages:
-        if page.name == st.session_state.page:
-            page.print_page()
-            page.print_sidebar()
+    first_run = 'tracer' not in st.session_state
+    activate(get_tracer())
+    page = get_page(st.session_state.page)
+    with current_tracer().span(f"page.{page.name}"):
+        page.print_page()
+    page.print_sidebar()
+    # From the start of the script to the rendered page; first_run is the cold start of a session
+    current_tracer().record("app.script_run", time.perf_counter() - SCRIPT_START, page=page.name,
+                            first_run=first_run)
+    print_diagnostics()
 
 
 # main()
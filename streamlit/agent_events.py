@@ -0,0 +1,185 @@
+"""
+Decoding of Cortex Agent server-sent events (SSE).
+
+A non-streaming agent call returns the whole event stream as a JSON array of
+{"event": ..., "data": ...} objects. iter_sse_events produces the same objects
+from a live text/event-stream, one at a time as the lines arrive, and
+AgentResponseParser turns either into a typed AgentResponse.
+"""
+import json
+from dataclasses import asdict, dataclass, field
+
+
+def iter_sse_events(lines):
+    """
+    Decodes an iterable of SSE lines (str or bytes) into event dicts.
+
+    Events are dispatched on the blank line that ends them. JSON payloads are
+    decoded, anything else (e.g. "[DONE]") is passed through as a string.
+    """
+    event = None
+    data = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r\n")
+
+        if not line:
+            if data:
+                yield _make_event(event, data)
+            event, data = None, []
+            continue
+        if line.startswith(":"):
+            # Comment / keep-alive line
+            continue
+
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+    if data:
+        yield _make_event(event, data)
+
+
+def _make_event(event, data):
+    payload = "\n".join(data)
+    try:
+        payload = json.loads(payload)
+    except json.JSONDecodeError:
+        pass
+    return {"event": event or "message", "data": payload}
+
+
+@dataclass
+class SearchResult:
+    """One Cortex Search hit; every field besides the text is kept as metadata."""
+    text: str
+    metadata: dict = field(default_factory=dict)
+
+
+@dataclass
+class ToolResult:
+    """The JSON output of one tool call, e.g. Cortex Analyst SQL or Cortex Search hits."""
+    tool_name: str
+    tool_use_id: str
+    text: str = ""
+    sql: str = ""
+    search_results: list = field(default_factory=list)
+
+
+@dataclass
+class AgentResponse:
+    """Everything an agent answer contains, in arrival order."""
+    text: str = ""
+    interpretation: str = ""
+    tool_results: list = field(default_factory=list)
+
+    @property
+    def sql_statements(self) -> list:
+        return [result.sql for result in self.tool_results if result.sql]
+
+    @property
+    def search_results(self) -> list:
+        return [hit for result in self.tool_results for hit in result.search_results]
+
+    @property
+    def citation(self) -> str:
+        """Search hits as a bulleted string, the format the chat history stores."""
+        return "".join(f"\n• {hit.text}" for hit in self.search_results)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AgentResponse":
+        return cls(
+            text=data.get('text', ''),
+            interpretation=data.get('interpretation', ''),
+            tool_results=[
+                ToolResult(
+                    tool_name=result.get('tool_name', ''),
+                    tool_use_id=result.get('tool_use_id', ''),
+                    text=result.get('text', ''),
+                    sql=result.get('sql', ''),
+                    search_results=[SearchResult(**hit) for hit in result.get('search_results', [])],
+                )
+                for result in data.get('tool_results', [])
+            ],
+        )
+
+
+class AgentResponseParser:
+    """
+    Incremental parser for agent events.
+
+    Text fragments are collected in lists and only joined when the response
+    is read, so long answers parse in linear time. Feed it events one at a
+    time while streaming, or use parse_agent_response for a complete response.
+    """
+
+    def __init__(self):
+        self._text = []
+        self._interpretation = []
+        self._tool_results = []
+
+    def feed(self, event) -> bool:
+        """Consumes one event. Returns True if it added anything to the response."""
+        if event.get('event') != "message.delta":
+            return False
+        data = event.get('data') or {}
+        if not isinstance(data, dict):
+            return False
+
+        changed = False
+        for content_item in data.get('delta', {}).get('content', []):
+            content_type = content_item.get('type')
+            if content_type == 'text':
+                self._text.append(content_item.get('text', ''))
+                changed = True
+            elif content_type == "tool_results":
+                changed |= self._feed_tool_results(content_item.get('tool_results', {}))
+        return changed
+
+    def _feed_tool_results(self, tool_results) -> bool:
+        changed = False
+        for result in tool_results.get('content', []):
+            if result.get('type') != 'json':
+                continue
+            payload = result.get('json', {})
+            tool_result = ToolResult(
+                tool_name=tool_results.get('name', ''),
+                tool_use_id=tool_results.get('tool_use_id', ''),
+                text=payload.get('text', ''),
+                sql=payload.get('sql', ''),
+                search_results=[
+                    SearchResult(
+                        text=hit.get('text', ''),
+                        metadata={key: value for key, value in hit.items() if key != 'text'},
+                    )
+                    for hit in payload.get('searchResults', [])
+                ],
+            )
+            self._tool_results.append(tool_result)
+            self._interpretation.append(tool_result.text)
+            changed = True
+        return changed
+
+    @property
+    def response(self) -> AgentResponse:
+        return AgentResponse(
+            text="".join(self._text),
+            interpretation="".join(self._interpretation),
+            tool_results=list(self._tool_results),
+        )
+
+
+def parse_agent_response(events) -> AgentResponse:
+    """Parses a complete (non-streaming) agent response."""
+    parser = AgentResponseParser()
+    for event in events or []:
+        parser.feed(event)
+    return parser.response
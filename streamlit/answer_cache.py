@@ -0,0 +1,129 @@
+"""
+Answer cache for the Supply Chain Assistant.
+
+Answers are keyed on the normalized question text plus a knowledge version
+(semantic model file, search service and inventory data), so a new semantic
+model, a refreshed search index or new MFG_INVENTORY rows never serve a stale
+answer. Entries live in an in-memory LRU with a TTL and can optionally be
+backed by a Snowflake table shared across app instances.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from agent_events import AgentResponse
+
+# Words that change the phrasing but not the meaning of a question
+FILLER_WORDS = {
+    "please", "pls", "can", "could", "would", "you", "tell", "me", "show", "give", "i", "want", "to", "know",
+    "the", "a", "an", "us", "hey", "hi",
+}
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lower-cases the question, strips accents and punctuation and drops filler
+    words, so "Which plants are low on steel?" and "which plants are low on
+    steel" share an entry.
+    """
+    question = unicodedata.normalize("NFKD", question).encode("ascii", "ignore").decode("ascii").lower()
+    words = re.findall(r"[a-z0-9_.]+", question)
+    meaningful = [word.strip(".") for word in words if word.strip(".") and word.strip(".") not in FILLER_WORDS]
+    return " ".join(meaningful or words)
+
+
+def answer_cache_key(question: str, knowledge_version: str) -> str:
+    return hashlib.sha256(f"{normalize_question(question)}\x1f{knowledge_version}".encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Thread-safe LRU + TTL cache of AgentResponse objects.
+
+    Args:
+        max_entries: Least recently used answers are evicted beyond this size.
+        ttl_seconds: Answers older than this are treated as missing.
+        session: Optional Snowpark session for table backing.
+        table: Fully qualified name of the backing table (see
+            AGENT_ANSWER_CACHE in 1_supply_chain_ddl.sql). Ignored without a session.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600, session=None, table: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.session = session
+        self.table = table if session is not None else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._knowledge_version = None
+        self._lock = threading.Lock()
+
+    def get(self, question: str, knowledge_version: str):
+        """Returns the cached AgentResponse for the question, or None."""
+        key = answer_cache_key(question, knowledge_version)
+        with self._lock:
+            self._invalidate_if_stale(knowledge_version)
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+
+        response = self._load_from_table(key)
+        with self._lock:
+            if response is not None:
+                self._remember(key, response)
+                self.hits += 1
+            else:
+                self.misses += 1
+        return response
+
+    def put(self, question: str, knowledge_version: str, response: AgentResponse):
+        key = answer_cache_key(question, knowledge_version)
+        with self._lock:
+            self._invalidate_if_stale(knowledge_version)
+            self._remember(key, response)
+        self._save_to_table(key, question, response)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, response):
+        self._entries[key] = (time.time(), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _invalidate_if_stale(self, knowledge_version):
+        # Old entries can no longer be hit once the version moves on, so free them
+        if knowledge_version != self._knowledge_version:
+            self._entries.clear()
+            self._knowledge_version = knowledge_version
+
+    def _load_from_table(self, key):
+        if self.table is None:
+            return None
+        rows = self.session.sql(
+            f"SELECT RESPONSE FROM {self.table} "
+            "WHERE CACHE_KEY = ? AND CREATED_AT >= DATEADD(second, ?, CURRENT_TIMESTAMP()::TIMESTAMP_NTZ) "
+            "ORDER BY CREATED_AT DESC LIMIT 1",
+            params=[key, -int(self.ttl_seconds)],
+        ).collect()
+        if not rows:
+            return None
+        return AgentResponse.from_dict(json.loads(rows[0][0]))
+
+    def _save_to_table(self, key, question, response):
+        if self.table is None:
+            return
+        self.session.sql(
+            f"INSERT INTO {self.table} (CACHE_KEY, QUESTION, RESPONSE) SELECT ?, ?, PARSE_JSON(?)",
+            params=[key, question, json.dumps(response.to_dict())],
+        ).collect()
@@ -0,0 +1,416 @@
+"""
+Execution backends for the Supply Chain Assistant.
+
+The app talks to a Backend instead of calling get_active_session() and
+_snowflake directly. SnowflakeBackend is what runs in Streamlit in Snowflake.
+LocalBackend loads the data/*.csv files into an in-memory SQLite database
+behind a Snowpark-like session and answers agent requests with canned events,
+so the query, optimizer and agent parsing paths can be run and profiled on a
+laptop or CI box.
+
+Select the backend with the SUPPLY_CHAIN_BACKEND environment variable
+("snowflake" by default, or "local").
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from agent_events import iter_sse_events
+
+STREAM_CONNECT_TIMEOUT = 3  # in seconds, to tell quickly whether the app can reach the API directly
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LOCAL_DATA_DIR = os.path.join(REPO_DIR, "data")
+# Tables loaded from files outside LOCAL_DATA_DIR
+LOCAL_EXTRA_TABLES = {'CITY_DAILY_IMPERIAL': os.path.join(REPO_DIR, "weather", "supply_chain_weather_extended.csv")}
+# Date columns moved so their earliest value is today, like weather/update_weather_dates_extended.sql does in Snowflake
+LOCAL_CURRENT_DATES = {'CITY_DAILY_IMPERIAL': 'DATE'}
+# Local stand-ins for stage files, looked up by file name
+LOCAL_STAGE_DIRS = [os.path.join(REPO_DIR, "semantic")]
+
+
+class Backend(ABC):
+    """
+    A Snowpark-compatible session plus access to the Cortex Agents API.
+
+    Args:
+        api_endpoint: Path of the Cortex Agents API.
+        api_timeout: Agent request timeout in milliseconds.
+    """
+    name = None
+    session = None
+
+    def __init__(self, api_endpoint: str = "/api/v2/cortex/agent:run", api_timeout: int = 50000):
+        self.api_endpoint = api_endpoint
+        self.api_timeout = api_timeout
+        self.streaming = True  # Turned off for good once a streaming request cannot reach the API
+
+    @abstractmethod
+    def agent_request(self, payload: dict) -> list:
+        """Sends an agent request and returns its complete list of events."""
+        pass
+
+    @abstractmethod
+    def agent_stream(self, payload: dict):
+        """
+        Sends an agent request and returns an iterator of its events as they
+        arrive, or None if streaming is unavailable and agent_request has to
+        be used instead. Errors of a request that reached the API are raised.
+        """
+        pass
+
+
+class SnowflakeBackend(Backend):
+    name = "snowflake"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        import _snowflake
+        from snowflake.snowpark.context import get_active_session
+
+        self._snowflake = _snowflake
+        self.session = get_active_session()
+
+    def agent_request(self, payload: dict) -> list:
+        resp = self._snowflake.send_snow_api_request(
+            "POST",  # method
+            self.api_endpoint,  # path
+            {},  # headers
+            {},  # params
+            payload,  # body
+            None,  # request_guid
+            self.api_timeout,  # timeout in milliseconds,
+        )
+        try:
+            return json.loads(resp["content"])
+        except json.JSONDecodeError:
+            raise ValueError(f"Failed to parse API response (status {resp.get('status')}): {resp}") from None
+
+    def agent_stream(self, payload: dict):
+        """Streams over the REST API with the session's token."""
+        if not self.streaming:
+            return None
+        try:
+            import requests  # Only needed for streaming
+        except ImportError:
+            self.streaming = False
+            return None
+
+        connection = self.session.connection
+        try:
+            resp = requests.post(
+                f"https://{connection.host}{self.api_endpoint}",
+                json=payload,
+                headers={
+                    "Authorization": f'Snowflake Token="{connection.rest.token}"',
+                    "Content-Type": "application/json",
+                    "Accept": "text/event-stream",
+                },
+                stream=True,
+                timeout=(STREAM_CONNECT_TIMEOUT, self.api_timeout / 1000),
+            )
+        except requests.ConnectionError:
+            # Streamlit in Snowflake usually has no external network access; the request never
+            # reached the API, so it is safe to send it again the blocking way, now and from now on
+            self.streaming = False
+            return None
+        resp.raise_for_status()
+        return _iter_response_events(resp)
+
+
+def _iter_response_events(resp):
+    with resp:
+        yield from iter_sse_events(resp.iter_lines(decode_unicode=True))
+
+
+def canned_agent_events(text: str, sql: str = None, search_results: list = None) -> list:
+    """
+    Agent events in the shape the Cortex Agents API sends them: the tool results
+    (generated SQL or search hits) followed by the answer text.
+    """
+    events = []
+    if sql or search_results:
+        payload = {'text': "", 'sql': sql or "", 'searchResults': search_results or []}
+        events.append({'event': "message.delta", 'data': {'delta': {'content': [{
+            'type': "tool_results",
+            'tool_results': {
+                'name': "analyst1" if sql else "search1",
+                'tool_use_id': "local",
+                'content': [{'type': "json", 'json': payload}],
+            },
+        }]}}})
+    # The API sends the answer in small fragments
+    for fragment in re.findall(r"\S+\s*", text):
+        events.append({'event': "message.delta", 'data': {'delta': {'content': [{'type': "text", 'text': fragment}]}}})
+    events.append({'event': "done", 'data': "[DONE]"})
+    return events
+
+
+class LocalBackend(Backend):
+    """
+    Offline backend on SQLite and canned agent answers.
+
+    Args:
+        data_dir: Directory of <table>.csv files, loaded as upper-case tables.
+        agent_responses: Maps a question to its canned answer, either a list of
+            event dicts or the text of a recorded text/event-stream. Other
+            questions get a short text-only answer.
+        **kwargs: Backend arguments, accepted so both backends are created the same way.
+    """
+    name = "local"
+
+    def __init__(self, data_dir: str = LOCAL_DATA_DIR, agent_responses: dict = None, **kwargs):
+        super().__init__(**kwargs)
+        self.session = LocalSession(data_dir)
+        self.agent_responses = {_question_key(question): response
+                                for question, response in (agent_responses or {}).items()}
+
+    def agent_request(self, payload: dict) -> list:
+        question = payload['messages'][-1]['content'][0]['text']
+        response = self.agent_responses.get(_question_key(question))
+        if response is None:
+            return canned_agent_events(f"Offline answer for: {question}")
+        if isinstance(response, str):
+            return list(iter_sse_events(response.splitlines()))
+        return list(response)
+
+    def agent_stream(self, payload: dict):
+        return iter(self.agent_request(payload))
+
+
+def _question_key(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def get_backend(name: str = None, **kwargs) -> Backend:
+    """Returns the backend named by name or SUPPLY_CHAIN_BACKEND, "snowflake" by default."""
+    name = name or os.environ.get("SUPPLY_CHAIN_BACKEND", SnowflakeBackend.name)
+    backends = {SnowflakeBackend.name: SnowflakeBackend, LocalBackend.name: LocalBackend}
+    try:
+        backend = backends[name]
+    except KeyError:
+        raise ValueError(f"Unknown backend '{name}', expected one of {list(backends)}") from None
+    return backend(**kwargs)
+
+
+class LocalRow(tuple):
+    """Minimal snowflake.snowpark.Row: a tuple that also supports as_dict()."""
+
+    def __new__(cls, values, fields):
+        row = super().__new__(cls, values)
+        row._fields = fields
+        return row
+
+    def as_dict(self) -> dict:
+        return dict(zip(self._fields, self))
+
+
+class LocalSession:
+    """
+    The subset of snowflake.snowpark.Session the app uses, on in-memory SQLite.
+
+    Fully qualified names are reduced to the table name, and a few Snowflake
+    functions are rewritten or registered, so that the app's queries run
+    unchanged. Column names come back upper-case like unquoted Snowflake
+    identifiers. Generated SQL that uses other Snowflake-only syntax fails the
+    same way a bad statement does in Snowflake.
+    """
+
+    def __init__(self, data_dir: str = LOCAL_DATA_DIR):
+        self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        _register_functions(self._connection)
+        for file_name in sorted(os.listdir(data_dir)):
+            if file_name.endswith(".csv"):
+                table = os.path.splitext(file_name)[0].upper()
+                pd.read_csv(os.path.join(data_dir, file_name)).to_sql(table, self._connection, index=False)
+        for table, path in LOCAL_EXTRA_TABLES.items():
+            if os.path.exists(path):
+                frame = pd.read_csv(path)
+                if table in LOCAL_CURRENT_DATES:
+                    dates = pd.to_datetime(frame[LOCAL_CURRENT_DATES[table]])
+                    shifted = dates + (pd.Timestamp.today().normalize() - dates.min())
+                    frame[LOCAL_CURRENT_DATES[table]] = shifted.dt.strftime("%Y-%m-%d")
+                frame.to_sql(table, self._connection, index=False)
+        self.file = LocalFileOperation()
+
+    def sql(self, query: str, params=None) -> "LocalDataFrame":
+        return LocalDataFrame(self, query=_to_sqlite(query), params=params)
+
+    def create_dataframe(self, data) -> "LocalDataFrame":
+        return LocalDataFrame(self, frame=pd.DataFrame(data))
+
+    def table(self, name: str) -> "LocalDataFrame":
+        return self.sql(f"SELECT * FROM {name}")
+
+    def _read(self, query, params):
+        with self._lock:
+            frame = pd.read_sql_query(query, self._connection, params=params)
+        frame.columns = [column.upper() for column in frame.columns]
+        return frame
+
+    def _execute(self, query, params):
+        with self._lock:
+            for statement in _statements(query):
+                cursor = self._connection.execute(statement, params or [])
+            fields = [column[0].upper() for column in cursor.description or []]
+            rows = [LocalRow(values, fields) for values in cursor.fetchall()]
+            self._connection.commit()
+        return rows
+
+    def _save(self, frame, table, mode):
+        with self._lock:
+            frame.to_sql(_table_name(table), self._connection, index=False,
+                         if_exists="replace" if mode == "overwrite" else "append")
+
+
+class LocalDataFrame:
+    """A lazily executed query (or an in-memory frame) with the Snowpark DataFrame methods the app uses."""
+
+    def __init__(self, session: LocalSession, query: str = None, params=None, frame: pd.DataFrame = None):
+        self._session = session
+        self._query = query
+        self._params = params
+        self._frame = frame
+
+    def to_pandas(self, **kwargs) -> pd.DataFrame:
+        if self._frame is not None:
+            return self._frame.copy()
+        return self._session._read(self._query, self._params)
+
+    def to_pandas_batches(self, batch_size: int = 10000, **kwargs):
+        frame = self.to_pandas()
+        for start in range(0, len(frame), batch_size):
+            yield frame.iloc[start:start + batch_size].reset_index(drop=True)
+
+    def collect(self, **kwargs) -> list:
+        if self._frame is not None:
+            fields = list(self._frame.columns)
+            return [LocalRow(values, fields) for values in self._frame.itertuples(index=False, name=None)]
+        return self._session._execute(self._query, self._params)
+
+    def collect_nowait(self, **kwargs):
+        return LocalAsyncJob(self.collect())
+
+    @property
+    def write(self) -> "LocalWriter":
+        return LocalWriter(self)
+
+
+class LocalAsyncJob:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def is_done(self) -> bool:
+        return True
+
+    def result(self):
+        return self._rows
+
+
+class LocalWriter:
+    def __init__(self, dataframe: LocalDataFrame):
+        self._dataframe = dataframe
+        self._mode = "errorifexists"
+
+    def mode(self, save_mode: str) -> "LocalWriter":
+        self._mode = save_mode
+        return self
+
+    def save_as_table(self, table_name: str, **kwargs):
+        self._dataframe._session._save(self._dataframe.to_pandas(), table_name, self._mode)
+
+
+class LocalFileOperation:
+    """session.file: stage files are served from LOCAL_STAGE_DIRS by file name."""
+
+    def get_stream(self, stage_location: str, **kwargs):
+        file_name = stage_location.rsplit("/", 1)[-1]
+        for directory in LOCAL_STAGE_DIRS:
+            path = os.path.join(directory, file_name)
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    return io.BytesIO(file.read())
+        raise FileNotFoundError(f"No local copy of {stage_location} in {LOCAL_STAGE_DIRS}")
+
+
+def _table_name(name: str) -> str:
+    return name.rsplit(".", 1)[-1].upper()
+
+
+def _to_sqlite(query: str) -> str:
+    # DATABASE.SCHEMA.TABLE -> TABLE; dotted alias.column references have only one dot
+    query = re.sub(r"\b[A-Za-z_][A-Za-z0-9_$]*\.[A-Za-z_][A-Za-z0-9_$]*\.([A-Za-z_][A-Za-z0-9_$]*)\b", r"\1", query)
+    query = re.sub(r"\bCURRENT_TIMESTAMP\(\)", "CURRENT_TIMESTAMP", query, flags=re.IGNORECASE)
+    # Dates are ISO text; date arithmetic in days goes through DATE()
+    query = re.sub(r"\bCURRENT_DATE\(\)\s*([+-])\s*(\d+)\b", r"DATE('now', 'localtime', '\1\2 days')", query,
+                   flags=re.IGNORECASE)
+    query = re.sub(r"\bCURRENT_DATE\(\)", "DATE('now', 'localtime')", query, flags=re.IGNORECASE)
+    query = re.sub(r"::\s*[A-Za-z_]+(\([0-9, ]*\))?", "", query)  # Casts
+    query = re.sub(r"\bILIKE\b", "LIKE", query, flags=re.IGNORECASE)  # SQLite LIKE is case-insensitive
+    return query.rstrip().rstrip(";")
+
+
+_MERGE = re.compile(
+    r"^\s*MERGE\s+INTO\s+(?P<target>\S+)\s+AS\s+(?P<t>\w+)\s+USING\s+(?P<source>\S+)\s+AS\s+(?P<s>\w+)"
+    r"\s+ON\s+(?P<on>.+?)\s+WHEN\s+MATCHED\s+THEN\s+UPDATE\s+SET\s+(?P<set>.+?)"
+    r"\s+WHEN\s+NOT\s+MATCHED\s+THEN\s+INSERT\s*\((?P<columns>[^)]*)\)\s*VALUES\s*\((?P<values>[^)]*)\)\s*$",
+    re.IGNORECASE | re.DOTALL)
+
+
+def _statements(query: str) -> list:
+    """
+    SQLite has no MERGE, so a MERGE with one WHEN MATCHED UPDATE and one WHEN
+    NOT MATCHED INSERT clause runs as an UPDATE ... FROM and an INSERT of the
+    unmatched source rows. Any other statement runs as it is.
+    """
+    merge = _MERGE.match(query)
+    if merge is None:
+        return [query]
+    m = merge.groupdict()
+    return [
+        f"UPDATE {m['target']} AS {m['t']} SET {m['set']} FROM {m['source']} AS {m['s']} WHERE {m['on']}",
+        f"INSERT INTO {m['target']} ({m['columns']}) SELECT {m['values']} FROM {m['source']} AS {m['s']} "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {m['target']} AS {m['t']} WHERE {m['on']})",
+    ]
+
+
+class _HashAgg:
+    """Order-independent hash of a set of rows, like Snowflake's HASH_AGG."""
+
+    def __init__(self):
+        self.total = 0
+
+    def step(self, *values):
+        digest = hashlib.sha256(repr(values).encode("utf-8")).digest()
+        self.total = (self.total + int.from_bytes(digest[:8], "big")) % 2 ** 63
+
+    def finalize(self):
+        return self.total
+
+
+def _register_functions(connection):
+    """Snowflake semi-structured functions on JSON text, as used by the conversation store and answer cache."""
+    def array_slice(array, start, end):
+        return json.dumps(json.loads(array)[start:end])
+
+    connection.create_function("PARSE_JSON", 1, lambda text: text, deterministic=True)
+    connection.create_function("ARRAY_CONSTRUCT", 0, lambda: "[]", deterministic=True)
+    connection.create_function("ARRAY_SIZE", 1, lambda array: None if array is None else len(json.loads(array)),
+                               deterministic=True)
+    connection.create_function("ARRAY_CAT", 2, lambda a, b: json.dumps(json.loads(a) + json.loads(b)),
+                               deterministic=True)
+    connection.create_function("ARRAY_SLICE", 3, array_slice, deterministic=True)
+    # Like Snowflake, NULL if any argument is NULL
+    connection.create_function("GREATEST", 2, lambda a, b: None if a is None or b is None else max(a, b),
+                               deterministic=True)
+    connection.create_function("LEAST", 2, lambda a, b: None if a is None or b is None else min(a, b),
+                               deterministic=True)
+    connection.create_aggregate("HASH_AGG", -1, _HashAgg)
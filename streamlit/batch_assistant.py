@@ -0,0 +1,147 @@
+"""
+Concurrent answering of a list of assistant questions.
+
+Agent requests run on a bounded thread pool, and the SQL of each answer is
+handed to a second pool as soon as that answer arrives. A batch therefore
+takes about as long as its slowest question instead of the sum of all of them.
+Nothing here calls Streamlit: worker threads have no script run context, so
+the caller renders the BatchReport afterwards.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+BATCH_MAX_WORKERS = 4  # Concurrent agent requests
+BATCH_QUESTION_TIMEOUT = 120  # in seconds, per question once its request has started
+
+
+@dataclass
+class QuestionResult:
+    question: str
+    response: object = None  # AgentResponse
+    query_results: list = field(default_factory=list)  # sql_executor.QueryResult per generated statement
+    error: str = None
+    elapsed_seconds: float = 0.0
+
+
+@dataclass
+class BatchReport:
+    results: list
+    elapsed_seconds: float
+
+    @property
+    def summary(self) -> pd.DataFrame:
+        """One row per question, in the order the questions were asked."""
+        return pd.DataFrame([
+            {
+                'question': result.question,
+                'status': "error" if result.error else "answered",
+                'answer': result.error or (result.response.text if result.response else ""),
+                'sql_statements': len(result.query_results),
+                'rows': sum(query.row_count for query in result.query_results),
+                'seconds': round(result.elapsed_seconds, 2),
+            }
+            for result in self.results
+        ])
+
+    def to_markdown(self) -> str:
+        lines = ["# Supply chain checklist", "", f"{len(self.results)} questions in {self.elapsed_seconds:.1f}s", ""]
+        for result in self.results:
+            lines += [f"## {result.question}", ""]
+            if result.error:
+                lines += [f"**Error:** {result.error}", ""]
+                continue
+            if result.response and result.response.text:
+                lines += [result.response.text, ""]
+            for query in result.query_results:
+                lines += ["```sql", query.sql, "```", ""]
+                if query.error:
+                    lines += [f"**Error:** {query.error}", ""]
+                elif query.frame is not None:
+                    lines += [query.frame.to_csv(index=False), ""]
+        return "\n".join(lines)
+
+
+def run_question_batch(questions, ask, run_sql, max_workers: int = BATCH_MAX_WORKERS,
+                       timeout_seconds: float = BATCH_QUESTION_TIMEOUT) -> BatchReport:
+    """
+    Answers every question concurrently.
+
+    Args:
+        questions: Questions to ask, e.g. one per plant or business line.
+        ask: Callable taking a question and returning an AgentResponse.
+        run_sql: Callable taking a SQL statement and returning a sql_executor.QueryResult.
+        max_workers: Upper bound for concurrent agent requests and for concurrent SQL statements.
+        timeout_seconds: A question that has not finished this long after its
+            agent request started is reported as timed out.
+
+    Returns:
+        BatchReport with one QuestionResult per question, in input order.
+    """
+    start = time.perf_counter()
+    results = [QuestionResult(question=question) for question in questions]
+    started = {}
+    lock = threading.Lock()
+
+    def ask_one(index):
+        with lock:
+            started[index] = time.perf_counter()
+        return ask(results[index].question)
+
+    agent_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-agent")
+    sql_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-sql")
+    try:
+        # Each task runs in a copy of the caller's context, so tracing spans reach the caller's tracer
+        pending = {agent_pool.submit(contextvars.copy_context().run, ask_one, index): index
+                   for index in range(len(results))}
+        sql_pending = {}
+        while pending or sql_pending:
+            done, _ = wait(list(pending) + list(sql_pending), timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in pending:
+                    index = pending.pop(future)
+                    try:
+                        results[index].response = future.result()
+                    except Exception as e:
+                        results[index].error = str(e)
+                        results[index].elapsed_seconds = time.perf_counter() - started[index]
+                        continue
+                    # Run the answer's SQL right away, alongside the remaining agent requests
+                    for sql in results[index].response.sql_statements:
+                        sql_pending[sql_pool.submit(contextvars.copy_context().run, run_sql, sql)] = index
+                    if not results[index].response.sql_statements:
+                        results[index].elapsed_seconds = time.perf_counter() - started[index]
+                else:
+                    index = sql_pending.pop(future)
+                    try:
+                        results[index].query_results.append(future.result())
+                    except Exception as e:
+                        results[index].error = str(e)
+                    if index not in sql_pending.values():
+                        results[index].elapsed_seconds = time.perf_counter() - started[index]
+
+            # Give up on questions that ran past their timeout; their threads finish on their own
+            now = time.perf_counter()
+            with lock:
+                expired = {index for index, begin in started.items() if now - begin > timeout_seconds}
+            for waiting in (pending, sql_pending):
+                for future, index in list(waiting.items()):
+                    if index in expired:
+                        del waiting[future]
+                        future.cancel()
+                        results[index].error = f"Timed out after {timeout_seconds:g}s"
+                        results[index].elapsed_seconds = now - started[index]
+    finally:
+        agent_pool.shutdown(wait=False, cancel_futures=True)
+        sql_pool.shutdown(wait=False, cancel_futures=True)
+
+    # Statements of one answer can finish in any order; report them in the order they were generated
+    for result in results:
+        if result.response is not None and len(result.query_results) > 1:
+            order = {sql: position for position, sql in enumerate(result.response.sql_statements)}
+            result.query_results.sort(key=lambda query: order.get(query.sql, len(order)))
+    return BatchReport(results=results, elapsed_seconds=time.perf_counter() - start)
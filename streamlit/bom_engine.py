@@ -0,0 +1,168 @@
+"""
+Raw material requirements of open orders, from the bill of materials.
+
+compile_bom turns the BILL_OF_MATERIALS rows that are effective on a date into
+one sparse matrix of raw material units per unit of each product, with every
+component level and scrap factor already multiplied in. explode_requirements
+then multiplies plant-by-product order demand through that matrix in a single
+sparse product, so exploding a large catalog costs one matrix multiplication
+instead of a walk through the BOM tree per order line.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Every BOM line; filtered by EFFECTIVE_DATE and EXPIRATION_DATE in compile_bom
+BOM_QUERY = """
+    SELECT
+        parent_product_id,
+        parent_component_id,
+        child_material_id,
+        child_component_id,
+        quantity_required,
+        scrap_factor,
+        effective_date,
+        expiration_date
+    FROM
+        supply_chain_network_optimization_db.entities.bill_of_materials
+    """
+
+# Product demand of orders that still consume material, per plant
+OPEN_ORDER_DEMAND_QUERY = """
+    SELECT
+        mfg_plant_id,
+        product_id,
+        SUM(quantity) AS quantity
+    FROM
+        supply_chain_network_optimization_db.entities.orders
+    WHERE order_status IN ('Placed', 'In Production')
+    GROUP BY
+        mfg_plant_id,
+        product_id
+    """
+
+REQUIREMENT_COLUMNS = ['MFG_PLANT_ID', 'MATERIAL_ID', 'UNITS_REQUIRED']
+
+
+@dataclass
+class BomMatrix:
+    """Raw material units per unit of product, all BOM levels included."""
+    requirements: sparse.csr_matrix  # (products, materials)
+    products: pd.Index
+    materials: pd.Index
+    as_of: pd.Timestamp
+    levels: int  # Deepest component nesting below a product
+
+    def per_unit(self) -> pd.DataFrame:
+        """The matrix as one row per (product, material) pair."""
+        coo = self.requirements.tocoo()
+        return pd.DataFrame({
+            'PRODUCT_ID': self.products[coo.row],
+            'MATERIAL_ID': self.materials[coo.col],
+            'UNITS_PER_PRODUCT': coo.data,
+        })
+
+
+def compile_bom(bom_df_pd: pd.DataFrame, as_of=None) -> BomMatrix:
+    """
+    Compiles the BOM lines effective on a date into a requirements matrix.
+
+    Products and components are the rows of a direct-usage matrix D (child
+    components per unit of parent) and a material matrix M (raw materials per
+    unit of parent), both with quantities grossed up by (1 + SCRAP_FACTOR).
+    Items are grouped by their height, the longest chain of components below
+    them. Going up one height at a time, the requirements of a group are its
+    own materials plus its rows of D times the (already final) requirements
+    of its child components, so every BOM line is multiplied once.
+
+    Args:
+        bom_df_pd: The result of BOM_QUERY.
+        as_of: Lines are used if EFFECTIVE_DATE <= as_of < EXPIRATION_DATE;
+            defaults to today.
+
+    Returns:
+        A BomMatrix with one row per product.
+
+    Raises:
+        ValueError: If a component (indirectly) contains itself.
+    """
+    as_of = pd.Timestamp(as_of if as_of is not None else pd.Timestamp.today()).normalize()
+    effective = pd.to_datetime(bom_df_pd['EFFECTIVE_DATE'])
+    expiration = pd.to_datetime(bom_df_pd['EXPIRATION_DATE'])
+    lines = bom_df_pd[(effective.isna() | (effective <= as_of)) & (expiration.isna() | (expiration > as_of))]
+
+    # Products and components share one index; keys are tagged so equal ids don't collide
+    is_product = lines['PARENT_PRODUCT_ID'].notna() & lines['PARENT_COMPONENT_ID'].isna()
+    parent_keys = np.where(is_product, "P" + lines['PARENT_PRODUCT_ID'].astype("Int64").astype(str),
+                           "C" + lines['PARENT_COMPONENT_ID'].astype("Int64").astype(str))
+    has_component = lines['CHILD_COMPONENT_ID'].notna().to_numpy()
+    has_material = lines['CHILD_MATERIAL_ID'].notna().to_numpy()
+    component_keys = "C" + lines['CHILD_COMPONENT_ID'][has_component].astype("Int64").astype(str)
+    items = pd.Index(pd.unique(np.concatenate([parent_keys, component_keys.to_numpy()])))
+    materials = pd.Index(pd.unique(lines['CHILD_MATERIAL_ID'][has_material]))
+
+    quantity = (lines['QUANTITY_REQUIRED'].to_numpy(dtype=float)
+                * (1 + lines['SCRAP_FACTOR'].fillna(0).to_numpy(dtype=float)))
+    parents = items.get_indexer(parent_keys)
+    usage = sparse.csr_matrix(
+        (quantity[has_component], (parents[has_component], items.get_indexer(component_keys))),
+        shape=(len(items), len(items)))
+    material_usage = sparse.csr_matrix(
+        (quantity[has_material], (parents[has_material], materials.get_indexer(lines['CHILD_MATERIAL_ID'][has_material]))),
+        shape=(len(items), len(materials)))
+
+    height = _heights(usage)
+    order = np.argsort(height, kind='stable')
+    usage, material_usage = usage[order][:, order], material_usage[order]
+    bounds = np.searchsorted(height[order], np.arange(height.max(initial=0) + 2))
+
+    # Children always have a lower height, so their rows are final when a height is reached
+    total = material_usage[:bounds[1]]
+    for start, end in zip(bounds[1:-1], bounds[2:]):
+        total = sparse.vstack([total, material_usage[start:end] + usage[start:end, :start] @ total], format='csr')
+
+    product_rows = np.flatnonzero(items[order].str.startswith("P"))
+    products = pd.Index(items[order][product_rows].str[1:].astype(int), name='PRODUCT_ID')
+    return BomMatrix(total[product_rows], products, materials, as_of, int(height.max(initial=0)))
+
+
+def _heights(usage: sparse.csr_matrix) -> np.ndarray:
+    """Longest chain of child components below every item."""
+    parents, children = usage.nonzero()
+    height = np.zeros(usage.shape[0], dtype=int)
+    for _ in range(usage.shape[0] + 1):
+        updated = np.zeros_like(height)
+        np.maximum.at(updated, parents, height[children] + 1)
+        if np.array_equal(updated, height):
+            return height
+        height = updated
+    raise ValueError("The bill of materials contains a cycle")
+
+
+def explode_requirements(bom: BomMatrix, demand_df_pd: pd.DataFrame) -> pd.DataFrame:
+    """
+    Raw material units needed per plant for the given product demand.
+
+    Args:
+        bom: The compiled BOM.
+        demand_df_pd: MFG_PLANT_ID, PRODUCT_ID and QUANTITY columns, e.g. the
+            result of OPEN_ORDER_DEMAND_QUERY. Products without a BOM need no
+            raw materials.
+
+    Returns:
+        One row per (plant, material) with REQUIREMENT_COLUMNS.
+    """
+    product_codes = bom.products.get_indexer(demand_df_pd['PRODUCT_ID'])
+    known = product_codes >= 0
+    plant_codes, plants = pd.factorize(demand_df_pd['MFG_PLANT_ID'][known])
+    demand = sparse.csr_matrix(
+        (demand_df_pd['QUANTITY'].to_numpy(dtype=float)[known], (plant_codes, product_codes[known])),
+        shape=(len(plants), len(bom.products)))
+    requirements = (demand @ bom.requirements).tocoo()
+    return pd.DataFrame({
+        'MFG_PLANT_ID': np.asarray(plants)[requirements.row],
+        'MATERIAL_ID': bom.materials[requirements.col],
+        'UNITS_REQUIRED': requirements.data,
+    }, columns=REQUIREMENT_COLUMNS).sort_values(['MFG_PLANT_ID', 'MATERIAL_ID'], ignore_index=True)
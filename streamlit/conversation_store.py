@@ -0,0 +1,104 @@
+"""
+Conversation threads persisted in CONVERSATION_HISTORY.
+
+Each thread is one row whose MESSAGES VARIANT holds the JSON array of
+{"role": ..., "content": ...} messages, owned by the USER_NAME that started
+it. A store only lists, reads and writes the threads of its own user. New messages are buffered and appended
+to the array with ARRAY_CAT in one statement per flush, and reads use
+ARRAY_SLICE so only the requested page of messages leaves Snowflake.
+"""
+import json
+import uuid
+from dataclasses import dataclass
+
+THREAD_NAME_LENGTH = 60  # Characters of the first question used as thread name
+
+
+@dataclass
+class Thread:
+    conversation_id: str
+    thread_name: str
+    updated_at: object
+    message_count: int
+
+
+class ConversationStore:
+    """
+    Reads and writes conversation threads.
+
+    Args:
+        session: Snowpark session.
+        table: Fully qualified name of the CONVERSATION_HISTORY table.
+        user_name: The user whose threads are read and written.
+    """
+
+    def __init__(self, session, table: str, user_name: str):
+        self.session = session
+        self.table = table
+        self.user_name = user_name
+        self._pending = {}
+
+    def list_threads(self, limit: int = 20) -> list:
+        """Most recently updated threads first."""
+        rows = self.session.sql(
+            f"SELECT CONVERSATION_ID, THREAD_NAME, UPDATED_AT, ARRAY_SIZE(MESSAGES) FROM {self.table} "
+            "WHERE USER_NAME = ? ORDER BY UPDATED_AT DESC LIMIT ?",
+            params=[self.user_name, int(limit)],
+        ).collect()
+        return [Thread(row[0], row[1], row[2], row[3] or 0) for row in rows]
+
+    def create_thread(self, first_question: str) -> str:
+        conversation_id = str(uuid.uuid4())
+        name = " ".join(first_question.split())
+        if len(name) > THREAD_NAME_LENGTH:
+            name = name[:THREAD_NAME_LENGTH - 1] + "…"
+        self.session.sql(
+            f"INSERT INTO {self.table} (CONVERSATION_ID, USER_NAME, THREAD_NAME, MESSAGES) "
+            "SELECT ?, ?, ?, ARRAY_CONSTRUCT()",
+            params=[conversation_id, self.user_name, name or "New conversation"],
+        ).collect()
+        return conversation_id
+
+    def load_messages(self, conversation_id: str, count: int, end: int = None):
+        """
+        Loads up to count messages that precede position end (exclusive).
+
+        Args:
+            conversation_id: Thread to read.
+            count: Number of messages to load.
+            end: Index after the last message to load; None loads the newest messages.
+
+        Returns:
+            (messages, total) where total is the number of persisted messages in the thread.
+        """
+        if end is None:
+            slice_sql = "ARRAY_SLICE(MESSAGES, GREATEST(ARRAY_SIZE(MESSAGES) - ?, 0), ARRAY_SIZE(MESSAGES))"
+            params = [int(count)]
+        else:
+            slice_sql = "ARRAY_SLICE(MESSAGES, GREATEST(? - ?, 0), ?)"
+            params = [int(end), int(count), int(end)]
+        rows = self.session.sql(
+            f"SELECT {slice_sql}, ARRAY_SIZE(MESSAGES) FROM {self.table} WHERE CONVERSATION_ID = ? AND USER_NAME = ?",
+            params=params + [conversation_id, self.user_name],
+        ).collect()
+        if not rows or rows[0][0] is None:
+            return [], 0
+        return json.loads(rows[0][0]), rows[0][1] or 0
+
+    def append(self, conversation_id: str, message: dict):
+        """Buffers a message; it is written on the next flush."""
+        self._pending.setdefault(conversation_id, []).append(message)
+
+    def flush(self):
+        """Appends the buffered messages of every thread, one UPDATE per thread."""
+        while self._pending:
+            conversation_id, messages = next(iter(self._pending.items()))
+            self.session.sql(
+                f"UPDATE {self.table} "
+                "SET MESSAGES = ARRAY_CAT(COALESCE(MESSAGES, ARRAY_CONSTRUCT()), PARSE_JSON(?)), "
+                "UPDATED_AT = CURRENT_TIMESTAMP() "
+                "WHERE CONVERSATION_ID = ? AND USER_NAME = ?",
+                params=[json.dumps(messages), conversation_id, self.user_name],
+            ).collect()
+            # Only drop the buffer once it is written, so a failed flush can be retried
+            del self._pending[conversation_id]
@@ -0,0 +1,182 @@
+"""
+Fast-path routing of assistant questions to the semantic model's verified queries.
+
+The semantic model YAML lists verified_queries: vetted questions with their
+SQL. VerifiedQueryRouter indexes those questions and, when a new question is a
+close enough match, returns the verified SQL so the app can run it directly
+instead of calling the agent. Matching is deliberately conservative: a wrong
+fast-path answer is worse than a slower agent answer.
+"""
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+import yaml
+
+from answer_cache import normalize_question
+
+ROUTER_THRESHOLD = 0.85  # Minimum similarity to answer from a verified query
+ROUTER_MIN_MARGIN = 0.05  # Required lead over the second best verified query
+
+# Words that carry no meaning for matching, on top of the answer cache's filler words
+STOP_WORDS = {
+    "is", "are", "was", "were", "do", "does", "did", "we", "our", "there", "of", "in", "on", "at", "for",
+    "with", "what", "whats", "s", "have", "has", "which", "that", "this", "these", "those", "all", "any",
+}
+
+# Numbers and quoted strings change the answer, so they must match exactly
+LITERAL_PATTERN = re.compile(r"'([^']*)'|\"([^\"]*)\"|\b(\d+(?:\.\d+)?)\b")
+
+
+@dataclass
+class VerifiedQuery:
+    name: str
+    question: str
+    sql: str
+
+
+@dataclass
+class RouteMatch:
+    verified_query: VerifiedQuery
+    score: float
+
+
+def load_verified_queries(semantic_model_yaml: str) -> list:
+    """
+    Reads the verified queries from a semantic model YAML document.
+
+    The verified SQL uses the model's logical table names; they are replaced by
+    the fully qualified base tables so the SQL runs in any session schema.
+    """
+    model = yaml.safe_load(semantic_model_yaml) or {}
+    base_tables = {}
+    for table in model.get('tables', []):
+        base_table = table.get('base_table') or {}
+        if base_table:
+            base_tables[table['name'].upper()] = \
+                f"{base_table['database']}.{base_table['schema']}.{base_table['table']}"
+
+    def qualify(match):
+        return f"{match.group(1)} {base_tables.get(match.group(2).upper(), match.group(2))}"
+
+    return [
+        VerifiedQuery(
+            name=query.get('name', ''),
+            question=query['question'],
+            sql=re.sub(r"\b(FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)\b(?!\.)", qualify, query['sql'],
+                       flags=re.IGNORECASE),
+        )
+        for query in model.get('verified_queries', [])
+        if query.get('question') and query.get('sql')
+    ]
+
+
+def _tokens(question: str) -> list:
+    words = [word for word in normalize_question(question).split() if word not in STOP_WORDS]
+    # Light stemming so "plant" and "plants" or "order" and "orders" match
+    return [word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+            for word in words]
+
+
+def _features(question: str) -> Counter:
+    """Word unigrams and bigrams plus character trigrams, which absorb small spelling differences."""
+    tokens = _tokens(question)
+    features = Counter(f"w:{token}" for token in tokens)
+    features.update(f"b:{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    text = f" {' '.join(tokens)} "
+    features.update(f"c:{text[i:i + 3]}" for i in range(len(text) - 2))
+    return features
+
+
+def _literals(question: str) -> set:
+    return {next(group for group in match.groups() if group is not None).lower()
+            for match in LITERAL_PATTERN.finditer(question)}
+
+
+class VerifiedQueryRouter:
+    """
+    TF-IDF index over the verified questions.
+
+    Features that no verified question contains get the highest IDF, so a
+    question that differs in a distinguishing word (e.g. another business
+    line) scores well below the threshold. Also keeps thread-safe counters of
+    routed questions and the time saved compared to the agent.
+    """
+
+    def __init__(self, verified_queries, threshold: float = ROUTER_THRESHOLD,
+                 min_margin: float = ROUTER_MIN_MARGIN):
+        self.verified_queries = list(verified_queries)
+        self.threshold = threshold
+        self.min_margin = min_margin
+
+        features = [_features(query.question) for query in self.verified_queries]
+        document_frequency = Counter(feature for vector in features for feature in vector)
+        num_documents = len(features)
+        self._idf = {feature: math.log((1 + num_documents) / (1 + count)) + 1
+                     for feature, count in document_frequency.items()}
+        self._unseen_idf = math.log(1 + num_documents) + 1
+        self._vectors = [self._weigh(vector) for vector in features]
+        self._literals = [_literals(query.question) for query in self.verified_queries]
+
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.matches = 0
+        self.fast_path_seconds = 0.0
+        self.agent_calls = 0
+        self.agent_seconds = 0.0
+
+    def _weigh(self, features: Counter) -> dict:
+        vector = {feature: count * self._idf.get(feature, self._unseen_idf) for feature, count in features.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {feature: weight / norm for feature, weight in vector.items()}
+
+    def scores(self, question: str) -> list:
+        """Cosine similarity of the question to every verified question."""
+        vector = self._weigh(_features(question))
+        return [sum(weight * reference.get(feature, 0.0) for feature, weight in vector.items())
+                for reference in self._vectors]
+
+    def match(self, question: str):
+        """Returns the RouteMatch for a confident match, or None to fall back to the agent."""
+        if not self.verified_queries:
+            return None
+        scores = self.scores(question)
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        best = ranked[0]
+        runner_up = scores[ranked[1]] if len(ranked) > 1 else 0.0
+        if scores[best] < self.threshold or scores[best] - runner_up < self.min_margin:
+            return None
+        if _literals(question) != self._literals[best]:
+            return None
+        return RouteMatch(verified_query=self.verified_queries[best], score=scores[best])
+
+    def record_fast_path(self, seconds: float):
+        with self._lock:
+            self.questions += 1
+            self.matches += 1
+            self.fast_path_seconds += seconds
+
+    def record_agent_call(self, seconds: float):
+        with self._lock:
+            self.questions += 1
+            self.agent_calls += 1
+            self.agent_seconds += seconds
+
+    @property
+    def stats(self) -> dict:
+        """Match rate and the latency saved, estimated from the average agent call."""
+        with self._lock:
+            average_agent = self.agent_seconds / self.agent_calls if self.agent_calls else None
+            average_fast_path = self.fast_path_seconds / self.matches if self.matches else None
+            saved = (average_agent * self.matches - self.fast_path_seconds) if average_agent is not None else None
+            return {
+                'questions': self.questions,
+                'matches': self.matches,
+                'match_rate': self.matches / self.questions if self.questions else 0.0,
+                'average_fast_path_seconds': average_fast_path,
+                'average_agent_seconds': average_agent,
+                'seconds_saved': saved,
+            }
+
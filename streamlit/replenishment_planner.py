@@ -0,0 +1,461 @@
+"""
+Time-phased replenishment planning over a rolling horizon.
+
+The transfer optimizer solves a single snapshot: who is low and who has excess
+right now. This module models every (plant, material) inventory position over
+a horizon of daily or weekly buckets instead. Stock is drawn down by the usage
+implied by DAYS_FORWARD_COVERAGE, open orders (QUANTITY_ON_ORDER) arrive after
+MATERIAL_LEAD_TIME, supplier purchases arrive after the lead time plus its
+variability and transfers after TRANSFER_LEAD_TIME_DAYS.
+
+The plan rolls forward one bucket at a time: the window is solved, the orders
+of its first bucket are committed and the next window starts from the
+resulting inventory. Consecutive windows have the same variables and
+constraints, so the LP is built once and every window only changes its
+right-hand side. With highspy installed the same HiGHS instance is re-solved,
+warm-started from the previous basis; otherwise the prebuilt matrices are
+handed to scipy's linprog.
+"""
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+from solver_engines import SolveResult
+
+try:
+    import highspy
+except ImportError:  # Optional, see HorizonSolver
+    highspy = None
+
+BUCKET_DAYS = {'Daily': 1, 'Weekly': 7}
+TRANSFER_LEAD_TIME_DAYS = 3  # Plant-to-plant transit; SHIPMENT only covers customer deliveries
+HOLDING_COST_RATE = 0.25  # Yearly carrying cost as a share of the material cost
+SAFETY_STOCK_PENALTY_RATE = 0.05  # Per unit below safety stock and day, as a share of the material cost
+STOCKOUT_PENALTY_RATE = 5.0  # Per unit of usage that cannot be met, as a share of the material cost
+QUANTITY_TOLERANCE = 0.005  # Committed quantities are rounded to 2 decimals
+
+# One row per (plant, material) inventory position
+PLANNING_INVENTORY_QUERY = """
+    SELECT
+        i.mfg_plant_id,
+        i.material_id,
+        i.quantity_on_hand,
+        i.quantity_on_order,
+        i.safety_stock_level,
+        i.material_lead_time,
+        i.lead_time_variability,
+        i.days_forward_coverage,
+        rm.material_cost
+    FROM
+        supply_chain_network_optimization_db.entities.mfg_inventory AS i
+    JOIN supply_chain_network_optimization_db.entities.raw_material AS rm ON i.material_id = rm.material_id
+    ORDER BY
+        i.material_id,
+        i.mfg_plant_id
+    """
+
+# Every pair of plants stocking the same material; priced like LOW_EXCESS_QUERY
+# with transport_costs.TransportCostModel.add_transfer_costs
+PLANNING_LANES_QUERY = """
+    SELECT
+        s.mfg_plant_id AS source_plant_id,
+        d.mfg_plant_id AS destination_plant_id,
+        s.material_id,
+        rm.material_cost
+    FROM
+        supply_chain_network_optimization_db.entities.mfg_inventory AS s
+    JOIN supply_chain_network_optimization_db.entities.mfg_inventory AS d
+        ON s.material_id = d.material_id AND s.mfg_plant_id <> d.mfg_plant_id
+    JOIN supply_chain_network_optimization_db.entities.raw_material AS rm ON s.material_id = rm.material_id
+    ORDER BY
+        s.material_id,
+        s.mfg_plant_id,
+        d.mfg_plant_id
+    """
+
+REPLENISHMENT_ACTION_COLUMNS = [
+    'period',
+    'order_date',
+    'arrival_date',
+    'action_type',
+    'source_plant_id',
+    'destination_plant_id',
+    'material_id',
+    'quantity',
+    'cost',
+]
+
+PROJECTION_COLUMNS = [
+    'period',
+    'date',
+    'plant_id',
+    'material_id',
+    'on_hand',  # At the end of the period
+    'safety_stock',
+    'below_safety_stock',
+    'unmet_usage',
+]
+
+
+@dataclass
+class HorizonModel:
+    """
+    The LP of one planning window of `horizon` buckets.
+
+    Node n is a (plant, material) position. Its balance row for bucket t is
+    n * horizon + t, in A_eq; its safety stock row has the same index in A_ub.
+    Only b_eq depends on the state the window starts from, see window_rhs.
+    """
+    c: np.ndarray
+    A_ub: sparse.csr_matrix
+    b_ub: np.ndarray
+    A_eq: sparse.csr_matrix
+    horizon: int
+    bucket_days: int
+    plants: np.ndarray  # Per node
+    materials: np.ndarray  # Per node
+    material_cost: np.ndarray  # Per node
+    usage: np.ndarray  # Per node, units consumed per bucket
+    safety_stock: np.ndarray  # Per node
+    purchase_lead: np.ndarray  # Per node, in buckets
+    on_order_bucket: np.ndarray  # Per node, bucket the open order arrives in
+    lane_source: np.ndarray  # Per lane, source node
+    lane_destination: np.ndarray  # Per lane, destination node
+    lane_cost: np.ndarray  # Per lane, cost per unit
+    transfer_lead: int  # In buckets
+    # Variable blocks: inventory, shortfall below safety stock and unmet usage per
+    # node and bucket, then purchases and transfers for the buckets they arrive in time
+    inventory_vars: np.ndarray  # (nodes, horizon)
+    unmet_vars: np.ndarray  # (nodes, horizon)
+    purchase_vars: np.ndarray  # (nodes, horizon), -1 where the purchase would arrive after the horizon
+    transfer_vars: np.ndarray  # (lanes, horizon), -1 where the transfer would arrive after the horizon
+    upper: np.ndarray  # Per variable, upper bound; unmet usage is at most the usage, everything else unbounded
+
+    @property
+    def num_nodes(self):
+        return len(self.plants)
+
+    @property
+    def num_vars(self):
+        return len(self.c)
+
+
+@dataclass
+class ReplenishmentPlan:
+    actions: pd.DataFrame  # REPLENISHMENT_ACTION_COLUMNS, committed orders per period
+    projection: pd.DataFrame  # Inventory of every position at the end of every period
+    solver_stats: dict = field(default_factory=dict)
+
+    @property
+    def kpis(self) -> dict:
+        actions = self.actions
+        return {
+            'transfers': int((actions['action_type'] == 'TRANSFER').sum()),
+            'purchases': int((actions['action_type'] == 'PURCHASE').sum()),
+            'total_spend': float(actions['cost'].sum()),
+            'unmet_usage': float(self.projection['unmet_usage'].sum()),
+            'periods_below_safety_stock': int((self.projection['below_safety_stock'] > 0).sum()),
+        }
+
+
+def _buckets(days, bucket_days: int) -> np.ndarray:
+    return np.ceil(np.asarray(days, dtype=float) / bucket_days).astype(int)
+
+
+def build_horizon_model(inventory_df_pd: pd.DataFrame, lanes_df_pd: pd.DataFrame, horizon: int = 8,
+                        bucket_days: int = 7) -> HorizonModel:
+    """
+    Builds the LP of a planning window.
+
+    Each bucket's inventory is last bucket's inventory plus arrivals minus usage
+    and outgoing transfers. Unmet usage, shortfall below the safety stock and
+    inventory carried over a bucket are priced as shares of the material cost,
+    so the solver trades purchases and transfers against them.
+
+    Args:
+        inventory_df_pd: The result of PLANNING_INVENTORY_QUERY.
+        lanes_df_pd: The result of PLANNING_LANES_QUERY with TRANSFER_COST_PER_UNIT.
+        horizon: Number of buckets in a window.
+        bucket_days: Length of a bucket in days, e.g. 1 or 7.
+
+    Returns:
+        A HorizonModel; pass window_rhs of a starting state to HorizonSolver.solve.
+    """
+    inventory = inventory_df_pd.reset_index(drop=True)
+    num_nodes = len(inventory)
+    H = int(horizon)
+    material_cost = inventory['MATERIAL_COST'].to_numpy(dtype=float)
+    coverage = inventory['DAYS_FORWARD_COVERAGE'].to_numpy(dtype=float)
+    on_hand = inventory['QUANTITY_ON_HAND'].to_numpy(dtype=float)
+    # Coverage is how many days the stock on hand lasts, which gives the daily usage
+    usage = np.divide(on_hand, coverage, out=np.zeros(num_nodes), where=coverage > 0) * bucket_days
+    lead_time = inventory['MATERIAL_LEAD_TIME'].to_numpy(dtype=float)
+    # Purchases are planned against late deliveries, open orders against the expected lead time
+    purchase_lead = np.maximum(_buckets(lead_time + inventory['LEAD_TIME_VARIABILITY'].to_numpy(dtype=float),
+                                        bucket_days), 1)
+    on_order_bucket = np.clip(_buckets(lead_time, bucket_days) - 1, 0, None)
+    transfer_lead = max(int(_buckets(TRANSFER_LEAD_TIME_DAYS, bucket_days)), 1)
+
+    nodes = pd.MultiIndex.from_arrays([inventory['MFG_PLANT_ID'], inventory['MATERIAL_ID']])
+    lane_source = nodes.get_indexer(pd.MultiIndex.from_arrays(
+        [lanes_df_pd['SOURCE_PLANT_ID'], lanes_df_pd['MATERIAL_ID']]))
+    lane_destination = nodes.get_indexer(pd.MultiIndex.from_arrays(
+        [lanes_df_pd['DESTINATION_PLANT_ID'], lanes_df_pd['MATERIAL_ID']]))
+    known = (lane_source >= 0) & (lane_destination >= 0)
+    lane_source, lane_destination = lane_source[known], lane_destination[known]
+    lane_cost = lanes_df_pd['TRANSFER_COST_PER_UNIT'].to_numpy(dtype=float)[known]
+    num_lanes = len(lane_cost)
+
+    buckets = np.arange(H)
+    node_rows = np.arange(num_nodes)[:, None] * H + buckets  # (nodes, horizon) balance row per node and bucket
+    num_rows = num_nodes * H
+
+    # Variable indices, block after block
+    inventory_vars = np.arange(num_rows).reshape(num_nodes, H)
+    shortfall_vars = inventory_vars + num_rows
+    unmet_vars = shortfall_vars + num_rows
+    purchase_ok = buckets + purchase_lead[:, None] < H
+    purchase_vars = np.full((num_nodes, H), -1)
+    purchase_vars[purchase_ok] = 3 * num_rows + np.arange(purchase_ok.sum())
+    transfer_ok = np.broadcast_to(buckets + transfer_lead < H, (num_lanes, H))
+    transfer_vars = np.full((num_lanes, H), -1)
+    transfer_vars[transfer_ok] = 3 * num_rows + purchase_ok.sum() + np.arange(transfer_ok.sum())
+    num_vars = 3 * num_rows + int(purchase_ok.sum()) + int(transfer_ok.sum())
+
+    # Balance rows: inventory_t - inventory_t-1 - arrivals + outgoing - unmet = arrivals known up front - usage
+    carried = buckets[:-1]
+    purchase_node, purchase_bucket = np.nonzero(purchase_ok)
+    transfer_lane, transfer_bucket = np.nonzero(transfer_ok)
+    rows = np.concatenate([
+        node_rows.ravel(),
+        node_rows[:, carried + 1].ravel(),
+        node_rows.ravel(),
+        node_rows[purchase_node, purchase_bucket + purchase_lead[purchase_node]],
+        node_rows[lane_source[transfer_lane], transfer_bucket],
+        node_rows[lane_destination[transfer_lane], transfer_bucket + transfer_lead],
+    ])
+    cols = np.concatenate([
+        inventory_vars.ravel(),
+        inventory_vars[:, carried].ravel(),
+        unmet_vars.ravel(),
+        purchase_vars[purchase_ok],
+        transfer_vars[transfer_ok],
+        transfer_vars[transfer_ok],
+    ])
+    values = np.concatenate([
+        np.ones(num_rows),
+        -np.ones(num_nodes * (H - 1)),
+        -np.ones(num_rows),
+        -np.ones(len(purchase_node)),
+        np.ones(len(transfer_lane)),
+        -np.ones(len(transfer_lane)),
+    ])
+    A_eq = sparse.csr_matrix((values, (rows, cols)), shape=(num_rows, num_vars))
+
+    # Safety stock rows: inventory + shortfall >= safety stock
+    safety_stock = inventory['SAFETY_STOCK_LEVEL'].to_numpy(dtype=float)
+    A_ub = sparse.csr_matrix(
+        (-np.ones(2 * num_rows), (np.tile(np.arange(num_rows), 2),
+                                  np.concatenate([inventory_vars.ravel(), shortfall_vars.ravel()]))),
+        shape=(num_rows, num_vars))
+    b_ub = -np.repeat(safety_stock, H)
+
+    # Only usage can go unmet; more would add stock that never arrived
+    upper = np.full(num_vars, np.inf)
+    upper[unmet_vars] = usage[:, None]
+
+    node_cost = np.repeat(material_cost, H)
+    c = np.concatenate([
+        node_cost * HOLDING_COST_RATE * bucket_days / 365,
+        node_cost * SAFETY_STOCK_PENALTY_RATE * bucket_days,
+        node_cost * STOCKOUT_PENALTY_RATE,
+        material_cost[purchase_node],
+        lane_cost[transfer_lane],
+    ])
+
+    return HorizonModel(
+        c=c,
+        A_ub=A_ub,
+        b_ub=b_ub,
+        A_eq=A_eq,
+        horizon=H,
+        bucket_days=bucket_days,
+        plants=inventory['MFG_PLANT_ID'].to_numpy(),
+        materials=inventory['MATERIAL_ID'].to_numpy(),
+        material_cost=material_cost,
+        usage=usage,
+        safety_stock=safety_stock,
+        purchase_lead=purchase_lead,
+        on_order_bucket=on_order_bucket,
+        lane_source=lane_source,
+        lane_destination=lane_destination,
+        lane_cost=lane_cost,
+        transfer_lead=transfer_lead,
+        inventory_vars=inventory_vars,
+        unmet_vars=unmet_vars,
+        purchase_vars=purchase_vars,
+        transfer_vars=transfer_vars,
+        upper=upper,
+    )
+
+
+def window_rhs(model: HorizonModel, on_hand: np.ndarray, arrivals: np.ndarray) -> np.ndarray:
+    """
+    Balance row right-hand side of a window.
+
+    Args:
+        model: The HorizonModel.
+        on_hand: Inventory per node at the start of the window.
+        arrivals: (nodes, horizon) units already on their way, by arrival bucket.
+    """
+    b_eq = arrivals[:, :model.horizon] - model.usage[:, None]
+    b_eq[:, 0] += on_hand
+    return b_eq.ravel()
+
+
+class HorizonSolver:
+    """
+    Solves the windows of one HorizonModel, only updating the right-hand side.
+
+    With highspy, the model is passed to HiGHS once and every window changes
+    the balance row bounds and re-solves from the previous optimal basis. Without
+    it, every window is a cold linprog solve of the prebuilt matrices.
+    """
+
+    def __init__(self, model: HorizonModel):
+        self.model = model
+        self.backend = "highspy" if highspy is not None else "linprog"
+        self._highs = self._pass_model(model) if highspy is not None else None
+
+    @staticmethod
+    def _pass_model(model):
+        A = sparse.vstack([model.A_eq, model.A_ub]).tocsc()
+        num_eq = model.A_eq.shape[0]
+        lp = highspy.HighsLp()
+        lp.num_col_ = model.num_vars
+        lp.num_row_ = A.shape[0]
+        lp.col_cost_ = model.c
+        lp.col_lower_ = np.zeros(model.num_vars)
+        lp.col_upper_ = np.where(np.isinf(model.upper), highspy.kHighsInf, model.upper)
+        # Balance rows are fixed to their right-hand side in solve
+        lp.row_lower_ = np.concatenate([np.zeros(num_eq), np.full(len(model.b_ub), -highspy.kHighsInf)])
+        lp.row_upper_ = np.concatenate([np.zeros(num_eq), model.b_ub])
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        lp.a_matrix_.start_ = A.indptr
+        lp.a_matrix_.index_ = A.indices
+        lp.a_matrix_.value_ = A.data
+        h = highspy.Highs()
+        h.setOptionValue("output_flag", False)
+        h.passModel(lp)
+        return h
+
+    def solve(self, b_eq: np.ndarray) -> SolveResult:
+        model = self.model
+        if self._highs is None:
+            result = linprog(model.c, A_ub=model.A_ub, b_ub=model.b_ub, A_eq=model.A_eq, b_eq=b_eq,
+                             bounds=np.column_stack([np.zeros(model.num_vars), model.upper]), method="highs")
+            return SolveResult(result.status, result.message, result.x, result.fun, result.nit, self.backend)
+
+        h = self._highs
+        h.changeRowsBounds(len(b_eq), np.arange(len(b_eq), dtype=np.int32), b_eq, b_eq)
+        h.run()
+        status = h.getModelStatus()
+        info = h.getInfo()
+        if status != highspy.HighsModelStatus.kOptimal:
+            return SolveResult(2, h.modelStatusToString(status), None, None,
+                               info.simplex_iteration_count, self.backend)
+        return SolveResult(0, "Optimization terminated successfully.", np.asarray(h.getSolution().col_value),
+                           info.objective_function_value, info.simplex_iteration_count, self.backend)
+
+
+def plan_rolling_horizon(inventory_df_pd: pd.DataFrame, lanes_df_pd: pd.DataFrame, periods: int = 12,
+                         horizon: int = 8, bucket_days: int = 7, start_date=None) -> ReplenishmentPlan:
+    """
+    Plans purchases and transfers period by period over a rolling horizon.
+
+    Every period solves a window of `horizon` buckets starting at that period,
+    commits the orders placed in its first bucket and moves the inventory and
+    the orders in transit on to the next period.
+
+    Args:
+        inventory_df_pd: The result of PLANNING_INVENTORY_QUERY.
+        lanes_df_pd: The result of PLANNING_LANES_QUERY with TRANSFER_COST_PER_UNIT.
+        periods: Number of buckets to commit orders for.
+        horizon: Number of buckets every window looks ahead.
+        bucket_days: Length of a bucket in days, e.g. 1 or 7.
+        start_date: Date of the first bucket, defaults to today.
+
+    Returns:
+        A ReplenishmentPlan. solver_stats has a 'status' other than 0 and a
+        'message' if a window could not be solved; the plan then ends there.
+    """
+    start = time.perf_counter()
+    model = build_horizon_model(inventory_df_pd, lanes_df_pd, horizon, bucket_days)
+    solver = HorizonSolver(model)
+    built = time.perf_counter()
+    start_date = pd.Timestamp(start_date if start_date is not None else pd.Timestamp.today()).normalize()
+
+    num_nodes, H = model.num_nodes, model.horizon
+    on_hand = inventory_df_pd['QUANTITY_ON_HAND'].to_numpy(dtype=float)
+    # Units in transit by arrival bucket, relative to the current period
+    in_transit = np.zeros((num_nodes, H + int(max(model.purchase_lead.max(initial=0), model.transfer_lead))))
+    np.add.at(in_transit, (np.arange(num_nodes), model.on_order_bucket),
+              inventory_df_pd['QUANTITY_ON_ORDER'].to_numpy(dtype=float))
+
+    actions, projection = [], []
+    stats = {'backend': solver.backend, 'windows': 0, 'iterations': 0, 'status': 0,
+             'message': "Optimization terminated successfully.", 'variables': model.num_vars,
+             'constraints': model.A_eq.shape[0] + model.A_ub.shape[0]}
+    for period in range(int(periods)):
+        result = solver.solve(window_rhs(model, on_hand, in_transit))
+        stats['windows'] += 1
+        stats['iterations'] += int(result.nit or 0)
+        if result.status != 0:
+            stats.update(status=int(result.status), message=f"Period {period}: {result.message}")
+            break
+        x = result.x
+        order_date = start_date + pd.Timedelta(days=period * bucket_days)
+
+        # Commit the first bucket's orders
+        purchases = np.where(model.purchase_vars[:, 0] >= 0, x[model.purchase_vars[:, 0]], 0.0)
+        for node in np.flatnonzero(purchases > QUANTITY_TOLERANCE):
+            lead = model.purchase_lead[node]
+            actions.append((period, order_date, order_date + pd.Timedelta(days=int(lead) * bucket_days),
+                            'PURCHASE', None, model.plants[node], model.materials[node],
+                            round(purchases[node], 2), round(purchases[node], 2) * model.material_cost[node]))
+        transfers = np.where(model.transfer_vars[:, 0] >= 0, x[model.transfer_vars[:, 0]], 0.0)
+        for lane in np.flatnonzero(transfers > QUANTITY_TOLERANCE):
+            source, destination = model.lane_source[lane], model.lane_destination[lane]
+            actions.append((period, order_date, order_date + pd.Timedelta(days=model.transfer_lead * bucket_days),
+                            'TRANSFER', model.plants[source], model.plants[destination], model.materials[source],
+                            round(transfers[lane], 2), round(transfers[lane], 2) * model.lane_cost[lane]))
+
+        on_hand = x[model.inventory_vars[:, 0]]
+        unmet = x[model.unmet_vars[:, 0]]
+        projection.append(pd.DataFrame({
+            'period': period,
+            'date': order_date,
+            'plant_id': model.plants,
+            'material_id': model.materials,
+            'on_hand': np.round(on_hand, 2),
+            'safety_stock': model.safety_stock,
+            'below_safety_stock': np.round(np.clip(model.safety_stock - on_hand, 0, None), 2),
+            'unmet_usage': np.round(unmet, 2),
+        }, columns=PROJECTION_COLUMNS))
+
+        # Move to the next period: committed orders join the units in transit
+        in_transit = np.roll(in_transit, -1, axis=1)
+        in_transit[:, -1] = 0
+        np.add.at(in_transit, (np.arange(num_nodes), model.purchase_lead - 1), purchases)
+        np.add.at(in_transit, (model.lane_destination, model.transfer_lead - 1), transfers)
+
+    stats.update(build_seconds=built - start, solve_seconds=time.perf_counter() - built)
+    return ReplenishmentPlan(
+        actions=pd.DataFrame(actions, columns=REPLENISHMENT_ACTION_COLUMNS),
+        projection=pd.concat(projection, ignore_index=True) if projection else pd.DataFrame(columns=PROJECTION_COLUMNS),
+        solver_stats=stats,
+    )
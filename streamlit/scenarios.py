@@ -0,0 +1,219 @@
+"""
+What-if scenario sweeps for the transfer optimizer.
+
+The base tables are fetched from Snowflake once. Each scenario derives its own
+low/excess rows from them in pandas, with the same rules as LOW_EXCESS_QUERY
+plus its parameter overrides. The scenarios are then solved concurrently on a
+process pool. The base data is sent to each worker process once, not once per
+scenario.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from transfer_optimizer import TRANSFER_ACTION_COLUMNS, OptimizationResult, solve_transfers
+from transport_costs import TransportCostModel
+
+# The columns of the base tables that LOW_EXCESS_QUERY reads. Surcharges come
+# from a TransportCostModel, kept in the base data under TRANSPORT_COSTS.
+BASE_DATA_QUERIES = {
+    'MFG_INVENTORY': """
+        SELECT mfg_plant_id, material_id, quantity_on_hand, safety_stock_level,
+               days_forward_coverage, material_lead_time, lead_time_variability
+        FROM supply_chain_network_optimization_db.entities.mfg_inventory""",
+    'MFG_PLANT': """
+        SELECT mfg_plant_id, mfg_plant_name
+        FROM supply_chain_network_optimization_db.entities.mfg_plant""",
+    'RAW_MATERIAL': """
+        SELECT material_id, material_name, material_cost, business_line
+        FROM supply_chain_network_optimization_db.entities.raw_material""",
+}
+
+LOW_EXCESS_COLUMNS = [
+    'LOW_PLANT_ID',
+    'LOW_PLANT_NAME',
+    'MATERIAL_ID',
+    'MATERIAL_NAME',
+    'UNITS_NEEDED',
+    'MATERIAL_COST',
+    'BUSINESS_LINE',
+    'EXCESS_PLANT_ID',
+    'EXCESS_PLANT_NAME',
+    'AVAILABLE_TO_TRANSFER',
+    'TRANSFER_COST_PER_UNIT',
+]
+
+
+@dataclass(frozen=True)
+class Scenario:
+    """Parameter overrides of one what-if scenario. The defaults reproduce LOW_EXCESS_QUERY."""
+    name: str
+    surcharge_multiplier: float = 1.0  # Applied to every lane's transport surcharge
+    safety_stock_multiplier: float = 1.0  # Applied to SAFETY_STOCK_LEVEL before classifying low and excess
+    material_cost_multiplier: float = 1.0  # Applied to supplier prices, and so to transfer costs as well
+    offline_plants: tuple = ()  # Plants that neither ship nor receive materials
+
+
+@dataclass
+class ScenarioSweep:
+    scenarios: list
+    results: list  # OptimizationResult per scenario, in the same order
+    elapsed_seconds: float
+    lanes: list = field(default_factory=list)  # Low/excess rows per scenario
+
+    @property
+    def comparison(self) -> pd.DataFrame:
+        """One row per scenario; spend_vs_base is the difference to the first scenario."""
+        rows = []
+        for scenario, result, lanes in zip(self.scenarios, self.results, self.lanes):
+            kpis = result.kpis if result.status == 0 else {}
+            rows.append({
+                'scenario': scenario.name,
+                'status': "solved" if result.status == 0 else "failed",
+                'total_spend': kpis.get('total_spend', np.nan),
+                'total_savings': kpis.get('total_savings', np.nan),
+                'transfers': kpis.get('transfers'),
+                'purchases': kpis.get('purchases'),
+                'lanes': lanes,
+                'seconds': round(result.solver_stats.get('wall_seconds', 0.0), 3),
+                'message': result.message,
+            })
+        comparison = pd.DataFrame(rows)
+        if not comparison.empty:
+            comparison.insert(3, 'spend_vs_base', comparison['total_spend'] - comparison['total_spend'].iloc[0])
+        return comparison
+
+
+def fetch_base_data(session, transport_costs: TransportCostModel = None) -> dict:
+    """
+    Reads the base tables once; the result is shared by every scenario of a sweep.
+
+    Args:
+        session: A Snowpark session or a backends.LocalSession.
+        transport_costs: The surcharge model the optimizer uses as well; read
+            from the session if not given.
+    """
+    base_data = {table: session.sql(query).to_pandas() for table, query in BASE_DATA_QUERIES.items()}
+    base_data['TRANSPORT_COSTS'] = transport_costs or TransportCostModel.from_session(session)
+    return base_data
+
+
+def build_low_excess(base_data: dict, scenario: Scenario, requirements: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Derives the low/excess rows of a scenario from the base tables, with the
+    same rules and columns as LOW_EXCESS_QUERY.
+
+    Args:
+        base_data: The tables returned by fetch_base_data.
+        scenario: The overrides to apply.
+        requirements: Raw material units committed to open orders per plant,
+            e.g. from bom_engine.explode_requirements. They are taken out of
+            QUANTITY_ON_HAND, and the forward coverage shrinks with it, before
+            plants are classified as low or excess.
+
+    Returns:
+        One row per (low plant, material, excess plant) lane, ordered by low
+        plant name and material name.
+    """
+    inventory = base_data['MFG_INVENTORY']
+    if scenario.offline_plants:
+        inventory = inventory[~inventory['MFG_PLANT_ID'].isin(scenario.offline_plants)]
+    plants = base_data['MFG_PLANT']
+    materials = base_data['RAW_MATERIAL'].assign(
+        MATERIAL_COST=lambda frame: frame['MATERIAL_COST'] * scenario.material_cost_multiplier)
+
+    on_hand = inventory['QUANTITY_ON_HAND']
+    coverage = inventory['DAYS_FORWARD_COVERAGE']
+    if requirements is not None:
+        required = inventory[['MFG_PLANT_ID', 'MATERIAL_ID']].merge(
+            requirements, how='left', on=['MFG_PLANT_ID', 'MATERIAL_ID'])['UNITS_REQUIRED'].fillna(0).to_numpy()
+        net = on_hand - required
+        coverage = coverage * np.divide(net, on_hand, out=np.zeros(len(net)), where=on_hand.to_numpy() > 0)
+        on_hand = net
+    safety_stock = inventory['SAFETY_STOCK_LEVEL'] * scenario.safety_stock_multiplier
+    lead_time = inventory['MATERIAL_LEAD_TIME']
+
+    is_low = (on_hand < safety_stock) & (coverage <= lead_time + inventory['LEAD_TIME_VARIABILITY'])
+    low = (pd.DataFrame({
+        'LOW_PLANT_ID': inventory['MFG_PLANT_ID'],
+        'MATERIAL_ID': inventory['MATERIAL_ID'],
+        'UNITS_NEEDED': safety_stock * 2 - on_hand,
+    })[is_low]
+        .merge(plants.rename(columns={'MFG_PLANT_ID': 'LOW_PLANT_ID', 'MFG_PLANT_NAME': 'LOW_PLANT_NAME'}))
+        .merge(materials))
+
+    is_excess = (on_hand > 3 * safety_stock) & (coverage > 2 * lead_time)
+    excess = (pd.DataFrame({
+        'EXCESS_PLANT_ID': inventory['MFG_PLANT_ID'],
+        'MATERIAL_ID': inventory['MATERIAL_ID'],
+        'AVAILABLE_TO_TRANSFER': on_hand - safety_stock * 2,
+    })[is_excess]
+        .merge(plants.rename(columns={'MFG_PLANT_ID': 'EXCESS_PLANT_ID', 'MFG_PLANT_NAME': 'EXCESS_PLANT_NAME'})))
+
+    lanes = low.merge(excess, on='MATERIAL_ID')
+    lanes = lanes[(lanes['AVAILABLE_TO_TRANSFER'] > 0) & (lanes['UNITS_NEEDED'] > 0)]
+    lanes = base_data['TRANSPORT_COSTS'].add_transfer_costs(lanes, surcharge_multiplier=scenario.surcharge_multiplier)
+
+    return (lanes.sort_values(['LOW_PLANT_NAME', 'MATERIAL_NAME'], kind='stable')
+            .reset_index(drop=True)[LOW_EXCESS_COLUMNS])
+
+
+# Base data of a sweep in a worker process, set once per process by the pool initializer
+_worker_base_data = None
+
+
+def _set_worker_base_data(base_data):
+    global _worker_base_data
+    _worker_base_data = base_data
+
+
+def _solve_scenario(scenario: Scenario, engine: str, base_data: dict = None):
+    """Builds and solves one scenario. Materials are solved one after another, the scenarios are the parallel unit."""
+    start = time.perf_counter()
+    low_excess_df_pd = build_low_excess(base_data if base_data is not None else _worker_base_data, scenario)
+    if low_excess_df_pd.empty:
+        result = OptimizationResult(0, "No transfer opportunities found.",
+                                    pd.DataFrame(columns=TRANSFER_ACTION_COLUMNS))
+    else:
+        result = solve_transfers(low_excess_df_pd, engine=engine, partition_by="MATERIAL_ID", max_workers=1)
+    result.solver_stats['wall_seconds'] = time.perf_counter() - start
+    return result, len(low_excess_df_pd)
+
+
+def run_scenarios(base_data: dict, scenarios, engine: str = "min_cost_flow", max_workers: int = None,
+                  executor: str = "process") -> ScenarioSweep:
+    """
+    Solves every scenario concurrently.
+
+    Args:
+        base_data: The tables returned by fetch_base_data.
+        scenarios: Scenario objects; the first one is the baseline of the comparison.
+        engine: Solver engine name, "highs" or "min_cost_flow".
+        max_workers: Size of the worker pool, defaults to the number of CPUs.
+        executor: "process" for a process pool or "thread" for a thread pool.
+
+    Returns:
+        A ScenarioSweep with one OptimizationResult per scenario, in input order.
+    """
+    start = time.perf_counter()
+    scenarios = list(scenarios)
+    workers = min(max_workers or os.cpu_count() or 1, max(len(scenarios), 1))
+
+    if workers == 1:
+        solutions = [_solve_scenario(scenario, engine, base_data) for scenario in scenarios]
+    elif executor == "process":
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_base_data,
+                                 initargs=(base_data,)) as pool:
+            solutions = list(pool.map(_solve_scenario, scenarios, repeat(engine)))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            solutions = list(pool.map(partial(_solve_scenario, engine=engine, base_data=base_data), scenarios))
+
+    results, lanes = zip(*solutions) if solutions else ((), ())
+    return ScenarioSweep(scenarios, list(results), time.perf_counter() - start, list(lanes))
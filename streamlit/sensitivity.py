@@ -0,0 +1,160 @@
+"""
+What-if answers from the dual values of the last transfer plan.
+
+The optimizer can return shadow prices for every supply and demand and
+reduced costs for every lane (see transfer_optimizer.extract_sensitivity).
+With them, questions like "what is 100 more units of material 101 at plant
+1002 worth" are answered by a lookup instead of a re-solve. These answers are
+first-order: they hold as long as the change is small enough not to move the
+optimum to another plan.
+
+"When would lane 1002 -> 1024 stop being used" needs the range of the lane's
+cost, which the duals of a degenerate optimum do not give. The frame holds
+every supply, demand and lane of the plan, so only the lane's material is
+re-solved from it, and only for the lane that is asked about.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linprog
+
+from transfer_optimizer import SENSITIVITY_COLUMNS
+
+BREAK_EVEN_STEP = 1e-3  # Units forced off a used lane, or onto an unused one, to price its break-even cost
+
+
+@dataclass
+class WhatIfAnswer:
+    question: str
+    cost_change: float = None  # Change of the total spend, negative is a saving
+    break_even_unit_cost: float = None
+    answer: str = ""
+
+
+class SensitivityReport:
+    """
+    Answers what-if questions from a sensitivity frame.
+
+    Args:
+        sensitivity: A frame with SENSITIVITY_COLUMNS, e.g.
+            OptimizationResult.sensitivity or the TRANSFER_SENSITIVITY table.
+    """
+
+    def __init__(self, sensitivity: pd.DataFrame):
+        frame = sensitivity.copy()
+        frame.columns = [column.lower() for column in frame.columns]
+        self.frame = frame.reindex(columns=SENSITIVITY_COLUMNS)
+
+    @property
+    def empty(self) -> bool:
+        return self.frame.empty
+
+    def _rows(self, kind: str, **ids) -> pd.DataFrame:
+        mask = self.frame['kind'] == kind
+        for column, value in ids.items():
+            mask &= pd.to_numeric(self.frame[column], errors='coerce') == value
+        return self.frame[mask]
+
+    def supplies(self) -> pd.DataFrame:
+        """Supplies ordered by the value of one more unit, most valuable first."""
+        return self.frame[self.frame['kind'] == 'SUPPLY'].sort_values('shadow_price')
+
+    def demands(self) -> pd.DataFrame:
+        """Demands ordered by the cost of one more needed unit, most expensive first."""
+        return self.frame[self.frame['kind'] == 'DEMAND'].sort_values('shadow_price', ascending=False)
+
+    def lanes(self) -> pd.DataFrame:
+        """Transfer and purchase lanes with their break-even unit costs."""
+        return self.frame[self.frame['kind'].isin(['TRANSFER', 'PURCHASE'])]
+
+    def extra_supply(self, plant_id, material_id, units: float) -> WhatIfAnswer:
+        """Cost change if plant_id had units more of material_id available to transfer."""
+        question = f"{units:,.0f} more units of material {material_id} at plant {plant_id}"
+        rows = self._rows('SUPPLY', source_plant_id=plant_id, material_id=material_id)
+        if rows.empty:
+            return WhatIfAnswer(question, answer=f"Plant {plant_id} has no excess of material {material_id} in the plan.")
+        cost_change = float(rows['shadow_price'].iloc[0]) * units
+        if np.isclose(cost_change, 0):
+            answer = "The plan does not use all of this excess, so more of it saves nothing."
+        else:
+            answer = f"Saves about ${-cost_change:,.2f}, replacing more expensive transfers or purchases."
+        return WhatIfAnswer(question, cost_change, answer=answer)
+
+    def extra_demand(self, plant_id, material_id, units: float) -> WhatIfAnswer:
+        """Cost change if plant_id needed units more of material_id."""
+        question = f"{units:,.0f} more units of material {material_id} needed at plant {plant_id}"
+        rows = self._rows('DEMAND', destination_plant_id=plant_id, material_id=material_id)
+        if rows.empty:
+            return WhatIfAnswer(question, answer=f"Plant {plant_id} is not low on material {material_id} in the plan.")
+        cost_change = float(rows['shadow_price'].iloc[0]) * units
+        return WhatIfAnswer(question, cost_change, answer=f"Costs about ${cost_change:,.2f} more.")
+
+    def _break_even(self, lane: pd.Series) -> float:
+        """
+        Unit cost at which a lane starts (unused) or stops (used) carrying flow.
+
+        The lane's material is re-solved with the lane's flow bounded
+        BREAK_EVEN_STEP below its quantity, or above zero if unused. The
+        marginal of that bound is the cost of moving the next unit between
+        the lane and its alternatives, and it is unique because the bounded
+        optimum lies between the breakpoints of the cost curve.
+
+        Returns:
+            The break-even unit cost, NaN if the bounded material has no
+            solution, e.g. for an unused lane from a plant without excess.
+        """
+        material = pd.to_numeric(self.frame['material_id'], errors='coerce') == pd.to_numeric(lane['material_id'])
+        rows = self.frame[material]
+        routes = rows[rows['kind'].isin(['TRANSFER', 'PURCHASE'])].reset_index(drop=True)
+        supplies = rows[rows['kind'] == 'SUPPLY'].reset_index(drop=True)
+        demands = rows[rows['kind'] == 'DEMAND'].reset_index(drop=True)
+
+        # Purchases draw from the uncapacitated supplier; transfers from a plant without a SUPPLY row have nothing to send
+        transfers = np.flatnonzero(routes['kind'] == 'TRANSFER')
+        supply_rows = pd.Index(supplies['source_plant_id'].astype(str)).get_indexer(
+            routes['source_plant_id'].iloc[transfers].astype(str))
+        A_ub = sparse.csr_matrix((np.ones(len(transfers)), (np.where(supply_rows >= 0, supply_rows, len(supplies)),
+                                                            transfers)),
+                                 shape=(len(supplies) + 1, len(routes)))
+        b_ub = np.append(supplies['capacity'].to_numpy(dtype=float), 0.0)
+        demand_rows = pd.Index(demands['destination_plant_id'].astype(str)).get_indexer(
+            routes['destination_plant_id'].astype(str))
+        A_eq = sparse.csr_matrix((np.ones(len(routes)), (demand_rows, np.arange(len(routes)))),
+                                 shape=(len(demands), len(routes)))
+
+        var = np.flatnonzero((routes['kind'] == 'TRANSFER')
+                             & (routes['source_plant_id'].astype(str) == str(lane['source_plant_id']))
+                             & (routes['destination_plant_id'].astype(str) == str(lane['destination_plant_id'])))[0]
+        used = lane['quantity'] > 0
+        bounds = [(0, None)] * len(routes)
+        bounds[var] = (0, lane['quantity'] - BREAK_EVEN_STEP) if used else (BREAK_EVEN_STEP, None)
+        c = routes['unit_cost'].to_numpy(dtype=float)
+        result = linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=demands['capacity'].to_numpy(dtype=float),
+                         bounds=bounds, method="highs")
+        if result.status != 0:
+            return np.nan
+        marginal = result.upper.marginals[var] if used else result.lower.marginals[var]
+        return c[var] - marginal
+
+    def lane(self, source_plant_id, destination_plant_id, material_id) -> WhatIfAnswer:
+        """Unit cost at which a lane starts carrying flow, or stops carrying all of it."""
+        question = f"Lane {source_plant_id} -> {destination_plant_id} for material {material_id}"
+        rows = self._rows('TRANSFER', source_plant_id=source_plant_id,
+                          destination_plant_id=destination_plant_id, material_id=material_id)
+        if rows.empty:
+            return WhatIfAnswer(question, answer="The lane is not part of the plan.")
+        row = rows.iloc[0]
+        break_even = self._break_even(row)
+        if pd.isna(break_even):
+            if row['quantity'] > 0:
+                return WhatIfAnswer(question, answer="The lane has no alternative, it is used at any unit cost.")
+            return WhatIfAnswer(question, answer="The source plant has no excess left, the lane cannot be used.")
+        if row['quantity'] > 0:
+            answer = (f"Carries {row['quantity']:,.0f} units at ${row['unit_cost']:,.2f} per unit; "
+                      f"above ${break_even:,.2f} per unit an alternative becomes cheaper.")
+        else:
+            answer = (f"Unused at ${row['unit_cost']:,.2f} per unit; "
+                      f"it would be used below ${break_even:,.2f} per unit.")
+        return WhatIfAnswer(question, break_even_unit_cost=float(break_even), answer=answer)
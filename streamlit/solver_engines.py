@@ -0,0 +1,346 @@
+"""
+Solver backends for the transfer optimizer.
+
+Every engine takes a TransferModel from transfer_optimizer.py and returns a
+SolveResult. HiGHS solves the model as a generic LP; the min-cost-flow engine
+exploits that the model is a transportation problem, and hands anything that
+is not one back to HiGHS.
+"""
+import heapq
+from collections import deque
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog  # For linear programming
+from scipy.sparse.csgraph import connected_components
+
+FLOW_TOLERANCE = 1e-9
+REDUCED_COST_TOLERANCE = 1e-7
+
+
+@dataclass
+class SolveResult:
+    """Engine-independent subset of scipy's OptimizeResult."""
+    status: int  # 0 on success, 2 when infeasible (same codes as linprog)
+    message: str
+    x: np.ndarray
+    fun: float
+    nit: int
+    engine: str
+    # Dual values, only set by engines that produce them; scipy's sign convention
+    # (the change of fun per unit increase of the right-hand side / variable bound)
+    marginals_ub: np.ndarray = None  # Supply constraints
+    marginals_eq: np.ndarray = None  # Demand constraints
+    reduced_costs: np.ndarray = None  # x >= 0 bounds
+
+
+class SolverEngine(ABC):
+    name = None
+
+    @abstractmethod
+    def solve(self, model, duals: bool = False) -> SolveResult:
+        """Solves the model; with duals=True the result also carries the marginals."""
+        pass
+
+
+class HighsEngine(SolverEngine):
+    """Generic LP through scipy.optimize.linprog and the HiGHS solver."""
+    name = "highs"
+
+    def solve(self, model, duals: bool = False) -> SolveResult:
+        result = linprog(model.c, A_ub=model.A_ub, b_ub=model.b_ub, A_eq=model.A_eq, b_eq=model.b_eq,
+                         bounds=(0, None), method="highs")
+        # HiGHS returns the marginals with every solution, so they are kept whether asked for or not
+        ineqlin, eqlin, lower = (result.get(key) for key in ("ineqlin", "eqlin", "lower"))
+        return SolveResult(
+            status=result.status,
+            message=result.message,
+            x=result.x,
+            fun=result.fun,
+            nit=result.nit,
+            engine=self.name,
+            marginals_ub=None if ineqlin is None else ineqlin.marginals,
+            marginals_eq=None if eqlin is None else eqlin.marginals,
+            reduced_costs=None if lower is None else lower.marginals,
+        )
+
+
+class MinCostFlowEngine(SolverEngine):
+    """
+    Successive shortest path min-cost flow for the transportation structure of
+    the transfer model.
+
+    The flow algorithm does not produce dual values, so models solved with
+    duals=True go to the fallback engine.
+
+    Each variable is an arc from its supply row (A_ub) to its demand row (A_eq).
+    Variables without a supply row, i.e. supplier purchases in the arc
+    formulation, draw from an uncapacitated source. Demand must be met exactly
+    and every augmentation follows a cheapest path found with Dijkstra on
+    reduced costs, so the flow stays optimal at every step.
+    """
+    name = "min_cost_flow"
+
+    def __init__(self, fallback: SolverEngine = None):
+        self.fallback = fallback or HighsEngine()
+
+    def solve(self, model, duals: bool = False) -> SolveResult:
+        network = _transportation_network(model) if not duals else None
+        if network is None:
+            return self.fallback.solve(model, duals=duals)
+
+        var_supply, var_demand = network
+        supply_cap = np.asarray(model.b_ub, dtype=float)
+        demand = np.asarray(model.b_eq, dtype=float)
+        cost = np.asarray(model.c, dtype=float)
+
+        # Materials never share a supply or demand row, so each connected
+        # component is its own (much smaller) flow problem
+        demand_component, supply_component = _components(len(supply_cap), len(demand), var_supply, var_demand)
+        var_component = demand_component[var_demand]
+
+        flows = np.zeros(len(cost))
+        augmentations = 0
+        for component in np.unique(demand_component):
+            vars_in = np.flatnonzero(var_component == component)
+            demand_rows = np.flatnonzero(demand_component == component)
+            supply_rows = np.flatnonzero(supply_component == component)
+            component_flows, component_augmentations = _successive_shortest_path(
+                supply_cap=supply_cap[supply_rows],
+                demand=demand[demand_rows],
+                arc_supply=np.where(var_supply[vars_in] < 0, -1,
+                                    np.searchsorted(supply_rows, var_supply[vars_in])),
+                arc_demand=np.searchsorted(demand_rows, var_demand[vars_in]),
+                arc_cost=cost[vars_in],
+            )
+            augmentations += component_augmentations
+            if component_flows is None:
+                return SolveResult(
+                    status=2,
+                    message="The problem is infeasible: supply cannot cover demand.",
+                    x=None,
+                    fun=None,
+                    nit=augmentations,
+                    engine=self.name,
+                )
+            flows[vars_in] = component_flows
+
+        return SolveResult(
+            status=0,
+            message="Optimization terminated successfully.",
+            x=flows,
+            fun=float(model.c @ flows),
+            nit=augmentations,
+            engine=self.name,
+        )
+
+
+def _transportation_network(model):
+    """
+    Returns (var_supply, var_demand) row indices for each variable, with -1 for
+    variables that have no supply row, or None if the constraint matrices are
+    not those of a transportation problem.
+    """
+    num_vars = len(model.c)
+    if np.any(np.asarray(model.c) < 0) or np.any(np.asarray(model.b_ub) < 0) \
+            or np.any(np.asarray(model.b_eq) < 0):
+        return None
+
+    var_rows = []
+    for A in (model.A_ub, model.A_eq):
+        A = A.tocsc()
+        counts = np.diff(A.indptr)
+        if np.any(counts > 1) or np.any(A.data != 1):
+            return None
+        rows = np.full(num_vars, -1)
+        rows[counts == 1] = A.indices
+        var_rows.append(rows)
+
+    var_supply, var_demand = var_rows
+    if np.any(var_demand < 0):
+        return None
+    return var_supply, var_demand
+
+
+def _components(num_supply, num_demand, var_supply, var_demand):
+    """Connected components of the supply/demand rows, linked by capacitated arcs."""
+    capacitated = var_supply >= 0
+    graph = sparse.csr_matrix(
+        (np.ones(int(capacitated.sum())), (var_supply[capacitated], num_supply + var_demand[capacitated])),
+        shape=(num_supply + num_demand, num_supply + num_demand))
+    _, labels = connected_components(graph, directed=False)
+    return labels[num_supply:], labels[:num_supply]
+
+
+def _successive_shortest_path(supply_cap, demand, arc_supply, arc_demand, arc_cost):
+    """
+    Min-cost flow on source -> supply rows -> demand rows -> sink.
+
+    Each round runs Dijkstra on reduced costs to update the node potentials and
+    then pushes a blocking flow through the zero reduced cost edges, so one
+    shortest path search serves many augmentations. Returns the flow on every arc and the
+    number of augmentations, or None for the flows if the demand cannot be met.
+    """
+    num_supply = len(supply_cap)
+    num_demand = len(demand)
+    source = 0
+    unlimited = num_supply + 1  # Feeds arcs that have no supply row
+    first_demand = num_supply + 2
+    sink = first_demand + num_demand
+    num_nodes = sink + 1
+
+    # Residual graph as parallel edge lists; edge e ^ 1 is the reverse of e
+    head, cap, cost = [], [], []
+    adjacency = [[] for _ in range(num_nodes)]
+
+    def add_edge(u, v, capacity, unit_cost):
+        adjacency[u].append(len(head))
+        head.append(v)
+        cap.append(capacity)
+        cost.append(unit_cost)
+        adjacency[v].append(len(head))
+        head.append(u)
+        cap.append(0.0)
+        cost.append(-unit_cost)
+        return len(head) - 2
+
+    for r in range(num_supply):
+        if supply_cap[r] > FLOW_TOLERANCE:
+            add_edge(source, r + 1, float(supply_cap[r]), 0.0)
+    add_edge(source, unlimited, float("inf"), 0.0)
+
+    arc_edges = [
+        add_edge(unlimited if s < 0 else s + 1, first_demand + d, float("inf"), float(w))
+        for s, d, w in zip(arc_supply.tolist(), arc_demand.tolist(), arc_cost.tolist())
+    ]
+
+    remaining = 0.0
+    for d in range(num_demand):
+        if demand[d] > FLOW_TOLERANCE:
+            add_edge(first_demand + d, sink, float(demand[d]), 0.0)
+            remaining += float(demand[d])
+
+    # All costs are non-negative, so zero potentials are a valid start
+    potential = [0.0] * num_nodes
+    augmentations = 0
+    inf = float("inf")
+
+    while remaining > FLOW_TOLERANCE:
+        dist = [inf] * num_nodes
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d_u, u = heapq.heappop(heap)
+            if d_u > dist[u]:
+                continue
+            if u == sink:
+                break
+            p_u = potential[u]
+            for e in adjacency[u]:
+                if cap[e] <= FLOW_TOLERANCE:
+                    continue
+                v = head[e]
+                d_v = d_u + cost[e] + p_u - potential[v]
+                if d_v < dist[v] - 1e-12:
+                    dist[v] = d_v
+                    heapq.heappush(heap, (d_v, v))
+
+        dist_sink = dist[sink]
+        if dist_sink == inf:
+            return None, augmentations
+
+        # Capping at the sink distance keeps reduced costs non-negative for
+        # nodes that were not settled before the search stopped
+        for v in range(num_nodes):
+            potential[v] += min(dist[v], dist_sink)
+
+        # Push along every zero reduced cost path before searching again; all of
+        # them are shortest paths under the current potentials
+        while remaining > FLOW_TOLERANCE:
+            pushed, paths = _blocking_flow(adjacency, head, cap, cost, potential, source, sink, remaining)
+            if paths == 0:
+                break
+            remaining -= pushed
+            augmentations += paths
+
+    # Flow on an arc is the residual capacity of its reverse edge
+    flows = np.array([cap[e ^ 1] for e in arc_edges], dtype=float)
+    return flows, augmentations
+
+
+def _blocking_flow(adjacency, head, cap, cost, potential, source, sink, limit):
+    """
+    Dinic-style blocking flow on the residual edges with zero reduced cost.
+
+    Returns the amount pushed (at most limit) and the number of paths used.
+    """
+    def admissible(u, e):
+        return cap[e] > FLOW_TOLERANCE \
+            and abs(cost[e] + potential[u] - potential[head[e]]) <= REDUCED_COST_TOLERANCE
+
+    # Breadth-first levels keep the search from walking back over reverse edges
+    num_nodes = len(adjacency)
+    level = [-1] * num_nodes
+    level[source] = 0
+    queue = deque([source])
+    while queue:
+        u = queue.popleft()
+        for e in adjacency[u]:
+            v = head[e]
+            if level[v] < 0 and admissible(u, e):
+                level[v] = level[u] + 1
+                queue.append(v)
+    if level[sink] < 0:
+        return 0.0, 0
+
+    next_edge = [0] * num_nodes
+    pushed = 0.0
+    paths = 0
+    path = []
+    u = source
+    while pushed < limit - FLOW_TOLERANCE:
+        if u == sink:
+            push = min(limit - pushed, min(cap[e] for e in path))
+            for e in path:
+                cap[e] -= push
+                cap[e ^ 1] += push
+            pushed += push
+            paths += 1
+            path = []
+            u = source
+            continue
+
+        edges = adjacency[u]
+        while next_edge[u] < len(edges):
+            e = edges[next_edge[u]]
+            if level[head[e]] == level[u] + 1 and admissible(u, e):
+                break
+            next_edge[u] += 1
+        else:
+            if u == source:
+                break
+            # Dead end for the rest of this phase: step back to the parent
+            level[u] = -1
+            u = head[path.pop() ^ 1]
+            next_edge[u] += 1
+            continue
+        path.append(e)
+        u = head[e]
+
+    return pushed, paths
+
+
+SOLVER_ENGINES = {
+    HighsEngine.name: HighsEngine,
+    MinCostFlowEngine.name: MinCostFlowEngine,
+}
+
+
+def get_solver_engine(name: str) -> SolverEngine:
+    """Looks up a solver engine by name, e.g. "highs" or "min_cost_flow"."""
+    try:
+        return SOLVER_ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown solver engine '{name}', expected one of {list(SOLVER_ENGINES)}") from None
@@ -0,0 +1,93 @@
+"""
+Bounded execution of SQL the assistant did not write itself.
+
+Text-to-SQL output can select millions of rows or run for minutes. Every
+statement is wrapped with a row cap and runs under a statement timeout, and
+the result is fetched as Arrow-backed pandas batches, stopping as soon as the
+cap is reached.
+"""
+import hashlib
+import re
+import time
+from dataclasses import dataclass
+
+import pandas as pd
+
+from tracing import current_tracer
+
+SQL_MAX_ROWS = 10000  # Rows fetched at most per statement
+SQL_TIMEOUT_SECONDS = 60  # Snowflake cancels statements that run longer
+
+
+@dataclass
+class QueryResult:
+    sql: str
+    frame: pd.DataFrame = None
+    truncated: bool = False  # True if the statement returned more than max_rows rows
+    batches: int = 0
+    first_batch_seconds: float = None  # Roughly the warehouse time; the rest is transfer
+    elapsed_seconds: float = 0.0
+    error: str = None
+
+    @property
+    def row_count(self) -> int:
+        return 0 if self.frame is None else len(self.frame)
+
+
+def sql_hash(sql: str) -> str:
+    """Cache key for a statement, insensitive to whitespace and trailing semicolons."""
+    return hashlib.sha256(" ".join(_strip_statement(sql).split()).encode("utf-8")).hexdigest()
+
+
+def _strip_statement(sql: str) -> str:
+    return re.sub(r"[\s;]+$", "", sql.strip())
+
+
+def bounded_sql(sql: str, max_rows: int) -> str:
+    """
+    Wraps a query with a row cap. One row more than the cap is selected, so a
+    truncated result can be told apart from one that has exactly max_rows rows.
+    """
+    return f"SELECT * FROM (\n{_strip_statement(sql)}\n) LIMIT {int(max_rows) + 1}"
+
+
+def execute_bounded(session, sql: str, max_rows: int = SQL_MAX_ROWS,
+                    timeout_seconds: int = SQL_TIMEOUT_SECONDS) -> QueryResult:
+    """
+    Runs a query with a row cap and a statement timeout.
+
+    Args:
+        session: Snowpark session.
+        sql: The query, e.g. SQL generated by Cortex Analyst.
+        max_rows: Maximum number of rows returned.
+        timeout_seconds: STATEMENT_TIMEOUT_IN_SECONDS for the statement.
+
+    Returns:
+        QueryResult with at most max_rows rows, or with error set if the query
+        failed or timed out.
+    """
+    result = QueryResult(sql=sql)
+    with current_tracer().span("sql.bounded", max_rows=max_rows) as span:
+        start = time.perf_counter()
+        try:
+            batches = session.sql(bounded_sql(sql, max_rows)).to_pandas_batches(
+                statement_params={"STATEMENT_TIMEOUT_IN_SECONDS": int(timeout_seconds)})
+            frames = []
+            fetched = 0
+            for batch in batches:
+                if result.first_batch_seconds is None:
+                    result.first_batch_seconds = time.perf_counter() - start
+                frames.append(batch)
+                fetched += len(batch)
+                result.batches += 1
+                if fetched > max_rows:
+                    break
+            frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            result.truncated = len(frame) > max_rows
+            result.frame = frame.iloc[:max_rows]
+        except Exception as e:
+            result.error = str(e)
+        result.elapsed_seconds = time.perf_counter() - start
+        span.set(rows=result.row_count, batches=result.batches, truncated=result.truncated,
+                 first_batch_seconds=result.first_batch_seconds, error=result.error)
+    return result
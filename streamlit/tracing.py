@@ -0,0 +1,169 @@
+"""
+Lightweight tracing for the Supply Chain Assistant.
+
+A Tracer records timed spans (warehouse queries, agent round trips, optimizer
+phases) with their attributes. Spans opened inside another span on the same
+thread become its children. The recorded spans can be exported as JSON lines
+or as a DataFrame, e.g. to append them to a telemetry table.
+
+Instrumented code does not hold a tracer itself: it calls current_tracer(),
+which returns the tracer activated for the running context, or one that keeps
+nothing. Worker threads only see the tracer if they run in a copy of the
+caller's context (contextvars.copy_context()).
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+import pandas as pd
+
+MAX_SPANS = 1000  # Oldest spans are dropped beyond this
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_active_tracer = contextvars.ContextVar("active_tracer", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str = None
+    start_time: float = 0.0  # Unix time in seconds
+    duration_seconds: float = 0.0
+    attributes: dict = field(default_factory=dict)
+    error: str = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Thread-safe span recorder.
+
+    Args:
+        max_spans: Number of most recent spans kept in memory.
+    """
+
+    def __init__(self, max_spans: int = MAX_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Times the block as a span and yields it, so attributes known only
+        inside the block can be added with span.set(...). Exceptions are
+        recorded on the span and re-raised.
+        """
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start_time=time.time(),
+            attributes=dict(attributes),
+        )
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration_seconds = time.perf_counter() - start
+            _current_span.reset(token)
+            self._add(span)
+
+    def record(self, name: str, duration_seconds: float, **attributes) -> Span:
+        """
+        Adds a span for a duration measured elsewhere, e.g. solver phases timed
+        inside worker processes, as a child of the current span.
+        """
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            start_time=time.time() - duration_seconds,
+            duration_seconds=duration_seconds,
+            attributes=dict(attributes),
+        )
+        self._add(span)
+        return span
+
+    def _add(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    @property
+    def spans(self) -> list:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def to_json_lines(self) -> str:
+        return "".join(json.dumps(asdict(span), default=str, sort_keys=True) + "\n" for span in self.spans)
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per span, attributes as a JSON string, e.g. for a telemetry table."""
+        return pd.DataFrame([
+            {
+                'TRACE_ID': span.trace_id,
+                'SPAN_ID': span.span_id,
+                'PARENT_ID': span.parent_id,
+                'NAME': span.name,
+                'START_TIME': pd.Timestamp(span.start_time, unit="s"),
+                'DURATION_MS': span.duration_seconds * 1000,
+                'ATTRIBUTES': json.dumps(span.attributes, default=str, sort_keys=True),
+                'ERROR': span.error,
+            }
+            for span in self.spans
+        ], columns=['TRACE_ID', 'SPAN_ID', 'PARENT_ID', 'NAME', 'START_TIME', 'DURATION_MS', 'ATTRIBUTES', 'ERROR'])
+
+    def summary(self) -> pd.DataFrame:
+        """Count and total, mean and max duration in milliseconds per span name."""
+        frame = self.to_frame()
+        if frame.empty:
+            return pd.DataFrame(columns=['NAME', 'COUNT', 'TOTAL_MS', 'MEAN_MS', 'MAX_MS'])
+        return (frame.groupby('NAME')['DURATION_MS']
+                .agg(COUNT='count', TOTAL_MS='sum', MEAN_MS='mean', MAX_MS='max')
+                .sort_values('TOTAL_MS', ascending=False)
+                .reset_index())
+
+
+# Used when no tracer is active: spans are timed but not kept
+NULL_TRACER = Tracer(max_spans=0)
+
+
+def activate(tracer: Tracer):
+    """Makes tracer the one current_tracer() returns in this context."""
+    _active_tracer.set(tracer)
+
+
+def current_tracer() -> Tracer:
+    return _active_tracer.get() or NULL_TRACER
+
+
+def traced(name: str):
+    """Decorator that runs every call of the function in a span of the current tracer."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with current_tracer().span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
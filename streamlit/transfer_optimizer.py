@@ -0,0 +1,729 @@
+"""
+Model building and solving for the plant-to-plant transfer optimizer.
+
+The Streamlit app fetches the low/excess inventory rows from Snowflake and hands
+them to this module as a pandas DataFrame. Everything here is plain NumPy/SciPy
+so it can be imported outside of Snowflake as well.
+"""
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from solver_engines import get_solver_engine
+
+SUPPLIER_ID = "999"  # Use '999' as the supplier ID
+SUPPLIER_CAPACITY = 1e9  # Large number for Supplier
+IMPOSSIBLE_TRANSFER_COST = 1e9  # Very high cost for impossible transfers
+# Below this many low/excess rows the subproblems are solved one after another:
+# starting a worker pool takes longer than solving them
+PARALLEL_MIN_LANES = 200
+
+# Low/excess inventory rows the optimizer takes as input, one row per
+# (low plant, material, excess plant) lane. The replenishment points are spelled
+# out instead of referenced by alias so the query also runs on the local backend.
+# TRANSFER_COST_PER_UNIT is added by transport_costs.TransportCostModel, which
+# keeps the surcharges in memory instead of joining them into every read.
+# Callers may add an OBJECTIVE_COST_PER_UNIT column, e.g. with a risk penalty,
+# that the optimizer minimizes instead while actions report the real cost. Rows
+# without an EXCESS_PLANT_ID only carry their demand, which is then purchased.
+LOW_EXCESS_QUERY = """
+    WITH low_inventory AS (
+        SELECT
+            l.mfg_plant_id AS low_plant_id,
+            mp.mfg_plant_name AS low_plant_name,  -- Keep names for reporting
+            l.material_id,
+            rm.material_name,
+            l.quantity_on_hand AS low_qty,
+            l.safety_stock_level,
+            rm.material_cost,
+            rm.business_line,
+            l.safety_stock_level * 2 AS low_replenishment_point,
+            (l.safety_stock_level * 2 - l.quantity_on_hand) AS units_needed
+        FROM
+            supply_chain_network_optimization_db.entities.mfg_inventory AS l
+        JOIN supply_chain_network_optimization_db.entities.mfg_plant AS mp ON l.mfg_plant_id = mp.mfg_plant_id
+        JOIN supply_chain_network_optimization_db.entities.raw_material AS rm ON l.material_id = rm.material_id
+        WHERE l.quantity_on_hand < l.safety_stock_level
+        AND l.days_forward_coverage <= l.material_lead_time + l.lead_time_variability
+    ), excess_inventory AS (
+        SELECT
+            e.mfg_plant_id AS excess_plant_id,
+            mp.mfg_plant_name AS excess_plant_name,  -- Keep names for reporting
+            e.material_id,
+            e.quantity_on_hand AS excess_qty,
+            e.safety_stock_level,
+            e.safety_stock_level * 2 AS excess_replenishment_point,
+            (e.quantity_on_hand - e.safety_stock_level * 2) AS available_to_transfer
+        FROM
+            supply_chain_network_optimization_db.entities.mfg_inventory AS e
+        JOIN supply_chain_network_optimization_db.entities.mfg_plant AS mp ON e.mfg_plant_id = mp.mfg_plant_id
+        WHERE e.quantity_on_hand > 3 * e.safety_stock_level
+        AND e.days_forward_coverage > 2 * e.material_lead_time
+    )
+    SELECT
+        l.low_plant_id,
+        l.low_plant_name,
+        l.material_id,
+        l.material_name,
+        l.units_needed,
+        l.material_cost,
+        l.business_line,
+        e.excess_plant_id,
+        e.excess_plant_name,
+        e.available_to_transfer
+    FROM
+        low_inventory AS l
+    LEFT JOIN excess_inventory AS e ON l.material_id = e.material_id
+    WHERE e.available_to_transfer > 0  AND l.units_needed > 0 -- Ensure positive transfer amounts
+    ORDER BY
+        l.low_plant_name,
+        l.material_name;
+    """
+
+# Materials with an MFG_INVENTORY row updated after the given LAST_UPDATED_TIMESTAMP
+CHANGED_MATERIALS_QUERY = """
+    SELECT DISTINCT material_id
+    FROM supply_chain_network_optimization_db.entities.mfg_inventory
+    WHERE last_updated_timestamp > ?
+    """
+
+# "arc" only creates variables for lanes that exist in the data, "cube" creates
+# one for every (low plant, excess plant, material) combination
+FORMULATIONS = ("arc", "cube")
+
+TRANSFER_ACTION_COLUMNS = [
+    'action_type',
+    'source_plant_id',
+    'destination_plant_id',
+    'material_id',
+    'transfer_quantity',
+    'transfer_cost',
+    'savings',
+    'transfer_id',
+    'transfer_date',
+]
+
+# Dual values of a solve, one row per supply constraint (SUPPLY), demand
+# constraint (DEMAND) and transfer or purchase variable (TRANSFER, PURCHASE)
+SENSITIVITY_COLUMNS = [
+    'kind',
+    'source_plant_id',
+    'destination_plant_id',
+    'material_id',
+    'quantity',  # Units shipped from the supply, needed by the demand, or moved on the lane
+    'capacity',  # AVAILABLE_TO_TRANSFER of a supply, UNITS_NEEDED of a demand
+    'unit_cost',  # Cost per unit the optimizer minimizes, OBJECTIVE_COST_PER_UNIT if given
+    'shadow_price',  # Change of the total cost per extra unit of capacity
+    'reduced_cost',  # Amount the unit cost of an unused lane has to drop before it is used
+    'break_even_unit_cost',  # Unit cost below which an unused lane starts carrying flow
+]
+
+# Identifies an action across runs; re-optimized actions keep the transfer_id of the action they replace
+TRANSFER_ACTION_KEY = ['action_type', 'source_plant_id', 'destination_plant_id', 'material_id']
+
+
+@dataclass
+class TransferModel:
+    """
+    Sparse linear program for the transfer problem plus the lookups needed to
+    turn a solution vector back into transfer/purchase actions.
+
+    Every decision variable moves one material from a source (an excess plant or
+    the supplier) to a low plant. The var_* arrays are aligned with c.
+    """
+    c: np.ndarray
+    A_ub: sparse.csr_matrix
+    b_ub: np.ndarray
+    A_eq: sparse.csr_matrix
+    b_eq: np.ndarray
+    low_plants: np.ndarray
+    excess_plants: np.ndarray  # Supplier is the last entry
+    materials: np.ndarray
+    material_cost: np.ndarray  # Indexed by material position
+    var_low: np.ndarray
+    var_excess: np.ndarray
+    var_material: np.ndarray
+    var_is_purchase: np.ndarray
+    var_is_lane: np.ndarray  # Transfer variables backed by a low/excess row
+    unit_cost: np.ndarray = None  # Real cost per unit of each variable, if c includes objective-only penalties
+
+    @property
+    def num_vars(self):
+        return len(self.c)
+
+
+@dataclass
+class OptimizationResult:
+    """
+    Outcome of an optimization run: the plan, its KPIs and solver statistics,
+    kept in memory so callers don't need to read the plan back from Snowflake.
+    """
+    status: int  # 0 on success
+    message: str
+    transfer_actions: pd.DataFrame = None
+    solver_stats: dict = field(default_factory=dict)
+    sensitivity: pd.DataFrame = None  # SENSITIVITY_COLUMNS, if requested
+
+    @property
+    def kpis(self) -> dict:
+        actions = self.transfer_actions
+        if actions is None or actions.empty:
+            return {'transfers': 0, 'purchases': 0, 'total_spend': 0.0, 'total_savings': 0.0}
+        return {
+            'transfers': int((actions['action_type'] == 'TRANSFER').sum()),
+            'purchases': int((actions['action_type'] == 'PURCHASE').sum()),
+            'total_spend': float(actions['transfer_cost'].sum()),
+            'total_savings': float(actions['savings'].sum()),
+        }
+
+
+@dataclass
+class PlanSnapshot:
+    """
+    A solved plan and what it was solved from, the starting point of the next
+    incremental re-optimization.
+    """
+    data_version: str  # MAX(LAST_UPDATED_TIMESTAMP) of MFG_INVENTORY the plan was solved against
+    materials: frozenset  # Materials in the low/excess rows the plan was solved from
+    transfer_actions: pd.DataFrame
+    solver_options: dict = field(default_factory=dict)  # Plans are only reused under the same options
+    sensitivity: pd.DataFrame = None
+
+
+def _first_rows(*codes):
+    """Boolean mask of the first row for each distinct combination of codes."""
+    return ~pd.DataFrame({i: code for i, code in enumerate(codes)}).duplicated().to_numpy()
+
+
+def build_transfer_model(low_excess_df_pd: pd.DataFrame, formulation: str = "arc") -> TransferModel:
+    """
+    Builds the transfer LP from the low/excess inventory rows.
+
+    The rows are indexed once with pd.factorize and the cost vector and
+    constraint matrices are filled through index arithmetic, so the model is
+    built in time proportional to its size instead of scanning the DataFrame
+    for every (low plant, material, excess plant) cell.
+
+    Args:
+        low_excess_df_pd: The result of LOW_EXCESS_QUERY with TRANSFER_COST_PER_UNIT, as a pandas DataFrame.
+            An OBJECTIVE_COST_PER_UNIT column, if present, is the cost of each
+            lane in c; TRANSFER_COST_PER_UNIT stays the cost in unit_cost.
+        formulation: "arc" creates one variable per (low plant, excess plant,
+            material) lane in the data plus one supplier purchase per (low plant,
+            material) demand. "cube" creates a variable for every combination and
+            prices the impossible ones at IMPOSSIBLE_TRANSFER_COST.
+
+    Returns:
+        A TransferModel ready to be passed to solve_transfer_model.
+    """
+    if formulation not in FORMULATIONS:
+        raise ValueError(f"Unknown formulation '{formulation}', expected one of {FORMULATIONS}")
+
+    low_codes, low_plants = pd.factorize(low_excess_df_pd['LOW_PLANT_ID'])
+    material_codes, materials = pd.factorize(low_excess_df_pd['MATERIAL_ID'])
+    excess_codes, excess_plants = pd.factorize(low_excess_df_pd['EXCESS_PLANT_ID'])
+
+    # --- Add Supplier as an "Excess Plant" ---
+    excess_plants = np.append(np.asarray(excess_plants, dtype=object), SUPPLIER_ID)
+
+    # Cost from supplier is just the material cost of the first row for the material
+    first_material = _first_rows(material_codes)
+    material_cost = np.zeros(len(materials))
+    material_cost[material_codes[first_material]] = \
+        low_excess_df_pd['MATERIAL_COST'].to_numpy(dtype=float)[first_material]
+
+    # Only the first row of each lane, supply and demand is used, like the
+    # .iloc[0] lookups of the original loop-based builder. Rows without an
+    # excess plant (code -1) only contribute their demand.
+    has_lane = excess_codes >= 0
+    first_lane = _first_rows(low_codes, material_codes, excess_codes) & has_lane
+    first_supply = _first_rows(excess_codes, material_codes) & has_lane
+    first_demand = _first_rows(low_codes, material_codes)
+    lane_cost = low_excess_df_pd['TRANSFER_COST_PER_UNIT'].to_numpy(dtype=float)
+    lane_objective = low_excess_df_pd.get('OBJECTIVE_COST_PER_UNIT', low_excess_df_pd['TRANSFER_COST_PER_UNIT'])
+
+    build = _build_arc_model if formulation == "arc" else _build_cube_model
+    return build(
+        low_excess_df_pd,
+        low_codes=low_codes,
+        material_codes=material_codes,
+        excess_codes=excess_codes,
+        first_lane=first_lane,
+        first_supply=first_supply,
+        first_demand=first_demand,
+        low_plants=np.asarray(low_plants, dtype=object),
+        excess_plants=excess_plants,
+        materials=np.asarray(materials, dtype=object),
+        material_cost=material_cost,
+        lane_cost=lane_cost,
+        lane_objective=lane_objective.to_numpy(dtype=float),
+    )
+
+
+def _build_cube_model(low_excess_df_pd, low_codes, material_codes, excess_codes,
+                      first_lane, first_supply, first_demand,
+                      low_plants, excess_plants, materials, material_cost, lane_cost, lane_objective):
+    """
+    Variable (i, j, k) for low plant i, material j and excess plant k lives at
+    i * num_excess_plants * num_materials + j * num_excess_plants + k, with the
+    supplier as the last excess plant.
+    """
+    num_low_plants = len(low_plants)
+    num_excess_plants = len(excess_plants)
+    num_materials = len(materials)
+    num_vars = num_low_plants * num_excess_plants * num_materials
+    supplier = num_excess_plants - 1
+
+    # Variable coordinates, in the same order as the variables themselves
+    var_low, var_material, var_excess = np.unravel_index(
+        np.arange(num_vars), (num_low_plants, num_materials, num_excess_plants))
+    var_is_purchase = var_excess == supplier
+
+    # Build cost vector (c)
+    c = np.full(num_vars, IMPOSSIBLE_TRANSFER_COST)
+    c[var_is_purchase] = material_cost[var_material[var_is_purchase]]
+
+    # Cost from another plant is the transfer cost of the first matching row
+    lane_idx = np.ravel_multi_index(
+        (low_codes[first_lane], material_codes[first_lane], excess_codes[first_lane]),
+        (num_low_plants, num_materials, num_excess_plants))
+    unit_cost = c.copy()
+    c[lane_idx] = lane_objective[first_lane]
+    unit_cost[lane_idx] = lane_cost[first_lane]
+    var_is_lane = np.zeros(num_vars, dtype=bool)
+    var_is_lane[lane_idx] = True
+
+    ones = np.ones(num_vars)
+
+    # Supply Constraints (<= available_to_transfer, including supplier)
+    # One row per (material, excess plant): every low plant draws from it
+    supply_rows = var_material * num_excess_plants + var_excess
+    A_ub = sparse.csr_matrix((ones, (supply_rows, np.arange(num_vars))),
+                             shape=(num_materials * num_excess_plants, num_vars))
+    b_ub = np.zeros(num_materials * num_excess_plants)
+    b_ub[material_codes[first_supply] * num_excess_plants + excess_codes[first_supply]] = \
+        low_excess_df_pd['AVAILABLE_TO_TRANSFER'].to_numpy(dtype=float)[first_supply]
+    b_ub[np.arange(num_materials) * num_excess_plants + supplier] = SUPPLIER_CAPACITY
+
+    # Demand Constraints (= units_needed)
+    # One row per (low plant, material) summing all inbound transfers
+    demand_rows = var_low * num_materials + var_material
+    A_eq = sparse.csr_matrix((ones, (demand_rows, np.arange(num_vars))),
+                             shape=(num_low_plants * num_materials, num_vars))
+    b_eq = np.zeros(num_low_plants * num_materials)
+    b_eq[low_codes[first_demand] * num_materials + material_codes[first_demand]] = \
+        low_excess_df_pd['UNITS_NEEDED'].to_numpy(dtype=float)[first_demand]
+
+    return TransferModel(
+        c=c,
+        A_ub=A_ub,
+        b_ub=b_ub,
+        A_eq=A_eq,
+        b_eq=b_eq,
+        low_plants=low_plants,
+        excess_plants=excess_plants,
+        materials=materials,
+        material_cost=material_cost,
+        var_low=var_low,
+        var_excess=var_excess,
+        var_material=var_material,
+        var_is_purchase=var_is_purchase,
+        var_is_lane=var_is_lane,
+        unit_cost=unit_cost,
+    )
+
+
+def _build_arc_model(low_excess_df_pd, low_codes, material_codes, excess_codes,
+                     first_lane, first_supply, first_demand,
+                     low_plants, excess_plants, materials, material_cost, lane_cost, lane_objective):
+    """
+    One transfer variable per lane listed in the low/excess rows and one
+    purchase variable per (low plant, material) demand. Variables are ordered by
+    (low plant, material, excess plant) with the purchase last, which keeps the
+    action order of the cube formulation.
+    """
+    supplier = len(excess_plants) - 1
+    num_lanes = int(first_lane.sum())
+    num_demands = int(first_demand.sum())
+
+    # Decision variables: lanes first, then purchases, sorted below
+    var_low = np.concatenate([low_codes[first_lane], low_codes[first_demand]])
+    var_material = np.concatenate([material_codes[first_lane], material_codes[first_demand]])
+    var_excess = np.concatenate([excess_codes[first_lane], np.full(num_demands, supplier)])
+    c = np.concatenate([lane_objective[first_lane], material_cost[material_codes[first_demand]]])
+    unit_cost = np.concatenate([lane_cost[first_lane], material_cost[material_codes[first_demand]]])
+
+    order = np.lexsort((var_excess, var_material, var_low))
+    var_low, var_material, var_excess = var_low[order], var_material[order], var_excess[order]
+    c, unit_cost = c[order], unit_cost[order]
+    var_is_purchase = var_excess == supplier
+    num_vars = num_lanes + num_demands
+
+    # Supply Constraints (<= available_to_transfer), only for real excess plants;
+    # the supplier is uncapacitated so purchases need no row
+    supply_keys = pd.MultiIndex.from_arrays(
+        [excess_codes[first_supply], material_codes[first_supply]])
+    lane_vars = np.flatnonzero(~var_is_purchase)
+    supply_rows = supply_keys.get_indexer(
+        pd.MultiIndex.from_arrays([var_excess[lane_vars], var_material[lane_vars]]))
+    A_ub = sparse.csr_matrix((np.ones(num_lanes), (supply_rows, lane_vars)),
+                             shape=(len(supply_keys), num_vars))
+    b_ub = low_excess_df_pd['AVAILABLE_TO_TRANSFER'].to_numpy(dtype=float)[first_supply]
+
+    # Demand Constraints (= units_needed), lanes and purchase into each demand
+    demand_keys = pd.MultiIndex.from_arrays(
+        [low_codes[first_demand], material_codes[first_demand]])
+    demand_rows = demand_keys.get_indexer(pd.MultiIndex.from_arrays([var_low, var_material]))
+    A_eq = sparse.csr_matrix((np.ones(num_vars), (demand_rows, np.arange(num_vars))),
+                             shape=(num_demands, num_vars))
+    b_eq = low_excess_df_pd['UNITS_NEEDED'].to_numpy(dtype=float)[first_demand]
+
+    return TransferModel(
+        c=c,
+        A_ub=A_ub,
+        b_ub=b_ub,
+        A_eq=A_eq,
+        b_eq=b_eq,
+        low_plants=low_plants,
+        excess_plants=excess_plants,
+        materials=materials,
+        material_cost=material_cost,
+        var_low=var_low,
+        var_excess=var_excess,
+        var_material=var_material,
+        var_is_purchase=var_is_purchase,
+        var_is_lane=~var_is_purchase,
+        unit_cost=unit_cost,
+    )
+
+
+def solve_transfer_model(model: TransferModel, engine: str = "highs", duals: bool = False):
+    """Solves the transfer LP with the named engine from solver_engines.py and returns its SolveResult."""
+    return get_solver_engine(engine).solve(model, duals=duals)
+
+
+def _variable_rows(A: sparse.spmatrix) -> np.ndarray:
+    """Row of each variable in a constraint matrix with at most one entry per column, -1 for none."""
+    A = A.tocsc()
+    rows = np.full(A.shape[1], -1)
+    has_row = np.diff(A.indptr) > 0
+    rows[has_row] = A.indices[A.indptr[:-1][has_row]]
+    return rows
+
+
+def _first_variable(var_rows: np.ndarray):
+    """The constraint rows that have variables, and the first variable of each."""
+    variables = np.flatnonzero(var_rows >= 0)
+    rows, first = np.unique(var_rows[variables], return_index=True)
+    return rows, variables[first]
+
+
+def extract_sensitivity(model: TransferModel, result) -> pd.DataFrame:
+    """
+    Maps the dual values of a solve back to plants, materials and lanes.
+
+    Shadow prices follow scipy's convention: a supply's shadow price is at
+    most zero (one more available unit lowers the cost by that much), a
+    demand's is what one more needed unit costs. For unused lanes, the
+    break-even unit cost is the unit cost minus the reduced cost, where the
+    lane starts carrying flow. Used lanes get none: the duals of a degenerate
+    optimum are not unique, so they cannot tell where a used lane starts
+    losing flow (SensitivityReport.lane ranges a single lane exactly). All
+    values come from the one solve and hold for small changes; a large change
+    can move the optimum to another basis.
+
+    Args:
+        model: The solved TransferModel.
+        result: Its SolveResult, solved with duals=True.
+
+    Returns:
+        A DataFrame with SENSITIVITY_COLUMNS.
+    """
+    x = result.x
+    supplier = len(model.excess_plants) - 1
+    var_supply = _variable_rows(model.A_ub)
+    var_demand = _variable_rows(model.A_eq)
+    supply_price = np.asarray(result.marginals_ub, dtype=float)
+    demand_price = np.asarray(result.marginals_eq, dtype=float)
+
+    # Supply rows; the supplier rows and the zero rows that pad the cube formulation are not real constraints
+    rows, first = _first_variable(var_supply)
+    real = (model.var_excess[first] != supplier) & (model.b_ub[rows] > 0)
+    rows, first = rows[real], first[real]
+    supply = pd.DataFrame({
+        'kind': 'SUPPLY',
+        'source_plant_id': model.excess_plants[model.var_excess[first]],
+        'destination_plant_id': None,
+        'material_id': model.materials[model.var_material[first]],
+        'quantity': (model.A_ub @ x)[rows],
+        'capacity': model.b_ub[rows],
+        'shadow_price': supply_price[rows],
+    })
+
+    rows, first = _first_variable(var_demand)
+    real = model.b_eq[rows] > 0
+    rows, first = rows[real], first[real]
+    demand = pd.DataFrame({
+        'kind': 'DEMAND',
+        'source_plant_id': None,
+        'destination_plant_id': model.low_plants[model.var_low[first]],
+        'material_id': model.materials[model.var_material[first]],
+        'quantity': model.b_eq[rows],
+        'capacity': model.b_eq[rows],
+        'shadow_price': demand_price[rows],
+    })
+
+    reduced_cost = np.asarray(result.reduced_costs, dtype=float)
+    lanes = np.flatnonzero((model.var_is_lane | model.var_is_purchase) & (model.b_eq[var_demand] > 0))
+    is_purchase = model.var_is_purchase[lanes]
+    used = np.round(x[lanes], 2) > 0
+    routes = pd.DataFrame({
+        'kind': np.where(is_purchase, 'PURCHASE', 'TRANSFER'),
+        'source_plant_id': model.excess_plants[model.var_excess[lanes]],
+        'destination_plant_id': model.low_plants[model.var_low[lanes]],
+        'material_id': model.materials[model.var_material[lanes]],
+        'quantity': np.round(x[lanes], 2) + 0.0,
+        'unit_cost': model.c[lanes],
+        'reduced_cost': reduced_cost[lanes],
+        'break_even_unit_cost': np.where(used, np.nan, model.c[lanes] - reduced_cost[lanes]),
+    })
+    return pd.concat([supply, demand, routes], ignore_index=True).reindex(columns=SENSITIVITY_COLUMNS)
+
+
+def extract_transfer_actions(model: TransferModel, x: np.ndarray) -> pd.DataFrame:
+    """
+    Turns a solution vector into transfer and purchase actions.
+
+    Quantities are rounded to cents; variables that round to zero are dropped, as
+    are flows on transfers that have no matching low/excess row. Costs and
+    savings use the real unit cost, without objective-only penalties.
+    """
+    transfer_quantity = np.round(x, 2)
+    keep = (transfer_quantity > 0) & (model.var_is_purchase | model.var_is_lane)
+    keep_idx = np.flatnonzero(keep)
+
+    quantity = transfer_quantity[keep_idx]
+    is_purchase = model.var_is_purchase[keep_idx]
+    cost_per_unit = (model.c if model.unit_cost is None else model.unit_cost)[keep_idx]
+    material_cost = model.material_cost[model.var_material[keep_idx]]
+
+    return pd.DataFrame({
+        'action_type': np.where(is_purchase, 'PURCHASE', 'TRANSFER'),
+        'source_plant_id': model.excess_plants[model.var_excess[keep_idx]],
+        'destination_plant_id': model.low_plants[model.var_low[keep_idx]],
+        'material_id': model.materials[model.var_material[keep_idx]],
+        'transfer_quantity': quantity,
+        'transfer_cost': quantity * cost_per_unit,
+        'savings': np.where(is_purchase, 0.00, quantity * (material_cost - cost_per_unit)),
+        'transfer_id': [str(uuid.uuid4()) for _ in range(len(keep_idx))],
+        'transfer_date': pd.to_datetime('today').normalize(),
+    }, columns=TRANSFER_ACTION_COLUMNS)
+
+
+def _solve_partition(low_excess_df_pd: pd.DataFrame, formulation: str, engine: str,
+                     sensitivity: bool = False) -> OptimizationResult:
+    """Builds, solves and extracts one independent subproblem."""
+    start = time.perf_counter()
+    model = build_transfer_model(low_excess_df_pd, formulation)
+    built = time.perf_counter()
+    result = solve_transfer_model(model, engine, duals=sensitivity)
+    solved = time.perf_counter()
+
+    solver_stats = {
+        'engine': result.engine,  # The engine that solved it, which may be the requested engine's fallback
+        'formulation': formulation,
+        'subproblems': 1,
+        'fallback_subproblems': int(result.engine != engine),
+        'variables': model.num_vars,
+        'constraints': model.A_ub.shape[0] + model.A_eq.shape[0],
+        'nonzeros': model.A_ub.nnz + model.A_eq.nnz,
+        'iterations': int(result.nit or 0),
+        'build_seconds': built - start,
+        'solve_seconds': solved - built,
+    }
+    if result.status != 0:
+        return OptimizationResult(result.status, result.message, solver_stats=solver_stats)
+    return OptimizationResult(result.status, result.message, extract_transfer_actions(model, result.x), solver_stats,
+                              extract_sensitivity(model, result) if sensitivity else None)
+
+
+def _check_partitions(low_excess_df_pd: pd.DataFrame, partition_by: list):
+    """Materials are the only thing linking constraints, so a partition may not split one."""
+    if 'MATERIAL_ID' in partition_by:
+        return
+    split = low_excess_df_pd.groupby('MATERIAL_ID', sort=False)[partition_by].nunique(dropna=False).max(axis=1) > 1
+    if split.any():
+        raise ValueError(f"Partitioning by {partition_by} splits material(s) "
+                         f"{split[split].index.tolist()} across subproblems")
+
+
+def _sort_like_monolithic(low_excess_df_pd: pd.DataFrame, transfer_actions: pd.DataFrame) -> pd.DataFrame:
+    """Orders merged actions by (low plant, material, source) as a single solve would."""
+    low_plants = pd.Index(low_excess_df_pd['LOW_PLANT_ID'].unique())
+    materials = pd.Index(low_excess_df_pd['MATERIAL_ID'].unique())
+    excess_plants = pd.Index(low_excess_df_pd['EXCESS_PLANT_ID'].unique())
+
+    source = excess_plants.get_indexer(transfer_actions['source_plant_id'])
+    source[(transfer_actions['action_type'] == 'PURCHASE').to_numpy()] = len(excess_plants)
+    order = np.lexsort((
+        source,
+        materials.get_indexer(transfer_actions['material_id']),
+        low_plants.get_indexer(transfer_actions['destination_plant_id']),
+    ))
+    return transfer_actions.iloc[order].reset_index(drop=True)
+
+
+def solve_transfers(low_excess_df_pd: pd.DataFrame, formulation: str = "arc", engine: str = "highs",
+                    partition_by=None, max_workers: int = None, executor: str = "process",
+                    sensitivity: bool = False):
+    """
+    Solves the transfer problem, optionally split into independent subproblems.
+
+    Supply and demand constraints are all indexed by material, so the problem
+    decomposes into one LP per material (or per group of materials, e.g. per
+    BUSINESS_LINE). The subproblems are solved concurrently and their actions
+    merged back in the order a single solve would produce.
+
+    Args:
+        low_excess_df_pd: The result of LOW_EXCESS_QUERY with TRANSFER_COST_PER_UNIT, as a pandas DataFrame.
+        formulation: Passed through to build_transfer_model.
+        engine: Solver engine name, "highs" or "min_cost_flow".
+        partition_by: Column name or list of column names to split on, e.g.
+            "MATERIAL_ID" or "BUSINESS_LINE". None solves a single LP.
+        max_workers: Size of the worker pool, defaults to the number of CPUs.
+            With one worker, or fewer than PARALLEL_MIN_LANES rows, the
+            subproblems are solved in the calling thread.
+        executor: "process" for a process pool or "thread" for a thread pool.
+        sensitivity: Also return shadow prices and lane reduced costs
+            (see extract_sensitivity). They come from HiGHS, so an engine
+            without dual values hands the subproblems to HiGHS.
+
+    Returns:
+        An OptimizationResult. solver_stats['engine'] names the engine(s)
+        that actually solved the subproblems, and 'fallback_subproblems'
+        counts those the requested engine handed to its fallback. status is
+        0 on success, otherwise transfer_actions is None and message says
+        which subproblem failed.
+    """
+    start = time.perf_counter()
+    if partition_by is None:
+        result = _solve_partition(low_excess_df_pd, formulation, engine, sensitivity)
+        result.solver_stats['wall_seconds'] = time.perf_counter() - start
+        return result
+
+    partition_by = [partition_by] if isinstance(partition_by, str) else list(partition_by)
+    _check_partitions(low_excess_df_pd, partition_by)
+
+    keys, frames = zip(*low_excess_df_pd.groupby(partition_by, sort=False, dropna=False))
+
+    workers = min(max_workers or os.cpu_count() or 1, len(frames))
+    if workers == 1 or len(low_excess_df_pd) < PARALLEL_MIN_LANES:
+        solutions = [_solve_partition(frame, formulation, engine, sensitivity) for frame in frames]
+    else:
+        pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            # Batch the many small material LPs so process overhead stays low
+            chunksize = max(1, len(frames) // (4 * workers)) if executor == "process" else 1
+            solutions = list(pool.map(_solve_partition, frames, repeat(formulation), repeat(engine),
+                                      repeat(sensitivity), chunksize=chunksize))
+
+    # Counts and timings add up across subproblems; solve_seconds is CPU time
+    # summed over workers while wall_seconds is what the caller waited
+    solver_stats = {
+        'engine': ", ".join(sorted({solution.solver_stats['engine'] for solution in solutions})),
+        'formulation': formulation,
+        'partition_by': partition_by,
+    }
+    for key in ('subproblems', 'fallback_subproblems', 'variables', 'constraints', 'nonzeros', 'iterations',
+                'build_seconds', 'solve_seconds'):
+        solver_stats[key] = sum(solution.solver_stats[key] for solution in solutions)
+    solver_stats['wall_seconds'] = time.perf_counter() - start
+
+    for key, solution in zip(keys, solutions):
+        if solution.status != 0:
+            return OptimizationResult(solution.status, f"Subproblem {dict(zip(partition_by, key))}: {solution.message}",
+                                      solver_stats=solver_stats)
+
+    transfer_actions = pd.concat([solution.transfer_actions for solution in solutions], ignore_index=True)
+    result = OptimizationResult(0, "Optimization terminated successfully.",
+                                _sort_like_monolithic(low_excess_df_pd, transfer_actions), solver_stats)
+    if sensitivity:
+        result.sensitivity = pd.concat([solution.sensitivity for solution in solutions], ignore_index=True)
+    return result
+
+
+def reoptimize_changed_materials(low_excess_df_pd: pd.DataFrame, previous: PlanSnapshot, changed_materials,
+                                 formulation: str = "arc", engine: str = "highs", max_workers: int = None,
+                                 executor: str = "process", sensitivity: bool = False) -> OptimizationResult:
+    """
+    Re-solves only the materials whose inventory changed and keeps the previous
+    plan for all others.
+
+    Materials never share a constraint, so the subproblem of a material whose
+    rows did not change has the same optimal solution as before and its
+    previous actions are reused as they are. Materials that entered or left
+    the low/excess rows since the previous plan are re-solved as well, since
+    deleted rows leave no LAST_UPDATED_TIMESTAMP behind. Re-optimized actions
+    that match a previous action on TRANSFER_ACTION_KEY keep its transfer_id.
+
+    Args:
+        low_excess_df_pd: The current result of LOW_EXCESS_QUERY.
+        previous: The plan to update.
+        changed_materials: Materials with inventory rows updated since
+            previous.data_version, e.g. from CHANGED_MATERIALS_QUERY.
+        formulation, engine, max_workers, executor, sensitivity: As for
+            solve_transfers. Sensitivity rows of unchanged materials are
+            kept from the previous plan, if it has them.
+
+    Returns:
+        An OptimizationResult with the complete updated plan. solver_stats
+        counts only the re-solved subproblems and lists the re-solved
+        materials under 'changed_materials'.
+    """
+    start = time.perf_counter()
+    current_materials = frozenset(low_excess_df_pd['MATERIAL_ID'].unique())
+    changed = (frozenset(changed_materials) | (current_materials ^ previous.materials))
+    changed_list = sorted(changed)
+
+    kept = previous.transfer_actions[~previous.transfer_actions['material_id'].isin(changed_list)]
+    rows = low_excess_df_pd[low_excess_df_pd['MATERIAL_ID'].isin(changed_list)]
+    if rows.empty:
+        result = OptimizationResult(0, "Optimization terminated successfully.",
+                                    pd.DataFrame(columns=TRANSFER_ACTION_COLUMNS),
+                                    {'engine': engine, 'formulation': formulation, 'subproblems': 0},
+                                    pd.DataFrame(columns=SENSITIVITY_COLUMNS) if sensitivity else None)
+    else:
+        result = solve_transfers(rows, formulation=formulation, engine=engine, partition_by="MATERIAL_ID",
+                                 max_workers=max_workers, executor=executor, sensitivity=sensitivity)
+    result.solver_stats.update({
+        'incremental': True,
+        'changed_materials': changed_list,
+        'wall_seconds': time.perf_counter() - start,
+    })
+    if result.status != 0:
+        return result
+
+    resolved = _keep_transfer_ids(result.transfer_actions, previous.transfer_actions)
+    result.transfer_actions = _sort_like_monolithic(low_excess_df_pd,
+                                                    pd.concat([kept, resolved], ignore_index=True))
+    if result.sensitivity is not None and previous.sensitivity is not None:
+        previous_sensitivity = previous.sensitivity[~previous.sensitivity['material_id'].isin(changed_list)]
+        result.sensitivity = pd.concat([previous_sensitivity, result.sensitivity], ignore_index=True)
+    return result
+
+
+def _keep_transfer_ids(transfer_actions: pd.DataFrame, previous_actions: pd.DataFrame) -> pd.DataFrame:
+    if transfer_actions.empty or previous_actions.empty:
+        return transfer_actions
+    previous_ids = previous_actions.set_index(TRANSFER_ACTION_KEY)['transfer_id']
+    matched = previous_ids.reindex(pd.MultiIndex.from_frame(transfer_actions[TRANSFER_ACTION_KEY])).to_numpy()
+    transfer_actions = transfer_actions.copy()
+    transfer_actions['transfer_id'] = np.where(pd.isna(matched), transfer_actions['transfer_id'], matched)
+    return transfer_actions
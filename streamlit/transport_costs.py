@@ -0,0 +1,88 @@
+"""
+Transfer cost per unit between plants.
+
+A transfer costs TRANSFER_COST_RATE times the material cost, times the
+surcharge of the lane in TRANSPORT_COST_SURCHARGE, or
+DEFAULT_TRANSPORT_SURCHARGE for lanes without a row. TransportCostModel loads
+the surcharge table once into a dense plant-by-plant array, so the optimizer,
+the scenario sweep and the replenishment planner price any number of lanes
+with one vectorized lookup instead of joining the table in every query.
+"""
+import numpy as np
+import pandas as pd
+
+TRANSFER_COST_RATE = 0.3  # Transfer cost per unit as a share of the material cost, before the surcharge
+DEFAULT_TRANSPORT_SURCHARGE = 1.5  # For lanes without a TRANSPORT_COST_SURCHARGE row
+
+SURCHARGE_QUERY = """
+    SELECT source_facility_id, destination_facility_id, transport_cost_surcharge
+    FROM supply_chain_network_optimization_db.entities.transport_cost_surcharge
+    """
+
+# Changes whenever a surcharge row is added, removed or updated
+SURCHARGE_VERSION_QUERY = """
+    SELECT HASH_AGG(source_facility_id, destination_facility_id, transport_cost_surcharge)
+    FROM supply_chain_network_optimization_db.entities.transport_cost_surcharge
+    """
+
+
+def _plant_keys(plant_ids) -> pd.Index:
+    """
+    Plant IDs as float64 keys, so 1001, 1001.0, Decimal("1001") and "1001"
+    match no matter how the surcharge and lane rows were typed when read.
+    IDs that are not numbers become NaN and never match.
+    """
+    return pd.Index(pd.to_numeric(pd.Series(plant_ids, copy=False), errors='coerce').to_numpy(dtype=float))
+
+
+class TransportCostModel:
+    """
+    Dense surcharge matrix with a plant ID to row/column index.
+
+    Args:
+        surcharge_df_pd: The result of SURCHARGE_QUERY. If a lane has several
+            rows, the last one wins.
+        version: The SURCHARGE_VERSION_QUERY value the rows were read at.
+    """
+
+    def __init__(self, surcharge_df_pd: pd.DataFrame, version: str = None):
+        source = _plant_keys(surcharge_df_pd['SOURCE_FACILITY_ID'])
+        destination = _plant_keys(surcharge_df_pd['DESTINATION_FACILITY_ID'])
+        # Rows whose IDs are not numbers could never be looked up
+        valid = ~(source.isna() | destination.isna())
+        source, destination = source[valid], destination[valid]
+        self.plant_ids = source.append(destination).unique()
+        self.version = version
+        # One extra row and column of defaults: get_indexer maps unknown plants to -1, the last one
+        self.surcharge = np.full((len(self.plant_ids) + 1, len(self.plant_ids) + 1), DEFAULT_TRANSPORT_SURCHARGE)
+        self.surcharge[self.plant_ids.get_indexer(source), self.plant_ids.get_indexer(destination)] = \
+            surcharge_df_pd['TRANSPORT_COST_SURCHARGE'].to_numpy(dtype=float)[valid]
+
+    @classmethod
+    def from_session(cls, session, version: str = None) -> "TransportCostModel":
+        return cls(session.sql(SURCHARGE_QUERY).to_pandas(), version)
+
+    def surcharges(self, source_plant_ids, destination_plant_ids) -> np.ndarray:
+        """Surcharge of every (source, destination) lane; plants without any surcharge row get the default."""
+        return self.surcharge[self.plant_ids.get_indexer(_plant_keys(source_plant_ids)),
+                              self.plant_ids.get_indexer(_plant_keys(destination_plant_ids))]
+
+    def transfer_costs(self, material_cost, source_plant_ids, destination_plant_ids,
+                       surcharge_multiplier: float = 1.0) -> np.ndarray:
+        """Transfer cost per unit of every lane."""
+        return (np.asarray(material_cost, dtype=float) * TRANSFER_COST_RATE
+                * self.surcharges(source_plant_ids, destination_plant_ids) * surcharge_multiplier)
+
+    def add_transfer_costs(self, lanes_df_pd: pd.DataFrame, source: str = 'EXCESS_PLANT_ID',
+                           destination: str = 'LOW_PLANT_ID', surcharge_multiplier: float = 1.0) -> pd.DataFrame:
+        """
+        The lanes with TRANSFER_COST_PER_UNIT set from their MATERIAL_COST.
+
+        Args:
+            lanes_df_pd: Rows with MATERIAL_COST and plant ID columns, e.g. the
+                result of LOW_EXCESS_QUERY.
+            source, destination: Names of the plant ID columns.
+            surcharge_multiplier: Applied to every lane's surcharge.
+        """
+        return lanes_df_pd.assign(TRANSFER_COST_PER_UNIT=self.transfer_costs(
+            lanes_df_pd['MATERIAL_COST'], lanes_df_pd[source], lanes_df_pd[destination], surcharge_multiplier))
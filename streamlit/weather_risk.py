@@ -0,0 +1,214 @@
+"""
+Weather disruption risk of plants and transfer lanes.
+
+Plants are matched to the forecast cities of CITY_DAILY_IMPERIAL with a
+nearest-neighbour index. Coordinates are turned into unit vectors on the
+sphere and indexed with a scipy cKDTree: the straight-line (chord) distance
+between unit vectors grows with the great-circle distance, so the nearest
+cities by chord are the nearest by haversine distance, and every plant is
+matched in one bulk query. The index depends only on city locations, so it is
+built once and reused for every new forecast.
+
+Each forecast day is scored for precipitation, snow, ice and wind gusts, a
+city's risk is its worst day in the forecast window, and a plant's risk is the
+distance-weighted risk of its nearest cities. A lane is disrupted if either
+end is, and apply_lane_risk turns that into a penalty the optimizer weighs
+against other lanes, or excludes the lane.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_MILES = 3958.8
+NEAREST_CITIES = 3  # Forecast cities blended into a plant's risk
+MAX_CITY_DISTANCE_MILES = 150  # Cities farther away say nothing about a plant's weather
+
+# Daily forecast values at which a hazard starts to matter and at which it is
+# treated as a certain disruption, with a linear ramp in between (imperial units)
+HAZARD_THRESHOLDS = {
+    'PRECIPITATION_LWE_TOTAL': (1.0, 3.0),  # inches
+    'SNOW_TOTAL': (2.0, 8.0),  # inches
+    'ICE_LWE_TOTAL': (0.05, 0.5),  # inches
+    'WIND_GUST_MAX': (40.0, 70.0),  # mph
+}
+
+LANE_RISK_COST_WEIGHT = 1.0  # A lane with risk 1 weighs (1 + weight) times its cost per unit in the objective
+LANE_RISK_EXCLUSION = 0.8  # Lanes at or above this risk are not used at all
+FORECAST_DAYS = 7  # Days from today a disruption can affect transfers planned now
+
+PLANT_LOCATION_QUERY = """
+    SELECT mfg_plant_id, latitude, longitude
+    FROM supply_chain_network_optimization_db.entities.mfg_plant
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """
+
+FORECAST_CITY_QUERY = """
+    SELECT DISTINCT country_code, admin_code, city_name, latitude, longitude
+    FROM supply_chain_network_optimization_db.weather.city_daily_imperial
+    """
+
+# Day and night rows of the forecast window are both kept; a city's risk is its worst row
+FORECAST_QUERY = f"""
+    SELECT
+        country_code,
+        admin_code,
+        city_name,
+        date,
+        precipitation_lwe_total,
+        snow_total,
+        ice_lwe_total,
+        wind_gust_max
+    FROM
+        supply_chain_network_optimization_db.weather.city_daily_imperial
+    WHERE date >= CURRENT_DATE() AND date < CURRENT_DATE() + {FORECAST_DAYS}
+    """
+
+CITY_KEY = ['COUNTRY_CODE', 'ADMIN_CODE', 'CITY_NAME']
+
+
+def _unit_vectors(latitude, longitude) -> np.ndarray:
+    latitude = np.radians(np.asarray(latitude, dtype=float))
+    longitude = np.radians(np.asarray(longitude, dtype=float))
+    return np.column_stack([np.cos(latitude) * np.cos(longitude),
+                            np.cos(latitude) * np.sin(longitude),
+                            np.sin(latitude)])
+
+
+class WeatherIndex:
+    """
+    Nearest forecast cities of any set of coordinates.
+
+    Args:
+        cities_df_pd: The result of FORECAST_CITY_QUERY.
+    """
+
+    def __init__(self, cities_df_pd: pd.DataFrame):
+        self.cities = cities_df_pd.drop_duplicates(CITY_KEY).reset_index(drop=True)
+        self._tree = cKDTree(_unit_vectors(self.cities['LATITUDE'], self.cities['LONGITUDE']))
+
+    def __len__(self):
+        return len(self.cities)
+
+    def nearest(self, latitude, longitude, k: int = NEAREST_CITIES):
+        """
+        The k nearest cities of every coordinate.
+
+        Returns:
+            (positions, distances): (n, k) arrays of rows of self.cities and
+            great-circle distances in miles, nearest first.
+        """
+        k = min(k, len(self.cities))
+        chord, positions = self._tree.query(_unit_vectors(latitude, longitude), k=k)
+        chord, positions = chord.reshape(-1, k), positions.reshape(-1, k)
+        return positions, 2 * EARTH_RADIUS_MILES * np.arcsin(np.clip(chord / 2, 0, 1))
+
+    def city_risk(self, forecast_df_pd: pd.DataFrame) -> pd.DataFrame:
+        """
+        Risk of every indexed city from a forecast: the worst day's score and the
+        hazard driving it. Cities without forecast rows have risk 0.
+
+        Args:
+            forecast_df_pd: The result of FORECAST_QUERY, for the days to plan for.
+        """
+        scores = pd.DataFrame({
+            hazard: np.clip((pd.to_numeric(forecast_df_pd[hazard], errors='coerce').fillna(0).to_numpy() - low)
+                            / (high - low), 0, 1)
+            for hazard, (low, high) in HAZARD_THRESHOLDS.items()
+        })
+        # Independent hazards: the day is disrupted unless every one of them passes
+        day_risk = 1 - (1 - scores).prod(axis=1)
+        days = forecast_df_pd[CITY_KEY].assign(RISK=day_risk.to_numpy(), DRIVER=scores.idxmax(axis=1).to_numpy(),
+                                               DATE=forecast_df_pd['DATE'].to_numpy())
+        worst = days.sort_values('RISK', ascending=False, kind='stable').drop_duplicates(CITY_KEY)
+        risk = self.cities.merge(worst, how='left', on=CITY_KEY)
+        risk['RISK'] = risk['RISK'].fillna(0.0)
+        risk.loc[risk['RISK'] == 0, ['DRIVER', 'DATE']] = None
+        return risk
+
+    def plant_risk(self, plants_df_pd: pd.DataFrame, city_risk: pd.DataFrame, k: int = NEAREST_CITIES,
+                   max_distance: float = MAX_CITY_DISTANCE_MILES) -> pd.DataFrame:
+        """
+        Inverse-distance weighted risk of the nearest cities of every plant.
+
+        Args:
+            plants_df_pd: The result of PLANT_LOCATION_QUERY.
+            city_risk: The result of city_risk, aligned with self.cities.
+            k: Number of nearest cities to blend.
+            max_distance: Cities farther away than this many miles are ignored;
+                plants without a city in range get risk 0.
+
+        Returns:
+            MFG_PLANT_ID, RISK, NEAREST_CITY and NEAREST_CITY_MILES per plant.
+        """
+        positions, distances = self.nearest(plants_df_pd['LATITUDE'], plants_df_pd['LONGITUDE'], k)
+        weights = np.where(distances <= max_distance, 1 / np.maximum(distances, 1.0), 0.0)
+        risk = city_risk['RISK'].to_numpy(dtype=float)[positions]
+        total = weights.sum(axis=1)
+        return pd.DataFrame({
+            'MFG_PLANT_ID': plants_df_pd['MFG_PLANT_ID'].to_numpy(),
+            'RISK': np.divide((weights * risk).sum(axis=1), total, out=np.zeros(len(total)), where=total > 0),
+            'NEAREST_CITY': self.cities['CITY_NAME'].to_numpy()[positions[:, 0]],
+            'NEAREST_CITY_MILES': distances[:, 0],
+        })
+
+
+@dataclass
+class LaneRisk:
+    plants: pd.DataFrame  # Result of WeatherIndex.plant_risk
+    cities: pd.DataFrame  # Result of WeatherIndex.city_risk
+
+    def lanes(self, source_plant_ids, destination_plant_ids) -> np.ndarray:
+        """Probability-style risk that either end of each lane is disrupted."""
+        plant_risk = self.plants.set_index('MFG_PLANT_ID')['RISK']
+        source = plant_risk.reindex(source_plant_ids).fillna(0).to_numpy()
+        destination = plant_risk.reindex(destination_plant_ids).fillna(0).to_numpy()
+        return 1 - (1 - source) * (1 - destination)
+
+
+def assess_lane_risk(index: WeatherIndex, plants_df_pd: pd.DataFrame, forecast_df_pd: pd.DataFrame) -> LaneRisk:
+    """City, plant and (through LaneRisk.lanes) lane risk for one forecast."""
+    cities = index.city_risk(forecast_df_pd)
+    return LaneRisk(index.plant_risk(plants_df_pd, cities), cities)
+
+
+def apply_lane_risk(low_excess_df_pd: pd.DataFrame, lane_risk: LaneRisk, cost_weight: float = LANE_RISK_COST_WEIGHT,
+                    exclusion: float = LANE_RISK_EXCLUSION) -> pd.DataFrame:
+    """
+    Adds LANE_DISRUPTION_RISK to the low/excess rows, and an
+    OBJECTIVE_COST_PER_UNIT of TRANSFER_COST_PER_UNIT * (1 + cost_weight * risk)
+    that the optimizer minimizes instead. TRANSFER_COST_PER_UNIT stays the real
+    cost, so planned actions report what they will actually cost.
+
+    Lanes at or above exclusion are dropped. A demand that loses all of its
+    lanes keeps one row without an excess plant, so it is still covered by a
+    purchase.
+
+    Args:
+        low_excess_df_pd: Rows with the columns of LOW_EXCESS_QUERY.
+        lane_risk: The result of assess_lane_risk.
+        cost_weight: Relative objective increase of a lane with risk 1.
+        exclusion: Risk from which a lane is excluded; None keeps every lane.
+    """
+    risk = lane_risk.lanes(low_excess_df_pd['EXCESS_PLANT_ID'], low_excess_df_pd['LOW_PLANT_ID'])
+    lanes = low_excess_df_pd.assign(
+        OBJECTIVE_COST_PER_UNIT=low_excess_df_pd['TRANSFER_COST_PER_UNIT'].to_numpy(dtype=float)
+        * (1 + cost_weight * risk),
+        LANE_DISRUPTION_RISK=np.round(risk, 3))
+    if exclusion is None:
+        return lanes
+
+    excluded = risk >= exclusion
+    demand = ['LOW_PLANT_ID', 'MATERIAL_ID']
+    stranded = lanes[excluded].drop_duplicates(demand)
+    stranded = stranded[~stranded.set_index(demand).index.isin(lanes[~excluded].set_index(demand).index)]
+    lane_columns = [column for column in ['EXCESS_PLANT_ID', 'EXCESS_PLANT_NAME', 'AVAILABLE_TO_TRANSFER',
+                                          'TRANSFER_COST_PER_UNIT', 'OBJECTIVE_COST_PER_UNIT', 'LANE_DISRUPTION_RISK']
+                    if column in lanes.columns]
+    stranded = stranded.assign(**{column: np.nan for column in lane_columns})
+    # Keep the row order of the input, with each stranded demand where its first lane was
+    lanes = pd.concat([lanes[~excluded], stranded]).sort_index(kind='stable').reset_index(drop=True)
+    if pd.api.types.is_integer_dtype(low_excess_df_pd['EXCESS_PLANT_ID']):
+        lanes['EXCESS_PLANT_ID'] = lanes['EXCESS_PLANT_ID'].astype("Int64")
+    return lanes
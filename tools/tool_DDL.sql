@@ -303,4 +303,113 @@ def get_page(weburl):
   response = requests.get(url)
   soup = BeautifulSoup(response.text)
   return soup.get_text()
-';
\ No newline at end of file
+';
+
+
+
+
+
+-- Optimize_Transfers Tool Description:
+
+-- PROCEDURE/FUNCTION DETAILS:
+-- Type: Stored Procedure
+-- Language: Python 3.10
+-- Signature: OPTIMIZE_TRANSFERS_SP(engine STRING DEFAULT 'min_cost_flow', partition_by STRING DEFAULT 'MATERIAL_ID', sensitivity BOOLEAN DEFAULT FALSE)
+-- Returns: VARCHAR (specifically, a JSON-formatted string)
+-- Execution: OWNER's Rights
+-- Volatility: VOLATILE
+-- Primary Function: Solves the plant-to-plant material transfer problem and writes the plan to TRANSFER_ACTIONS and, on request, its shadow prices to TRANSFER_SENSITIVITY.
+-- Dependencies: Requires transfer_optimizer.py, solver_engines.py and transport_costs.py (from the /streamlit/ folder) in the CODE_STAGE stage, and the scipy package.
+
+-- Error Handling: Returns a JSON object with a non-zero "status" and a "message" when the linear program cannot be solved; TRANSFER_ACTIONS is left unchanged in that case. SQL and write errors are raised as procedure errors.
+
+-- DESCRIPTION:
+-- This Python-based stored procedure runs the same optimizer as the Optimization page of the Streamlit app, but next to the data. It reads the low/excess inventory rows with LOW_EXCESS_QUERY, prices every lane from the TRANSPORT_COST_SURCHARGE matrix, builds and solves one linear program per material (or per value of PARTITION_BY) with the HiGHS solver or a dedicated min-cost-flow engine, and overwrites TRANSFER_ACTIONS with the resulting transfers and purchases. With SENSITIVITY set to TRUE, the shadow prices of every supply and demand and the reduced cost of every lane go to TRANSFER_SENSITIVITY, where the Streamlit page answers what-if questions from them; without it, TRANSFER_SENSITIVITY is dropped so it never describes an older plan. Dual values come from HiGHS, so a sensitivity run solves every subproblem with HiGHS even if ENGINE is 'min_cost_flow'. Neither the inventory rows nor the plan leave Snowflake, so the solve can run on a larger warehouse than the app, and the Streamlit page only starts the procedure and waits for its summary.
+
+-- The returned JSON contains the solver status and message, the plan KPIs (transfers, purchases, total_spend, total_savings) and solver statistics such as the number of variables, nonzeros and solver iterations, plus the time spent reading, solving and writing.
+
+-- USAGE SCENARIOS:
+-- Streamlit App: The Optimization page calls the procedure asynchronously when "Solve in the warehouse" is selected and renders the plan from TRANSFER_ACTIONS.
+-- Scheduled Re-planning: Wrap the call in a task to refresh the plan on a schedule, for example:
+--   CREATE OR REPLACE TASK SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.OPTIMIZE_TRANSFERS_TASK
+--     WAREHOUSE = SCNO_WH SCHEDULE = 'USING CRON 0 6 * * * UTC'
+--     AS CALL SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.OPTIMIZE_TRANSFERS_SP();
+-- AI Agent Orchestration: An agent can re-plan transfers after answering inventory questions and report the KPIs from the returned JSON.
+
+
+
+CREATE OR REPLACE PROCEDURE SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.OPTIMIZE_TRANSFERS_SP("ENGINE" VARCHAR DEFAULT 'min_cost_flow', "PARTITION_BY" VARCHAR DEFAULT 'MATERIAL_ID', "SENSITIVITY" BOOLEAN DEFAULT FALSE)
+RETURNS VARCHAR
+LANGUAGE PYTHON
+RUNTIME_VERSION = '3.10'
+PACKAGES = ('snowflake-snowpark-python','pandas','numpy','scipy')
+IMPORTS = ('@SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.CODE_STAGE/transfer_optimizer.py', '@SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.CODE_STAGE/solver_engines.py', '@SUPPLY_CHAIN_NETWORK_OPTIMIZATION_DB.ENTITIES.CODE_STAGE/transport_costs.py')
+HANDLER = 'main'
+EXECUTE AS OWNER
+AS '
+import json
+import time
+
+from transfer_optimizer import LOW_EXCESS_QUERY, solve_transfers
+from transport_costs import TransportCostModel
+
+TRANSFER_ACTIONS_TABLE = "supply_chain_network_optimization_db.entities.transfer_actions"
+TRANSFER_SENSITIVITY_TABLE = "supply_chain_network_optimization_db.entities.transfer_sensitivity"
+
+
+def main(session, engine: str, partition_by: str, sensitivity: bool) -> str:
+    """
+    Solves the transfer problem inside Snowflake and overwrites TRANSFER_ACTIONS,
+    and TRANSFER_SENSITIVITY if asked to; otherwise TRANSFER_SENSITIVITY is dropped.
+
+    Args:
+        session: The Snowflake session object.
+        engine: Solver engine, "min_cost_flow" or "highs".
+        partition_by: Column to split the problem on, e.g. "MATERIAL_ID" or
+            "BUSINESS_LINE". NULL or an empty string solves a single LP.
+        sensitivity: Also compute and save shadow prices and lane reduced
+            costs. They need HiGHS, which then replaces the min-cost-flow engine.
+
+    Returns:
+        A JSON string with the status, message, KPIs and solver statistics.
+    """
+    # --- 1. Read the low/excess inventory rows ---
+    start = time.perf_counter()
+    low_excess_df_pd = session.sql(LOW_EXCESS_QUERY.replace(";", "")).to_pandas()
+    low_excess_df_pd = TransportCostModel.from_session(session).add_transfer_costs(low_excess_df_pd)
+    read = time.perf_counter()
+
+    if low_excess_df_pd.empty:
+        return json.dumps({"status": 0, "message": "No transfer opportunities found.", "transfer_actions": 0})
+
+    # --- 2. Solve, one subproblem per partition ---
+    # Stored procedures cannot reliably start worker processes, so the subproblems share a thread pool
+    result = solve_transfers(low_excess_df_pd, engine=engine, partition_by=partition_by or None, executor="thread",
+                             sensitivity=bool(sensitivity))
+    solved = time.perf_counter()
+    summary = {
+        "status": int(result.status),
+        "message": result.message,
+        "solver_stats": result.solver_stats,
+        "read_seconds": read - start,
+    }
+    if result.status != 0:
+        return json.dumps(summary, default=str)
+
+    # --- 3. Write the plan next to the data ---
+    if not result.transfer_actions.empty:
+        session.create_dataframe(result.transfer_actions).write.mode("overwrite").save_as_table(TRANSFER_ACTIONS_TABLE)
+    if result.sensitivity is not None:
+        session.create_dataframe(result.sensitivity).write.mode("overwrite").save_as_table(TRANSFER_SENSITIVITY_TABLE)
+    else:
+        # Sensitivity of an older plan would answer what-if questions about this one
+        session.sql(f"DROP TABLE IF EXISTS {TRANSFER_SENSITIVITY_TABLE}").collect()
+    summary.update({
+        "message": f"Successfully created {len(result.transfer_actions)} transfer actions.",
+        "transfer_actions": len(result.transfer_actions),
+        "kpis": result.kpis,
+        "solve_seconds": solved - read,
+        "write_seconds": time.perf_counter() - solved,
+    })
+    return json.dumps(summary, default=str)
+';
@@ -5,13 +5,14 @@ USE SCHEMA WEATHER;
 
 -- Update weather forecast dates to be recent and current
 -- This script adjusts the weather data dates to reflect the current time period
--- similar to how the supply chain data dates are updated
+-- similar to how the supply chain data dates are updated. The forecast starts
+-- today, so the "next N days" queries below and the app see the whole storm.
 
 UPDATE CITY_DAILY_IMPERIAL
 SET DATE = DATEADD(
     days, (
         SELECT 
-            DATEDIFF(day, MAX(DATE), CURRENT_DATE())
+            DATEDIFF(day, MIN(DATE), CURRENT_DATE())
         FROM 
             CITY_DAILY_IMPERIAL
     ),